@@ -0,0 +1,50 @@
+import argparse
+import time
+
+from PIL import Image, ImageDraw
+
+from grid_marker import DEFAULT_STYLE, apply_grid_overlay, draw_grid, grid_layer
+
+# Per-frame overlay cost: redrawing every label (old path) vs compositing the cached layer
+
+
+def redraw_overlay(image: Image.Image, rows: int, cols: int) -> Image.Image:
+    image = image.copy()
+    draw_grid(ImageDraw.Draw(image), image.width, image.height, rows, cols, DEFAULT_STYLE)
+    return image
+
+
+def time_per_frame(fn, image: Image.Image, frames: int) -> float:
+    start = time.perf_counter()
+    for _ in range(frames):
+        fn(image)
+    return (time.perf_counter() - start) / frames * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark grid overlay cost per frame")
+    parser.add_argument("--width", type=int, default=720)
+    parser.add_argument("--height", type=int, default=1600)
+    parser.add_argument("--rows", type=int, default=20)
+    parser.add_argument("--cols", type=int, default=10)
+    parser.add_argument("--frames", type=int, default=50)
+    args = parser.parse_args()
+
+    image = Image.new("RGB", (args.width, args.height), "white")
+
+    grid_layer.cache_clear()
+    start = time.perf_counter()
+    grid_layer(args.width, args.height, args.rows, args.cols, DEFAULT_STYLE)
+    first_render = (time.perf_counter() - start) * 1000
+
+    redraw_ms = time_per_frame(lambda im: redraw_overlay(im, args.rows, args.cols), image, args.frames)
+    cached_ms = time_per_frame(lambda im: apply_grid_overlay(im, args.rows, args.cols), image, args.frames)
+
+    print(f"Frame {args.width}x{args.height}, grid {args.rows}x{args.cols}, {args.frames} frames")
+    print(f"  redraw per frame:        {redraw_ms:8.2f} ms")
+    print(f"  cached layer per frame:  {cached_ms:8.2f} ms  (one-off layer render {first_render:.2f} ms)")
+    print(f"  speedup:                 {redraw_ms / cached_ms:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
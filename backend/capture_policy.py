@@ -0,0 +1,53 @@
+import os
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+# ---------------------------------------------------------------------------
+# 📸 Capture requests: when the phone should send its next screenshot
+# ---------------------------------------------------------------------------
+# Replaces the phone's fixed 4 s sleep. After a command the phone waits delay_ms for the
+# gesture to start, then sends the first frame whose fingerprint has not changed for
+# stable_ms, or whatever it has once timeout_ms has passed.
+
+CAPTURE_STABLE_MS = int(os.getenv("ARES_CAPTURE_STABLE_MS", "300"))
+CAPTURE_TIMEOUT_MS = int(os.getenv("ARES_CAPTURE_TIMEOUT_MS", "3000"))
+# Phone-side 64-bit dHash distance that counts as "the screen changed"
+CAPTURE_THRESHOLD_BITS = int(os.getenv("ARES_CAPTURE_THRESHOLD_BITS", "3"))
+
+# Time until each gesture has visibly started; "type" taps, then the phone types after 1 s
+ACTION_DELAYS_MS = {
+    "tap": 150,
+    "type": 1200,
+    "swipeUp": 400,
+    "swipeDown": 400,
+    "back": 300,
+    "announce": 0,
+}
+
+
+@dataclass(frozen=True)
+class SettlePolicy:
+    delay_ms: int
+    stable_ms: int = CAPTURE_STABLE_MS
+    timeout_ms: int = CAPTURE_TIMEOUT_MS
+    threshold_bits: int = CAPTURE_THRESHOLD_BITS
+
+
+def settle_policy(command: dict) -> SettlePolicy:
+    action = command.get("action")
+    if action == "wait":
+        # The server asked the UI to settle for this long; don't look before then
+        delay = int(command.get("duration", 0))
+        return SettlePolicy(delay_ms=delay, timeout_ms=max(CAPTURE_TIMEOUT_MS, delay + CAPTURE_STABLE_MS))
+    return SettlePolicy(delay_ms=ACTION_DELAYS_MS.get(action, 0))
+
+
+def capture_request(command: Optional[dict]) -> dict:
+    """The "capture" field sent with a command: how to decide the next frame is ready"""
+    policy = settle_policy(command or {})
+    return {"settle": asdict(policy)}
+
+
+def batch_delay_ms(previous: dict) -> int:
+    """Gap before a batched command: the previous gesture has started and had time to settle"""
+    return settle_policy(previous).delay_ms + CAPTURE_STABLE_MS
@@ -0,0 +1,208 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+# ---------------------------------------------------------------------------
+# 🔲 Local UI-element detection: candidate boxes before the vision model
+# ---------------------------------------------------------------------------
+# Edges -> dilation (glyphs into words, words into labels) -> connected components
+# -> size/containment filters. NumPy only, on a small greyscale copy of the frame,
+# so it costs a few milliseconds of CPU instead of a model call's worth of labels.
+
+DETECT_WIDTH = int(os.getenv("ARES_DETECT_WIDTH", "270"))  # working width in pixels
+EDGE_THRESHOLD = int(os.getenv("ARES_EDGE_THRESHOLD", "12"))  # grey-level step that counts as an edge
+# Gaps (working pixels) closed between edges of one element: letters of a label, icon and text
+GAP_X = int(os.getenv("ARES_ELEMENT_GAP_X", "3"))
+GAP_Y = int(os.getenv("ARES_ELEMENT_GAP_Y", "2"))
+MIN_ELEMENT_SIDE = int(os.getenv("ARES_MIN_ELEMENT_SIDE", "5"))  # working pixels
+MAX_ELEMENT_AREA = float(os.getenv("ARES_MAX_ELEMENT_AREA", "0.25"))  # fraction of the frame; larger = layout
+# A box inside a parent smaller than this (fraction of the frame) is part of it, e.g. a button's text
+SMALL_PARENT_AREA = float(os.getenv("ARES_SMALL_PARENT_AREA", "0.03"))
+MAX_ELEMENTS = int(os.getenv("ARES_MAX_ELEMENTS", "60"))
+ELEMENT_INDEX_SIZE = int(os.getenv("ARES_ELEMENT_INDEX_SIZE", "256"))  # frames whose elements are kept
+
+# Labels the model reads: e1, e2, ... (they still match BOX_ID_PATTERN)
+ELEMENT_PREFIX = "e"
+
+
+class Element(NamedTuple):
+    """A candidate tappable region, in pixels of the image it was detected on"""
+    left: float
+    top: float
+    right: float
+    bottom: float
+    kind: str  # "field" (wide, mostly empty box: a text input) or "control"
+
+    @property
+    def center(self) -> Tuple[float, float]:
+        return (self.left + self.right) / 2, (self.top + self.bottom) / 2
+
+
+def element_label(index: int) -> str:
+    return f"{ELEMENT_PREFIX}{index + 1}"
+
+
+def element_at(elements: List[Element], label: str) -> Optional[Element]:
+    """The element a model answer names, or None for N/A, malformed or out-of-range labels"""
+    if not label.startswith(ELEMENT_PREFIX) or not label[len(ELEMENT_PREFIX):].isdigit():
+        return None
+    index = int(label[len(ELEMENT_PREFIX):]) - 1
+    return elements[index] if 0 <= index < len(elements) else None
+
+
+def dilate(mask: np.ndarray, gap: int, axis: int) -> np.ndarray:
+    """Grow True runs by gap pixels on both sides along axis (box filter via cumulative sums)"""
+    if gap <= 0:
+        return mask
+    size = mask.shape[axis]
+    pad = [(0, 0), (0, 0)]
+    pad[axis] = (1, 0)
+    counts = np.pad(np.cumsum(mask, axis=axis, dtype=np.int32), pad)
+    index = np.arange(size)
+    upper = np.take(counts, np.minimum(index + gap + 1, size), axis=axis)
+    lower = np.take(counts, np.maximum(index - gap, 0), axis=axis)
+    return (upper - lower) > 0
+
+
+def component_boxes(mask: np.ndarray) -> np.ndarray:
+    """Bounding boxes (x0, y0, x1, y1; exclusive ends) of 4-connected True regions
+
+    Runs of True pixels are found per row, runs that overlap a run on the next row are
+    joined, and labels are settled by min-propagation with pointer jumping.
+    """
+    height, width = mask.shape
+    stride = width + 2
+    padded = np.zeros((height, stride), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    steps = np.diff(padded, axis=1)
+    run_rows, run_starts = np.nonzero(steps == 1)
+    _, run_ends = np.nonzero(steps == -1)
+    count = len(run_starts)
+    if count == 0:
+        return np.zeros((0, 4), dtype=np.int64)
+
+    # For each run, the runs on the next row that overlap it: start < its end and end > its start
+    start_keys = run_rows * stride + run_starts
+    end_keys = run_rows * stride + run_ends
+    next_row = (run_rows + 1) * stride
+    first = np.searchsorted(end_keys, next_row + run_starts, side="right")
+    last = np.searchsorted(start_keys, next_row + run_ends, side="left")
+    overlaps = np.maximum(last - first, 0)
+    a = np.repeat(np.arange(count), overlaps)
+    offsets = np.arange(len(a)) - np.repeat(np.cumsum(overlaps) - overlaps, overlaps)
+    b = np.repeat(first, overlaps) + offsets
+
+    labels = np.arange(count)
+    while True:
+        previous = labels
+        low = np.minimum(labels[a], labels[b])
+        labels = labels.copy()
+        np.minimum.at(labels, a, low)
+        np.minimum.at(labels, b, low)
+        labels = labels[labels]  # pointer jumping
+        if np.array_equal(labels, previous):
+            break
+
+    roots, index = np.unique(labels, return_inverse=True)
+    boxes = np.empty((len(roots), 4), dtype=np.int64)
+    boxes[:, 0] = width
+    boxes[:, 1] = height
+    boxes[:, 2:] = 0
+    np.minimum.at(boxes[:, 0], index, run_starts)
+    np.minimum.at(boxes[:, 1], index, run_rows)
+    np.maximum.at(boxes[:, 2], index, run_ends)
+    np.maximum.at(boxes[:, 3], index, run_rows + 1)
+    return boxes
+
+
+def box_sums(integral: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """Sum of the underlying image over each box, from its zero-padded integral image"""
+    x0, y0, x1, y1 = boxes.T
+    return integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+
+
+def drop_contained(boxes: np.ndarray, frame_area: int) -> np.ndarray:
+    """Drop boxes inside a small parent (a button's label), keep those inside large ones (a card's icons)"""
+    x0, y0, x1, y1 = (boxes[:, i][:, None] for i in range(4))
+    inside = (x0 >= x0.T) & (y0 >= y0.T) & (x1 <= x1.T) & (y1 <= y1.T)
+    np.fill_diagonal(inside, False)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    small_parent = inside & (areas[None, :] < SMALL_PARENT_AREA * frame_area)
+    return boxes[~small_parent.any(axis=1)]
+
+
+def detect_elements(image: Image.Image) -> List[Element]:
+    """Candidate tappable regions of a screenshot, top to bottom, left to right"""
+    scale = DETECT_WIDTH / image.width
+    size = (DETECT_WIDTH, max(1, round(image.height * scale)))
+    gray = np.asarray(image.convert("L").resize(size, Image.BILINEAR), dtype=np.int16)
+    height, width = gray.shape
+
+    edges = np.zeros(gray.shape, dtype=bool)
+    edges[:, 1:] |= np.abs(np.diff(gray, axis=1)) > EDGE_THRESHOLD
+    edges[1:, :] |= np.abs(np.diff(gray, axis=0)) > EDGE_THRESHOLD
+    mask = dilate(dilate(edges, GAP_X, axis=1), GAP_Y, axis=0)
+
+    boxes = component_boxes(mask)
+    sides = boxes[:, 2:] - boxes[:, :2]
+    areas = sides[:, 0] * sides[:, 1]
+    keep = (sides.min(axis=1) >= MIN_ELEMENT_SIDE) & (areas <= MAX_ELEMENT_AREA * width * height)
+    boxes = drop_contained(boxes[keep], width * height)
+
+    # Text inputs: wide, short and mostly empty inside (at most a hint or a few typed words)
+    integral = np.pad(edges.cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+    inner = boxes + np.array([2, 2, -2, -2])
+    inner[:, 2:] = np.maximum(inner[:, 2:], inner[:, :2])
+    inner_area = np.maximum((inner[:, 2] - inner[:, 0]) * (inner[:, 3] - inner[:, 1]), 1)
+    density = box_sums(integral, inner) / inner_area
+    sides = boxes[:, 2:] - boxes[:, :2]
+    fields = (sides[:, 0] >= 0.4 * width) & (sides[:, 0] >= 3.5 * sides[:, 1]) & (density < 0.08)
+
+    order = np.lexsort((boxes[:, 0], boxes[:, 1]))[:MAX_ELEMENTS]
+    return [
+        Element(
+            float(boxes[i, 0] / scale), float(boxes[i, 1] / scale),
+            float(boxes[i, 2] / scale), float(boxes[i, 3] / scale),
+            "field" if fields[i] else "control",
+        )
+        for i in order
+    ]
+
+
+class ElementIndex:
+    """LRU of detected elements per frame fingerprint, so each screen is analysed once"""
+
+    def __init__(self, max_entries: int = ELEMENT_INDEX_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, List[Element]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, fingerprint: int, image: Image.Image) -> List[Element]:
+        with self._lock:
+            elements = self._entries.get(fingerprint)
+            if elements is not None:
+                self._entries.move_to_end(fingerprint)
+                self.hits += 1
+                return elements
+            self.misses += 1
+        elements = detect_elements(image)
+        with self._lock:
+            self._entries[fingerprint] = elements
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return elements
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
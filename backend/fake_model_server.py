@@ -0,0 +1,197 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from model_backend import MockBackend, ToolRequest
+
+# ---------------------------------------------------------------------------
+# 🧪 Local fake of the OpenAI-compatible chat endpoint, with fault injection
+# ---------------------------------------------------------------------------
+# Answers like MockBackend, but over real HTTP, so OpenAIBackend + ModelGateway
+# (pool, deadlines, retries, hedging, rate limit) can be exercised offline:
+#   python fake_model_server.py --port 8099 --fail-rate 0.1 --slow-rate 0.05
+#   ARES_MODEL_BASE_URL=http://127.0.0.1:8099/ GEMINI_API_KEY=fake python web_socket.py
+
+_INSTRUCTION_RE = re.compile(r'Instruction: "(.*)"\s*$', re.DOTALL)
+_GOAL_RE = re.compile(r"\*\*(.+?)\*\*")
+_STEP_RE = re.compile(r"^\d+\. (.+)$", re.MULTILINE)
+
+
+def prompt_text(messages: list) -> str:
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(part.get("text", "") for part in content or [] if part.get("type") == "text")
+    return "\n".join(parts)
+
+
+def request_context(tool_name: str, messages: list) -> dict:
+    """Recover the MockBackend context (instruction / goal / goals) from the prompt"""
+    text = prompt_text(messages)
+    if tool_name == "extract_goals":
+        match = _INSTRUCTION_RE.search(text)
+        return {"instruction": match.group(1) if match else text}
+    if tool_name == "select_boxes":
+        return {"goals": _STEP_RE.findall(text)}
+    match = _GOAL_RE.search(text)
+    return {"goal": match.group(1) if match else text}
+
+
+class FakeModelServer:
+    def __init__(self, mock: MockBackend, fail_rate: float = 0.0, slow_rate: float = 0.0, slow_latency: float = 10.0, seed: int = 0):
+        self.mock = mock
+        self.fail_rate = fail_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.requests = 0
+        self.failures = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def _roll(self) -> str:
+        with self._lock:
+            self.requests += 1
+            roll = self._random.random()
+        if roll < self.fail_rate:
+            with self._lock:
+                self.failures += 1
+            return "fail"
+        if roll < self.fail_rate + self.slow_rate:
+            return "slow"
+        return "ok"
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like the real endpoint
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                outcome = fake._roll()
+                if outcome == "fail":
+                    self._send_json(503, {"error": {"message": "injected failure", "code": 503}})
+                    return
+                if outcome == "slow":
+                    time.sleep(fake.slow_latency)
+
+                tool = body["tools"][0]
+                tool_name = tool["function"]["name"]
+                request = ToolRequest(
+                    model=body["model"],
+                    tool=tool,
+                    messages=body["messages"],
+                    temperature=body.get("temperature", 0),
+                    context=request_context(tool_name, body["messages"]),
+                )
+                fake.mock._sleep(body["model"])
+                arguments = json.dumps(fake.mock.answer(request))
+                if body.get("stream"):
+                    self._send_stream(body["model"], tool_name, arguments)
+                else:
+                    self._send_json(200, completion(body["model"], tool_name, arguments))
+
+            def _send_json(self, status: int, payload: dict) -> None:
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, model: str, tool_name: str, arguments: str) -> None:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                for i in range(0, len(arguments), 16):
+                    chunk = completion_chunk(model, tool_name if i == 0 else None, arguments[i:i + 16])
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.close_connection = True
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        self._server = ThreadingHTTPServer((host, port), self.handler())
+        threading.Thread(target=self._server.serve_forever, name="fake-model", daemon=True).start()
+        return self._server.server_address[1]
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def completion(model: str, tool_name: str, arguments: str) -> dict:
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "finish_reason": "tool_calls",
+            "message": {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [{"id": "call_0", "type": "function", "function": {"name": tool_name, "arguments": arguments}}],
+            },
+        }],
+    }
+
+
+def completion_chunk(model: str, tool_name: Optional[str], arguments: str) -> dict:
+    function = {"arguments": arguments}
+    tool_call = {"index": 0, "function": function}
+    if tool_name is not None:
+        function["name"] = tool_name
+        tool_call.update(id="call_0", type="function")
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "finish_reason": None, "delta": {"tool_calls": [tool_call]}}],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fake OpenAI-compatible model endpoint")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--fixture", default=None, help="MockBackend fixture with recorded answers")
+    parser.add_argument("--latency", type=float, default=0.8)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with HTTP 503")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of requests delayed by --slow-latency")
+    parser.add_argument("--slow-latency", type=float, default=10.0)
+    args = parser.parse_args()
+
+    server = FakeModelServer(
+        MockBackend(fixture_path=args.fixture, latency=args.latency, jitter=args.jitter),
+        fail_rate=args.fail_rate, slow_rate=args.slow_rate, slow_latency=args.slow_latency,
+    )
+    port = server.start(port=args.port)
+    print(f"Fake model endpoint on http://127.0.0.1:{port}/")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
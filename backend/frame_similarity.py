@@ -0,0 +1,117 @@
+import os
+from collections import deque
+from functools import lru_cache
+from io import BytesIO
+from typing import Callable, Deque, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+# ---------------------------------------------------------------------------
+# 👀 Perceptual frame fingerprints (dHash / pHash) + near-duplicate history
+# ---------------------------------------------------------------------------
+
+# Mask regions are fractions of the frame: (left, top, right, bottom)
+MaskRegion = Tuple[float, float, float, float]
+
+# Status bar (clock, battery, notification icons) changes without the app changing
+STATUS_BAR_MASK: MaskRegion = (0.0, 0.0, 1.0, 0.04)
+
+# pHash is the default: dHash barely reacts to flat UI changes (a new button, typed text)
+FRAME_HASH = os.getenv("ARES_FRAME_HASH", "phash")
+HASH_SIZE = 16  # 16x16 = 256-bit fingerprints; 8x8 is too coarse for mostly-white app screens
+DUPLICATE_THRESHOLD = int(os.getenv("ARES_DUPLICATE_THRESHOLD", "10"))  # max differing bits
+DUPLICATE_WINDOW = int(os.getenv("ARES_DUPLICATE_WINDOW", "3"))
+
+
+def _prepare(image: Image.Image, size: Tuple[int, int], masks: Sequence[MaskRegion]) -> np.ndarray:
+    gray = image.convert("L")
+    if masks:
+        draw = ImageDraw.Draw(gray)
+        width, height = gray.size
+        for left, top, right, bottom in masks:
+            # Flat fill so masked pixels contribute nothing that can change between frames
+            draw.rectangle([left * width, top * height, right * width, bottom * height], fill=128)
+    return np.asarray(gray.resize(size, Image.Resampling.BILINEAR), dtype=np.float32)
+
+
+def _pack_bits(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.astype(np.uint8).ravel()).tobytes(), "big")
+
+
+def dhash(image: Image.Image, hash_size: int = HASH_SIZE, masks: Sequence[MaskRegion] = ()) -> int:
+    """Difference hash: sign of horizontal gradients on a tiny grayscale thumbnail"""
+    pixels = _prepare(image, (hash_size + 1, hash_size), masks)
+    return _pack_bits(pixels[:, 1:] > pixels[:, :-1])
+
+
+@lru_cache(maxsize=4)
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    return np.cos(np.pi * (2 * i + 1) * k / (2 * n)).astype(np.float32)
+
+
+def phash(image: Image.Image, hash_size: int = HASH_SIZE, masks: Sequence[MaskRegion] = (), highfreq_factor: int = 4) -> int:
+    """Perceptual hash: low-frequency DCT coefficients compared to their median"""
+    n = hash_size * highfreq_factor
+    pixels = _prepare(image, (n, n), masks)
+    dct = _dct_matrix(n)
+    low = (dct @ pixels @ dct.T)[:hash_size, :hash_size]
+    # Skip the DC term when picking the median so overall brightness doesn't dominate
+    return _pack_bits(low > np.median(low.ravel()[1:]))
+
+
+HASHERS: Dict[str, Callable[..., int]] = {
+    "dhash": dhash,
+    "phash": phash,
+}
+
+
+def register_hasher(name: str, fn: Callable[..., int]) -> None:
+    HASHERS[name] = fn
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def fingerprint(image: Image.Image, algorithm: str = FRAME_HASH, masks: Sequence[MaskRegion] = (STATUS_BAR_MASK,)) -> int:
+    return HASHERS[algorithm](image, masks=masks)
+
+
+def fingerprint_bytes(img_bytes: bytes, algorithm: str = FRAME_HASH, masks: Sequence[MaskRegion] = (STATUS_BAR_MASK,)) -> int:
+    return fingerprint(Image.open(BytesIO(img_bytes)), algorithm, masks)
+
+
+class FrameHistory:
+    """Last few frame fingerprints of a session, matched by Hamming distance"""
+
+    def __init__(self, threshold: int = DUPLICATE_THRESHOLD, window: int = DUPLICATE_WINDOW):
+        self.threshold = threshold
+        self.fingerprints: Deque[int] = deque(maxlen=window)
+
+    def find(self, fp: int) -> Optional[int]:
+        # Newest first: the previous frame is the most likely match
+        for seen in reversed(self.fingerprints):
+            if hamming(seen, fp) <= self.threshold:
+                return seen
+        return None
+
+    def observe(self, fp: int) -> bool:
+        """True if fp looks like the frame right before it; fp is remembered either way
+
+        Only the previous frame counts: coming back to a screen seen a few frames ago is
+        navigation (e.g. after "back"), not a command that changed nothing. The older
+        frames of the window are for find().
+        """
+        unchanged = bool(self.fingerprints) and hamming(self.fingerprints[-1], fp) <= self.threshold
+        self.fingerprints.append(fp)
+        return unchanged
+
+    def forget(self, fp: int) -> None:
+        """Drop the newest record of fp, e.g. when the step that saw it failed and will be retried"""
+        for index in range(len(self.fingerprints) - 1, -1, -1):
+            if self.fingerprints[index] == fp:
+                del self.fingerprints[index]
+                return
@@ -1,23 +1,52 @@
 import os
 import json
 import base64
-import hashlib
-import time
 import re
-from typing import List, Dict, Optional, Union, Literal, Annotated, Any
+import asyncio
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Union, Literal, Annotated, Any, Tuple, Callable, Iterator, NamedTuple, Awaitable, Collection, Sequence, Set, Type, TypeVar
 
 from dotenv import load_dotenv
 from pydantic import BaseModel, StringConstraints
-from openai import OpenAI
+from PIL import Image
+
+from capture_policy import batch_delay_ms
+from session_manager import SessionManager
+from session_store import open_session_store
+from frame_similarity import FrameHistory, fingerprint_bytes
+from grounding_cache import GroundingCache
+from plan_cache import PlanCache
+from session_machine import GoalMachine
+from speculation import PREFETCH_NEXT_GOAL, SPECULATIVE_START, Speculation, speculate
+from model_backend import ModelBackend, OpenAIBackend, ToolRequest
+from model_gateway import ModelError, ModelGateway
+from model_routing import HEAVY_MODEL, ModelRouter
+from prompts import StepHistory, batch_grounder_messages, grounder_messages, planner_messages
+from grid_utils import BOX_ID_PATTERN, COARSE_COLUMNS, COARSE_ROWS, FINE_COLUMNS, FINE_ROWS, REGION_SEPARATOR, TOTAL_COLUMNS, TOTAL_ROWS, box_in_grid, point_id
+from image_prep import PREP_CONFIG, coarse_view, element_view, region_view, render_grid, sniff_mime, target_size
+from element_detector import ElementIndex, element_at, element_label
+from telemetry import log_event, metrics, session_scope
 
 # ---------------------------------------------------------------------------
 # 🔧 Environment & Gemini client setup
 # ---------------------------------------------------------------------------
 load_dotenv()
-client = OpenAI(
-    api_key=os.getenv("GEMINI_API_KEY"),  # You must define GEMINI_API_KEY in your .env
-    base_url="https://generativelanguage.googleapis.com/v1beta/"
-)
+# Every model call goes through the gateway: deadline, retries, hedging, shared rate limit
+backend = ModelGateway(OpenAIBackend())
+
+def set_backend(new_backend: ModelBackend) -> None:
+    """Swap what answers extract_goals/select_box, e.g. MockBackend for offline replay"""
+    backend.inner = new_backend
+
+# Upper bound on concurrent chat.completions calls across all sessions
+MAX_INFLIGHT_MODEL_CALLS = int(os.getenv("ARES_MAX_INFLIGHT_MODEL_CALLS", "8"))
+# Worker threads that run blocking process_request steps for the event loop
+STEP_WORKERS = int(os.getenv("ARES_STEP_WORKERS", "32"))
+
+_model_call_slots = threading.BoundedSemaphore(MAX_INFLIGHT_MODEL_CALLS)
+_step_executor = ThreadPoolExecutor(max_workers=STEP_WORKERS, thread_name_prefix="ares-step")
 
 # ---------------------------------------------------------------------------
 # 📝 Pydantic models (mirrors the schema your mobile client expects)
@@ -27,7 +56,13 @@ class GoalExtractionResponse(BaseModel):
     goals: List[str]
 
 class IconBoxResponse(BaseModel):
-    box_id: Annotated[str, StringConstraints(pattern=r"^([a-z][0-9]|N/A)$")]
+    box_id: Annotated[str, StringConstraints(pattern=BOX_ID_PATTERN)]
+
+class BatchBoxResponse(BaseModel):
+    box_ids: List[Annotated[str, StringConstraints(pattern=BOX_ID_PATTERN)]]
+
+# Any of the tool-argument models above
+ToolArguments = TypeVar("ToolArguments", bound=BaseModel)
 
 class TapCommand(BaseModel):
     action: Literal["tap"]
@@ -51,22 +86,32 @@ class AnnounceCommand(BaseModel):
     action: Literal["announce"]
     text: str
 
-class CommandResponse(BaseModel):
-    command: Union[TapCommand, TypeCommand, SwipeUpCommand, SwipeDownCommand, BackCommand,AnnounceCommand]
-    isDone: bool
-
 class WaitCommand(BaseModel):
     action: Literal["wait"]
     duration: int  # Wait duration in milliseconds
 
+Command = Union[TapCommand, TypeCommand, SwipeUpCommand, SwipeDownCommand, BackCommand, AnnounceCommand, WaitCommand]
+
+class CommandResponse(BaseModel):
+    command: Command
+    isDone: bool
+
+class BatchStep(BaseModel):
+    command: Command
+    delay_ms: int = 0  # wait before running it, after the previous step
+    # "changed": run only if the previous command changed the screen; otherwise the phone
+    # stops the batch and sends a frame (with "batch_stopped": this step's index)
+    guard: Optional[Literal["changed"]] = None
+
+class CommandBatch(BaseModel):
+    batch: List[BatchStep]  # run in order on the phone, no frames in between
+    isDone: bool
+
 # ---------------------------------------------------------------------------
 # 🔨 Utility helpers
 # ---------------------------------------------------------------------------
 
-def sha256(data: bytes) -> str:
-    return hashlib.sha256(data).hexdigest()
-
-def create_command_response(action: str, *, box_id: Optional[str] = None, text: Optional[str] = None) -> dict:
+def create_command_response(action: str, *, box_id: Optional[str] = None, text: Optional[str] = None, duration: Optional[int] = None) -> dict:
     if action == "tap" and box_id:
         return CommandResponse(
             command=TapCommand(action="tap", box_id=box_id),
@@ -97,9 +142,22 @@ def create_command_response(action: str, *, box_id: Optional[str] = None, text:
             command=AnnounceCommand(action="announce", text=text),
             isDone=False
         ).model_dump()
+    elif action == "wait" and duration is not None:
+        return CommandResponse(
+            command=WaitCommand(action="wait", duration=duration),
+            isDone=False
+        ).model_dump()
     else:
         return {"error": "Invalid command parameters"}
 
+def create_command_batch(commands: List[dict]) -> dict:
+    """Commands the phone runs back-to-back; each after the first waits for the previous
+    gesture to play out and only runs if it changed the screen"""
+    steps = [BatchStep(command=commands[0])]
+    for previous, command in zip(commands, commands[1:]):
+        steps.append(BatchStep(command=command, delay_ms=batch_delay_ms(previous), guard="changed"))
+    return CommandBatch(batch=steps, isDone=False).model_dump()
+
 # ---------------------------------------------------------------------------
 # 🤖 Gemini function-calling wrappers
 # ---------------------------------------------------------------------------
@@ -126,217 +184,566 @@ box_tools = [
     }
 ]
 
-def extract_goals(instruction: str) -> List[str]:
-    resp = client.chat.completions.create(
-        model="gemini-2.5-pro-preview-03-25",
-        tools=goal_tools,
-        tool_choice={"type": "function", "function": {"name": "extract_goals"}},
-        messages=[
-            {
-                "role": "user",
-                "content": f"""
-You are an android assistant which runs on android to do basic chores on behalf of user and that breaks down user instructions into concrete, modular mobile UI goals to automate workflows on Android apps.
-
-Each goal should be written like a command and must reflect specific UI actions such as:
-- Tapping buttons, icons, or menu items (e.g., "Tap element ")
-- Typing into text fields (e.g., "Type something into search bar")
-- Navigating through the interface (e.g., "Open LinkedIn app", "Scroll down", "Swipe left")
-- Selecting or confirming actions (e.g., "Tap 'Connect'", "Tap 'Allow'", "Select first result")
-- Waiting for or verifying UI changes if implied by flow (e.g., "Wait for connection confirmation")
-
-Ensure that:
-- Goals are atomic (one action per step)
-- The order reflects how a user would logically complete the task in the UI
-- Multi-step flows (e.g., searching, connecting, posting) are decomposed clearly
-
-
-### Knowledge Base:
-
-⏰ **Whatsapp App**
-- Remember that while interacting with WHATSAPP, when you look for someone through search, click on their name to open the chat not the profile picture.
-
-⏰ **Reddit App**
-- Remember that while interacting with REDDIT, you will probably will be told to browse on user's behalf,
-- In that case, after opening the app, keep scrolling upto 5 times, and then announce a very short summary.
-
-⏰ **Uber App**
-- Remember that while booking UBER, when you complete input/type, the most closest search will appear right below -- pick that.
-
-
-⏰ **Clock App**
-- Clock app has 5 bottom tabs: **Alarm, Clock, Timer, Stopwatch, Bedtime**.
-- If the desired alarm exists, toggle it.
-- Otherwise:
-    1. Tap the **plus (+)** button.
-    2. Set **hour**, **minute**, and **AM/PM**.
-    3. Tap **OK** to confirm.
-
-Return only the modular goals in the `goals` field as a **list of strings**.
-Instruction: \"{instruction}\"
-""",
-            }
-        ],
+batch_box_tools = [
+    {
+        "type": "function",
+        "function": {
+            "name": "select_boxes",
+            "description": "Identify the box ID for each goal, in order, or N/A where the element is not visible.",
+            "parameters": BatchBoxResponse.model_json_schema(),
+        },
+    }
+]
+
+def parse_arguments(schema: Type[ToolArguments], arguments: str) -> ToolArguments:
+    """Validate a tool call's arguments; malformed or incomplete ones count as a failed model call"""
+    try:
+        return schema.model_validate_json(arguments)
+    except ValueError as e:  # pydantic's ValidationError, which also covers broken JSON
+        metrics.incr("model_errors")
+        raise ModelError(f"Invalid {schema.__name__} arguments: {e}") from e
+
+def call_model(request: ToolRequest, schema: Type[ToolArguments]) -> ToolArguments:
+    """Run a forced tool call while holding one of the shared in-flight slots"""
+    with _model_call_slots:
+        try:
+            arguments = backend.call(request)
+        except Exception:
+            metrics.incr("model_errors")
+            raise
+    return parse_arguments(schema, arguments)
+
+def goal_request(instruction: str, model: str = HEAVY_MODEL) -> ToolRequest:
+    return ToolRequest(
+        model=model,
+        tool=goal_tools[0],
+        messages=planner_messages(instruction),
         temperature=0,
+        context={"instruction": instruction},
+    )
+
+def extract_goals(instruction: str, model: str = HEAVY_MODEL) -> List[str]:
+    return call_model(goal_request(instruction, model), GoalExtractionResponse).goals
+
+_json_decoder = json.JSONDecoder()
+
+def parse_partial_strings(arguments: str) -> List[str]:
+    """Items already complete in a partial '{"goals": ["...' (or any string-list) buffer"""
+    pos = arguments.find("[")
+    if pos < 0:
+        return []
+    goals = []
+    pos += 1
+    while True:
+        while pos < len(arguments) and arguments[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= len(arguments) or arguments[pos] != '"':
+            return goals
+        try:
+            goal, pos = _json_decoder.raw_decode(arguments, pos)
+        except json.JSONDecodeError:
+            return goals  # string still streaming in
+        goals.append(goal)
+
+_partial_box_re = re.compile(r'"box_id"\s*:\s*"([^"\\]*)"')
+
+def parse_partial_box(arguments: str) -> Optional[str]:
+    """The box_id once its JSON string has closed in a partial '{"box_id": "...' buffer, if valid"""
+    match = _partial_box_re.search(arguments)
+    if match is None or not re.match(BOX_ID_PATTERN, match.group(1)):
+        return None
+    return match.group(1)
+
+def stream_model(request: ToolRequest) -> Iterator[str]:
+    """Yield tool-call argument fragments as they stream in, holding a model slot throughout"""
+    with _model_call_slots:
+        try:
+            yield from backend.stream(request)
+        except Exception:
+            metrics.incr("model_errors")
+            raise
+
+def extract_goals_streaming(instruction: str, on_goal: Callable[[int, str], None], model: str = HEAVY_MODEL) -> List[str]:
+    """Like extract_goals, but calls on_goal(index, goal) as soon as each goal is parsed"""
+    arguments = ""
+    emitted = 0
+    for fragment in stream_model(goal_request(instruction, model)):
+        arguments += fragment
+        goals = parse_partial_strings(arguments)
+        for index in range(emitted, len(goals)):
+            on_goal(index, goals[index])
+        emitted = len(goals)
+
+    return parse_arguments(GoalExtractionResponse, arguments).goals
+
+# Grid drawn on each grounding view: the full frame, or the two coarse-to-fine passes
+VIEW_GRIDS = {
+    "grid": (TOTAL_ROWS, TOTAL_COLUMNS),
+    "coarse": (COARSE_ROWS, COARSE_COLUMNS),
+    "fine": (FINE_ROWS, FINE_COLUMNS),
+}
+# How each view's labels are described to the model
+VIEW_LABELS = {
+    "elements": "boxes labelled e1, e2, etc. around its UI elements",
+}
+
+def box_request(goal: str, img_bytes: bytes, mime_type: str = "image/jpeg", view: str = "grid",
+                model: str = HEAVY_MODEL, labels: Optional[List[str]] = None, history: Sequence[str] = ()) -> ToolRequest:
+    # The only base64 pass on the image path: the API wants a data URL
+    img_b64 = base64.b64encode(img_bytes).decode("utf-8")
+    context = {"goal": goal, "view": view, "grid": VIEW_GRIDS.get(view)}
+    if labels is not None:
+        context["labels"] = labels
+    return ToolRequest(
+        model=model,
+        tool=box_tools[0],
+        messages=grounder_messages(goal, img_b64, mime_type, VIEW_LABELS.get(view), history),
+        temperature=0.4,
+        context=context,
     )
 
-    return json.loads(resp.choices[0].message.tool_calls[0].function.arguments)["goals"]
-
-def select_box(goal: str, img_b64: str) -> str:
-    resp = client.chat.completions.create(
-        model="gemini-2.5-pro-preview-03-25",
-        tools=box_tools,
-        tool_choice={"type": "function", "function": {"name": "select_best_box"}},
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": f"""You are shown a screenshot with bounding boxes labelled a1, b2, etc.
-Return the single best box that fully contains the UI element needed for this goal: **{goal}**
-Return "N/A" ONLY if the element is definitely not visible in the current screen.
-No explanations.""",
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{img_b64}"},
-                    },
-                ],
-            }
-        ],
+def select_box_streaming(request: ToolRequest, on_box: Callable[[str], None]) -> str:
+    """Like select_box, but calls on_box(box_id) as soon as the id is parsed from the stream"""
+    arguments = ""
+    early = None
+    for fragment in stream_model(request):
+        arguments += fragment
+        if early is None:
+            early = parse_partial_box(arguments)
+            if early is not None:
+                on_box(early)
+    return parse_arguments(IconBoxResponse, arguments).box_id
+
+def select_box(goal: str, img_bytes: bytes, mime_type: str = "image/jpeg", view: str = "grid",
+               on_box: Optional[Callable[[str], None]] = None, model: str = HEAVY_MODEL,
+               labels: Optional[List[str]] = None, history: Sequence[str] = ()) -> str:
+    request = box_request(goal, img_bytes, mime_type, view, model, labels, history)
+    if on_box is not None:
+        return select_box_streaming(request, on_box)
+    return call_model(request, IconBoxResponse).box_id
+
+def batch_request(goals: List[str], img_bytes: bytes, mime_type: str = "image/jpeg", model: str = HEAVY_MODEL,
+                  history: Sequence[str] = ()) -> ToolRequest:
+    img_b64 = base64.b64encode(img_bytes).decode("utf-8")
+    return ToolRequest(
+        model=model,
+        tool=batch_box_tools[0],
+        messages=batch_grounder_messages(goals, img_b64, mime_type, history=history),
         temperature=0.4,
+        context={"goals": goals, "view": "grid", "grid": VIEW_GRIDS["grid"]},
     )
-    return json.loads(resp.choices[0].message.tool_calls[0].function.arguments)["box_id"]
+
+def select_boxes(goals: List[str], img_bytes: bytes, mime_type: str = "image/jpeg",
+                 on_box: Optional[Callable[[str], None]] = None, model: str = HEAVY_MODEL,
+                 history: Sequence[str] = ()) -> List[str]:
+    """One model call for several goals on one screenshot; N/A where a goal's element isn't visible"""
+    request = batch_request(goals, img_bytes, mime_type, model, history)
+    if on_box is None:
+        box_ids = call_model(request, BatchBoxResponse).box_ids
+    else:
+        # The first id is the current goal's: dispatch it before the lookahead ids arrive
+        arguments = ""
+        sent = False
+        for fragment in stream_model(request):
+            arguments += fragment
+            if not sent:
+                parsed = parse_partial_strings(arguments)
+                if parsed and re.match(BOX_ID_PATTERN, parsed[0]):
+                    sent = True
+                    on_box(parsed[0])
+        box_ids = parse_arguments(BatchBoxResponse, arguments).box_ids
+    # Tolerate a miscounted answer: missing goals are "not visible", extras are dropped
+    return (box_ids + ["N/A"] * len(goals))[:len(goals)]
+
+# Repeated instructions (or the same one with a different name/number) skip extract_goals
+plan_cache = PlanCache()
+
+# Plans and groundings go to the fast model first; the heavy one only sees what fails the checks
+router = ModelRouter()
+# A fast box that disagrees with the cached answer for its goal on a screen this close is escalated
+ROUTING_AGREEMENT_BITS = int(os.getenv("ARES_ROUTING_AGREEMENT_BITS", "20"))
+MAX_PLAN_GOALS = int(os.getenv("ARES_MAX_PLAN_GOALS", "30"))
+
+def plan_accepts(goals: Any) -> bool:
+    """A fast-tier plan is usable if it is a short, non-empty list of non-empty goal strings"""
+    return (
+        isinstance(goals, list)
+        and 0 < len(goals) <= MAX_PLAN_GOALS
+        and all(isinstance(goal, str) and goal.strip() for goal in goals)
+    )
+
+def plan_goals(instruction: str, on_goal: Optional[Callable[[int, str], None]] = None) -> List[str]:
+    """Goals for an instruction; with on_goal, the model output is streamed goal by goal"""
+    goals = plan_cache.get(instruction)
+    if goals is not None:
+        metrics.incr("plan_cache_hits")
+        log_event(None, f"Plan cache hit for: {instruction}")
+        return goals
+    def attempt(model: str, use: str) -> List[str]:
+        # Goals streamed from a fast plan that is later rejected are superseded by the
+        # heavy plan's goals; on_goal sees index 0 again
+        if on_goal is not None and use != "shadow":
+            return extract_goals_streaming(instruction, on_goal, model)
+        return extract_goals(instruction, model)
+
+    with metrics.timer("plan"):
+        goals = router.run("plan", attempt, plan_accepts)
+    plan_cache.put(instruction, goals)
+    return goals
+
+# "grid": one full-frame call on the TOTAL_ROWS x TOTAL_COLUMNS grid.
+# "coarse": pick a region on a small downscaled frame, then a cell on a crop of that region.
+# "elements": a local detector proposes candidate boxes; only those are labelled on the frame.
+GROUNDING_MODE = os.getenv("ARES_GROUNDING_MODE", "grid")
+COARSE_TO_FINE = GROUNDING_MODE == "coarse"
+ELEMENT_GROUNDING = GROUNDING_MODE == "elements"
+# Only full-grid mode reads the gridded frame; the other modes draw their views from the clean one
+GRID_FRAME = GROUNDING_MODE == "grid"
+
+# How many goals after the current one are grounded in the same call, on the same frame (0 = off)
+GROUNDING_LOOKAHEAD = int(os.getenv("ARES_GROUNDING_LOOKAHEAD", "2"))
+
+# Shared across sessions: the same goal on the same screen resolves the same way
+grounding_cache = GroundingCache()
+# Box ids only mean something for the grid they were read off
+if COARSE_TO_FINE:
+    GRID_SCOPE = f"c2f{COARSE_ROWS}x{COARSE_COLUMNS}/{FINE_ROWS}x{FINE_COLUMNS}"
+elif ELEMENT_GROUNDING:
+    GRID_SCOPE = "elements"  # point ids, valid at any resolution
+else:
+    GRID_SCOPE = f"grid{TOTAL_ROWS}x{TOTAL_COLUMNS}"
+
+class Frame(NamedTuple):
+    """One screenshot as grounding sees it: encoded gridded image + clean-frame fingerprint"""
+    image_bytes: Optional[bytes]
+    mime_type: str
+    fingerprint: int
+    image: Optional[Image.Image] = None  # clean frame, needed for coarse-to-fine and element grounding
+
+def select_box_coarse_to_fine(goal: str, frame: Frame, on_box: Optional[Callable[[str], None]] = None,
+                              model: str = HEAVY_MODEL, history: Sequence[str] = ()) -> str:
+    """Two small calls instead of one large one; returns a 'region/cell' id or N/A"""
+    region = select_box(goal, coarse_view(frame.image), frame.mime_type, view="coarse", model=model, history=history)
+    if region == "N/A":
+        return region
+    on_cell = None
+    if on_box is not None:
+        on_cell = lambda cell: on_box(cell if cell == "N/A" else f"{region}{REGION_SEPARATOR}{cell}")
+    cell = select_box(goal, region_view(frame.image, region), frame.mime_type, view="fine", on_box=on_cell, model=model,
+                      history=history)
+    if cell == "N/A":
+        return cell
+    return f"{region}{REGION_SEPARATOR}{cell}"
+
+# Detected elements per frame fingerprint, shared across sessions like the grounding cache
+element_index = ElementIndex()
+
+def select_element(goal: str, frame: Frame, on_box: Optional[Callable[[str], None]] = None,
+                   model: str = HEAVY_MODEL, history: Sequence[str] = ()) -> str:
+    """One call on a view where only the detected elements are labelled; returns a point id or N/A
+
+    A frame on which nothing was detected is grounded on the full grid instead.
+    """
+    elements = element_index.get(frame.fingerprint, frame.image)
+    if not elements:
+        metrics.incr("element_fallbacks")
+        view = render_grid(frame.image, TOTAL_ROWS, TOTAL_COLUMNS, size=target_size(frame.image.size, PREP_CONFIG))
+        return select_box(goal, view, frame.mime_type, on_box=on_box, model=model, history=history)
+
+    labels = [element_label(i) for i in range(len(elements))]
+    width, height = frame.image.size
+
+    def to_point(label: str) -> str:
+        element = element_at(elements, label)
+        return "N/A" if element is None else point_id(*element.center, width, height)
+
+    on_label = None
+    if on_box is not None:
+        on_label = lambda label: on_box(to_point(label))
+    view = element_view(frame.image, [element[:4] for element in elements], labels)
+    return to_point(select_box(goal, view, frame.mime_type, view="elements", on_box=on_label, model=model,
+                               labels=labels, history=history))
+
+def local_grounding(goal: str, frame: Frame) -> Optional[str]:
+    """A box for goals the detector answers alone: typing when the screen has exactly one text field"""
+    if not ELEMENT_GROUNDING or frame.image is None or goal_command(goal)[0] != "type":
+        return None
+    fields = [element for element in element_index.get(frame.fingerprint, frame.image) if element.kind == "field"]
+    if len(fields) != 1:
+        return None
+    return point_id(*fields[0].center, *frame.image.size)
+
+def grounding_accepts(goal: str, box_id: str, frame: Frame, avoid: Collection[str] = ()) -> bool:
+    """Whether a fast-tier box can be used without asking the heavy model
+
+    Rejected: "N/A" (a wrong one costs a round of swipes), ids that are malformed or
+    off the grid, a box that already failed for this goal, and a box that disagrees
+    with the cached answer for this goal on a similar screen.
+    """
+    if box_id == "N/A" or box_id in avoid:
+        return False
+    if not box_in_grid(box_id):
+        return False
+    known = grounding_cache.nearest(goal, frame.fingerprint, ROUTING_AGREEMENT_BITS, scope=GRID_SCOPE)
+    return known is None or known == box_id
+
+def ground(goal: str, frame: Frame, on_box: Optional[Callable[[str], None]] = None, lookahead: Optional[List[str]] = None,
+           avoid: Collection[str] = (), history: Sequence[str] = ()) -> Tuple[str, bool]:
+    """Resolve goal -> box_id from the cache, else from the model; returns (box_id, cache_hit)
+
+    With on_box, the model answer is streamed and on_box(box_id) fires as soon as it is parsed.
+    With lookahead goals, they are grounded in the same call (full-grid mode only); their
+    answers are cached against this frame, so they cost nothing if the screen is unchanged
+    when their turn comes. avoid lists boxes that already failed for this goal; history is
+    the session's recent steps, shown to the model.
+    """
+    box_id = grounding_cache.get(goal, frame.fingerprint, scope=GRID_SCOPE)
+    if box_id is not None:
+        metrics.incr("grounding_cache_hits")
+        return box_id, True
+
+    box_id = local_grounding(goal, frame)
+    if box_id is not None and box_id not in avoid:
+        metrics.incr("local_groundings")
+        grounding_cache.put(goal, frame.fingerprint, box_id, scope=GRID_SCOPE)
+        return box_id, False
+
+    pending = [goal]
+    batched = bool(lookahead) and frame.image_bytes is not None and GRID_FRAME
+    if batched:
+        pending += [g for g in lookahead if grounding_cache.get(g, frame.fingerprint, scope=GRID_SCOPE) is None]
+    accept = lambda box_id: grounding_accepts(goal, box_id, frame, avoid)
+
+    def attempt(model: str, use: str) -> List[str]:
+        on_checked = on_box if use == "trusted" else None
+        if on_box is not None and use == "checked":
+            # An early fast answer is dispatched only if it would pass the final check
+            on_checked = lambda box_id: on_box(box_id) if accept(box_id) else None
+        if batched:
+            return select_boxes(pending, frame.image_bytes, frame.mime_type, on_checked, model, history)
+        if COARSE_TO_FINE and frame.image is not None:
+            return [select_box_coarse_to_fine(goal, frame, on_checked, model, history)]
+        if ELEMENT_GROUNDING and frame.image is not None:
+            return [select_element(goal, frame, on_checked, model, history)]
+        return [select_box(goal, frame.image_bytes, frame.mime_type, on_box=on_checked, model=model, history=history)]
+
+    with metrics.timer("ground"):
+        box_ids = router.run("ground", attempt, lambda box_ids: accept(box_ids[0]), lambda a, b: a[0] == b[0])
+    for pending_goal, pending_box in zip(pending, box_ids):
+        if pending_box != "N/A" and box_in_grid(pending_box):
+            grounding_cache.put(pending_goal, frame.fingerprint, pending_box, scope=GRID_SCOPE)
+    return box_ids[0], False
+
+def resolve_box(state: "SessionState", goal: str, frame: Frame, on_box: Optional[Callable[[str], None]] = None) -> Tuple[str, bool]:
+    """Use the session's speculative grounding if it fits this goal and frame, else ground now"""
+    speculation = state.take_speculation()
+    if speculation is not None:
+        if speculation.matches(state.goal_index, goal, frame.fingerprint):
+            result = speculation.result()
+            if result is not None and result[0] != "N/A":
+                metrics.incr("speculation_hits")
+                log_event(None, f"🔮 Speculative grounding used for: {goal}")
+                return result
+        else:
+            speculation.cancel()
+    return ground(goal, frame, on_box, state.lookahead_goals(), state.failed_boxes.get(goal, ()), state.history.lines())
+
+def prefetch_next_goal(state: "SessionState", frame: Frame) -> None:
+    """Ground the upcoming goal on the current frame in the background, in case the UI barely changes"""
+    goal = state.current_goal()
+    # Gesture goals need no grounding
+    if PREFETCH_NEXT_GOAL and goal is not None and goal_gesture(goal) is None:
+        state.speculation = speculate(state.goal_index, goal, frame.fingerprint, ground, goal, frame,
+                                      None, None, (), state.history.lines())
 
 # ---------------------------------------------------------------------------
 # 🗂️ SessionState to manage each instruction's lifecycle with improved state tracking
 # ---------------------------------------------------------------------------
 
+# Bump when snapshot() changes shape; older snapshots are then dropped, not misread
+SNAPSHOT_VERSION = 1
+
 class SessionState:
-    def __init__(self, instruction: str):
+    def __init__(self, instruction: str, goals: Optional[List[str]] = None):
         self.instruction = instruction
-        self.goals = extract_goals(instruction)
-        print(f"Goals extracted: {self.goals}")
-        self.goal_index = 0
-        self.last_hashes: List[str] = []
-        self.consecutive_failed_attempts = 0
-        self.max_consecutive_fails = 3
-        self.swipe_attempts = 0
-        self.max_swipe_attempts = 5
-        self.alternative_actions = ["swipeUp", "swipeDown", "back"]
-        self.action_index = 0
-        self.last_action = None
-        self.goal_timestamps = {}  # Track when we started working on each goal
-        self.goal_timeout = 20  # seconds before we consider a goal stuck
+        self.goals = goals if goals is not None else plan_goals(instruction)
+        log_event(None, "Goals extracted", {"goals": self.goals})
+        self.frames = FrameHistory()
+        self.last_grounding: Optional[Tuple[str, int]] = None  # (goal, fingerprint) behind the last command
+        self.failed_boxes: Dict[str, Set[str]] = {}  # goal -> boxes whose command left the screen unchanged
+        self.speculation: Optional[Speculation] = None  # grounding started ahead of time
+        # Goal progress, recovery and per-goal deadlines
+        self.machine = GoalMachine(self.goals, on_doomed=self._on_doomed)
+        self.saved_version = -1  # machine.version last written to the session store
+        self.history = StepHistory()  # recent commands, shown to grounding calls
+        self.saved_stamp: Optional[float] = None  # session store stamp of the snapshot this state matches
+
+    @property
+    def goal_index(self) -> int:
+        return self.machine.goal_index
 
     def current_goal(self) -> Optional[str]:
-        if self.goal_index < len(self.goals):
-            return self.goals[self.goal_index]
-        return None
+        return self.machine.current_goal()
 
-    def advance_goal(self):
-        print(f"✅ Completed goal: {self.current_goal()}")
-        self.goal_index += 1
-        # Reset counters when progressing to a new goal
-        self.consecutive_failed_attempts = 0
-        self.swipe_attempts = 0
-        if self.goal_index < len(self.goals):
-            # Start tracking time for the new goal
-            self.goal_timestamps[self.goal_index] = time.time()
-            print(f"📋 Now working on: {self.current_goal()}")
-
-    def register_goal_attempt(self, success: bool, action: str):
-        """Track success/failure of attempts to achieve current goal"""
-        self.last_action = action
-        
-        if not success:
-            self.consecutive_failed_attempts += 1
-            if action in ["swipeUp", "swipeDown"]:
-                self.swipe_attempts += 1
-        else:
-            # Reset failure counters on success
-            self.consecutive_failed_attempts = 0
-            self.swipe_attempts = 0
-    
-    def get_next_alternative_action(self) -> str:
-        """Cycle through alternative actions when stuck"""
-        action = self.alternative_actions[self.action_index % len(self.alternative_actions)]
-        self.action_index += 1
-        return action
-
-    def is_goal_stuck(self) -> bool:
-        """Check if we've been trying to achieve the same goal for too long"""
-        if self.goal_index not in self.goal_timestamps:
-            self.goal_timestamps[self.goal_index] = time.time()
-            return False
-            
-        time_on_goal = time.time() - self.goal_timestamps[self.goal_index]
-        return time_on_goal > self.goal_timeout or self.consecutive_failed_attempts >= self.max_consecutive_fails
-
-    def handle_stuck_goal(self) -> None:
-        """Try to recover when stuck on a goal"""
-        print(f"⚠️ Stuck on goal: {self.current_goal()}. Attempting recovery...")
-        
-        # If we've been scrolling too much without finding the element, try going back
-        if self.swipe_attempts >= self.max_swipe_attempts // 2:  # After half of max swipe attempts
-            print("Scroll attempts not working, trying to go back")
-            self.action_index = 2  # Force next alternative_action to be "back"
-            return
-        
-        # If we've tried back and still can't find the element, skip this goal
-        if self.swipe_attempts >= self.max_swipe_attempts:
-            print("Exhausted recovery attempts, moving to next goal")
-            self.advance_goal()
-            return
-            
-        # Reset counters but stay on same goal
-        self.consecutive_failed_attempts = 0
+    def lookahead_goals(self) -> List[str]:
+        """The goals after the current one that batch grounding may resolve early"""
+        start = self.goal_index + 1
+        goals = []
+        # A gesture goal changes the screen, so nothing past it is on this frame
+        for goal in self.goals[start:start + GROUNDING_LOOKAHEAD]:
+            if goal_gesture(goal) is not None:
+                break
+            goals.append(goal)
+        return goals
 
     def is_all_done(self) -> bool:
-        return self.goal_index >= len(self.goals)
+        return self.machine.is_all_done()
+
+    def _on_doomed(self, goal_index: int) -> None:
+        # Scheduler thread: a grounding started ahead for the timed-out goal would go unused
+        self.cancel_speculation()
+
+    def close(self) -> None:
+        self.machine.close()
+        self.cancel_speculation()
+
+    def snapshot(self) -> dict:
+        """What a restarted server needs to carry on: the plan and progress, no frames or calls in flight"""
+        return {
+            "v": SNAPSHOT_VERSION,
+            "instruction": self.instruction,
+            "goals": self.goals,
+            "machine": self.machine.snapshot(),
+            "last_grounding": self.last_grounding,
+            "failed_boxes": {goal: sorted(boxes) for goal, boxes in self.failed_boxes.items()},
+            "history": self.history.snapshot(),
+        }
+
+    @classmethod
+    def restore(cls, snapshot: dict) -> "SessionState":
+        if snapshot.get("v") != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported session snapshot version {snapshot.get('v')!r}")
+        state = cls(snapshot["instruction"], goals=snapshot["goals"])
+        state.machine.restore(snapshot["machine"])
+        if snapshot["last_grounding"] is not None:
+            goal, fingerprint = snapshot["last_grounding"]
+            state.last_grounding = (goal, fingerprint)
+        state.failed_boxes = {goal: set(boxes) for goal, boxes in snapshot["failed_boxes"].items()}
+        state.history.restore(snapshot.get("history", []))
+        state.saved_version = state.machine.version
+        return state
 
-    def is_duplicate(self, img_bytes: bytes) -> bool:
-        h = sha256(img_bytes)
-        duplicate = (len(self.last_hashes) > 0 and h == self.last_hashes[-1])
-        self.last_hashes.append(h)
-        if len(self.last_hashes) > 2:
-            self.last_hashes.pop(0)
-        return duplicate
+    def take_speculation(self) -> Optional[Speculation]:
+        speculation, self.speculation = self.speculation, None
+        return speculation
+
+    def cancel_speculation(self) -> None:
+        speculation = self.take_speculation()
+        if speculation is not None:
+            speculation.cancel()
+
+    def is_unchanged(self, fingerprint: int) -> bool:
+        """Whether the frame matches the one before it (status bar masked out)"""
+        return self.frames.observe(fingerprint)
 
 # ---------------------------------------------------------------------------
 # 🌍 Store multiple sessions keyed by some identifier (like a client ID)
 # ---------------------------------------------------------------------------
 
-sessions: Dict[str, SessionState] = {}
+# Snapshots of every session, so a restart resumes them instead of planning again
+session_store = open_session_store()
+# Set when several server processes share session_store: a session held in memory may
+# have been advanced (or ended) by another process since, which the store's stamp reveals
+SHARED_SESSIONS = os.getenv("ARES_SHARED_SESSIONS", "0") == "1"
+
+def restore_session(client_id: str) -> Optional[SessionState]:
+    """A session from the store, for a client the server doesn't hold in memory (e.g. after a restart)"""
+    snapshot = session_store.load(client_id)
+    if snapshot is None:
+        return None
+    try:
+        state = SessionState.restore(snapshot)
+    except (KeyError, TypeError, ValueError) as e:
+        log_event(client_id, f"Dropping unreadable session snapshot: {e}")
+        session_store.delete(client_id)
+        return None
+    state.saved_stamp = session_store.stamp(client_id)
+    metrics.incr("sessions_restored", client_id=client_id)
+    log_event(client_id, "Session restored", {"goal_index": state.goal_index, "goals": len(state.goals)})
+    return state
+
+def close_evicted(client_id: str, state: SessionState) -> None:
+    # Evicted from memory only: the stored snapshot stays and restore_session brings it back
+    state.close()
+
+sessions = SessionManager(loader=restore_session, on_evict=close_evicted)
+
+def fresh_session(client_id: str) -> Optional[SessionState]:
+    """The client's session, reloaded from the shared store if another process moved it on"""
+    state = sessions.get(client_id)
+    if not SHARED_SESSIONS or state is None or session_store.stamp(client_id) == state.saved_stamp:
+        return state
+    metrics.incr("sessions_stale", client_id=client_id)
+    stale = sessions.discard(client_id)
+    if stale is not None:
+        stale.close()
+    return sessions.get(client_id)
+
+def checkpoint(client_id: str) -> None:
+    """Write the session's snapshot if it changed; called before the step's answer goes out"""
+    state = sessions.get(client_id)
+    if state is None or state.saved_version == state.machine.version:
+        return
+    with metrics.timer("session_save"):
+        state.saved_stamp = session_store.save(client_id, state.snapshot())
+    state.saved_version = state.machine.version
+
+def drop_session(client_id: str) -> None:
+    """Forget a session in memory and in the store"""
+    state = sessions.discard(client_id)
+    if state is not None:
+        state.close()
+    session_store.delete(client_id)
+
+def end_session(client_id: str) -> None:
+    """Drop a client's session, e.g. when its connection closes"""
+    drop_session(client_id)
+    metrics.end_session(client_id)
+
+# Read at scrape time, so caches swapped in later (e.g. by the benchmark) are reported
+metrics.register_gauge("grounding_cache", lambda: grounding_cache.stats())
+metrics.register_gauge("plan_cache", lambda: plan_cache.stats())
+metrics.register_gauge("active_sessions", lambda: len(sessions))
+metrics.register_gauge("model_routing", router.stats)
+metrics.register_gauge("session_store", lambda: session_store.stats())
 
 # ---------------------------------------------------------------------------
 # 📝 Structured logging helper
 # ---------------------------------------------------------------------------
 
 def log_action(client_id: str, message: str, data: Any = None) -> None:
-    """Structured logging for debugging and tracing execution flow"""
-    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-    log_entry = {
-        "timestamp": timestamp,
-        "client_id": client_id,
-        "message": message
-    }
-    if data:
-        log_entry["data"] = data
-    print(json.dumps(log_entry))
+    """Structured logging for debugging and tracing execution flow; queued, never blocks the step"""
+    log_event(client_id, message, data)
 
 def create_summary(state: SessionState) -> str:
     """Create a summary of the session's progress and completed goals"""
-    completed_goals = state.goals[:state.goal_index]
+    skipped = set(state.machine.skipped)
+    completed_goals = [goal for i, goal in enumerate(state.goals[:state.goal_index]) if i not in skipped]
+    skipped_goals = [state.goals[i] for i in sorted(skipped)]
     remaining_goals = state.goals[state.goal_index:]
     
     summary = f"Completed {len(completed_goals)}/{len(state.goals)} goals.\n\n"
     
     if completed_goals:
         summary += "Completed:\n" + "\n".join(f"- {goal}" for goal in completed_goals) + "\n\n"
+
+    if skipped_goals:
+        summary += "Skipped:\n" + "\n".join(f"- {goal}" for goal in skipped_goals) + "\n\n"
     
     if remaining_goals:
         summary += "Remaining:\n" + "\n".join(f"- {goal}" for goal in remaining_goals)
+    elif skipped_goals:
+        summary += f"Finished, with {len(skipped_goals)} goal(s) skipped."
     else:
         summary += "All goals completed successfully!"
     
@@ -346,7 +753,174 @@ def create_summary(state: SessionState) -> str:
 # 🎯 Main function for external call: process_automation_request
 # ---------------------------------------------------------------------------
 
-def process_request(data: dict, client_id: str) -> dict:
+# How long the phone should let the UI settle when it sends an unchanged screen
+DUPLICATE_WAIT_MS = int(os.getenv("ARES_DUPLICATE_WAIT_MS", "1000"))
+# How long the phone waits before retrying a step whose model call failed
+MODEL_ERROR_WAIT_MS = int(os.getenv("ARES_MODEL_ERROR_WAIT_MS", "2000"))
+# Most commands in one CommandBatch (gesture goals and repeats run on the phone without frames)
+MAX_BATCH_COMMANDS = int(os.getenv("ARES_MAX_BATCH_COMMANDS", "8"))
+
+# Instructions whose planning failed; retried with the client's next frame
+pending_instructions = SessionManager()
+
+def read_frame(data: dict) -> Optional[Frame]:
+    """The step's Frame, from raw bytes sent by the server or base64 from older callers"""
+    image = data.get("image")
+    if "image_bytes" in data:
+        img_bytes = data["image_bytes"]
+    elif "imageb64" in data:
+        img_bytes = base64.b64decode(data["imageb64"])
+        data["image_bytes"] = img_bytes  # decode once even if read again
+    elif image is not None and "fingerprint" in data:
+        img_bytes = None  # coarse-to-fine or elements: only the clean frame was prepared
+    else:
+        return None
+    fingerprint = data.get("fingerprint")
+    if fingerprint is None:
+        fingerprint = data["fingerprint"] = fingerprint_bytes(img_bytes)
+    mime_type = data.get("image_mime") or sniff_mime(img_bytes)
+    return Frame(img_bytes, mime_type, fingerprint, image)
+
+def start_session(instruction: str, frame: Optional[Frame]) -> SessionState:
+    """Plan the instruction; with a frame, ground the first goal while the rest of the plan streams"""
+    if not SPECULATIVE_START or frame is None:
+        return SessionState(instruction)
+
+    first: List[Speculation] = []
+
+    def on_goal(index: int, goal: str) -> None:
+        if index == 0 and goal_gesture(goal) is None:
+            # A rejected fast-tier plan is followed by the heavy one, which starts over at goal 0
+            if first and first[-1].goal == goal:
+                return
+            for stale in first:
+                stale.cancel()
+            first.append(speculate(0, goal, frame.fingerprint, ground, goal, frame))
+
+    try:
+        goals = plan_goals(instruction, on_goal=on_goal)
+    except BaseException:
+        # No session will use these groundings; free their model slots as far as possible
+        for speculation in first:
+            speculation.cancel()
+        raise
+    state = SessionState(instruction, goals=goals)
+    # Keep the grounding only if it is for the first goal of the plan that won
+    if first and goals and first[-1].goal == goals[0]:
+        state.speculation = first.pop()
+    for stale in first:
+        stale.cancel()
+    return state
+
+def dispatch_early(on_command: Optional[Callable[[dict], None]], action: str, text: Optional[str] = None) -> Optional[Callable[[str], None]]:
+    """on_box callback that hands the command to the server as soon as a streamed box_id is known"""
+    if on_command is None:
+        return None
+
+    def on_box(box_id: str) -> None:
+        if box_id != "N/A":
+            on_command(create_command_response(action, box_id=box_id, text=text))
+
+    return on_box
+
+_type_goal_re = re.compile(r"[\"'](.+?)[\"']|type (.+?)(?: in| on| into| to|$)", re.IGNORECASE)
+
+def goal_command(goal: str) -> Tuple[str, Optional[str]]:
+    """The command a goal turns into once its box is found: ("type", text) or ("tap", None)"""
+    if goal.lower().startswith("type "):
+        match = _type_goal_re.search(goal)
+        return "type", (match.group(1) or match.group(2) if match else goal[5:].strip())
+    return "tap", None
+
+# Goals that need no grounding: the gesture is the same on every screen. "Scroll down"
+# moves the content down, so the finger swipes up.
+GESTURE_GOALS = [
+    (re.compile(r"^scroll\s+down\b", re.IGNORECASE), "swipeUp"),
+    (re.compile(r"^scroll\s+up\b", re.IGNORECASE), "swipeDown"),
+    (re.compile(r"^swipe\s+up\b", re.IGNORECASE), "swipeUp"),
+    (re.compile(r"^swipe\s+down\b", re.IGNORECASE), "swipeDown"),
+    (re.compile(r"^(?:go|navigate|press)\s+back\b", re.IGNORECASE), "back"),
+]
+_repeat_re = re.compile(r"\b(\d+)\s+times\b|\b(twice)\b", re.IGNORECASE)
+
+def goal_gesture(goal: str) -> Optional[Tuple[str, int]]:
+    """(action, times) for a goal that is a fixed gesture, e.g. "Scroll down 5 times"; else None"""
+    for pattern, action in GESTURE_GOALS:
+        if pattern.search(goal.strip()):
+            match = _repeat_re.search(goal)
+            times = 2 if match and match.group(2) else int(match.group(1)) if match else 1
+            return action, max(1, min(times, MAX_BATCH_COMMANDS))
+    return None
+
+def gesture_commands(state: SessionState, client_id: str) -> dict:
+    """Complete the current gesture goal and the ones right after it in one response
+
+    A run of gesture goals (or one repeated gesture) goes out as a CommandBatch, so the
+    phone plays it without a frame and a server round trip per gesture.
+    """
+    commands: List[dict] = []
+    while not state.is_all_done():
+        goal = state.current_goal()
+        gesture = goal_gesture(goal)
+        if gesture is None or (commands and len(commands) + gesture[1] > MAX_BATCH_COMMANDS):
+            break
+        action, times = gesture
+        if state.machine.handle("found").effect != "act":
+            break
+        state.history.record(goal, action)
+        commands.extend(create_command_response(action)["command"] for _ in range(times))
+    state.last_grounding = None  # nothing grounded: an unchanged screen invalidates no cache entry
+    log_action(client_id, f"Sending {len(commands)} gesture(s)", {"actions": [command["action"] for command in commands]})
+    if len(commands) == 1:
+        return CommandResponse(command=commands[0], isDone=False).model_dump()
+    metrics.incr("command_batches")
+    metrics.incr("batched_commands", len(commands))
+    return create_command_batch(commands)
+
+class Grounding(NamedTuple):
+    """A goal's command once its box is known, carried from the "ground" effect to "act" """
+    goal: str
+    action: str
+    text: Optional[str]
+    box_id: str
+
+def grounded_here(state: SessionState, frame: Frame) -> bool:
+    """Whether the current goal already has a box on this screen, e.g. from a lookahead batch
+
+    Then an unchanged screen is expected (the last command only focused or selected
+    something) and the next command can go out without another model call.
+    """
+    goal = state.current_goal()
+    return bool(GROUNDING_LOOKAHEAD) and goal is not None and grounding_cache.get(goal, frame.fingerprint, scope=GRID_SCOPE) is not None
+
+def process_request(data: dict, client_id: str, on_command: Optional[Callable[[dict], None]] = None) -> dict:
+    """One step; with on_command, tap/type commands may be sent early from the streamed model answer"""
+    with session_scope(client_id), metrics.timer("process_request"):
+        metrics.step(client_id)
+        try:
+            response = run_step(data, client_id, on_command)
+            checkpoint(client_id)
+            return response
+        except ModelError as e:
+            # The session survives: nothing advanced, so the next frame simply retries the step
+            log_action(client_id, "Model call failed", {"error": str(e)})
+            state = sessions.get(client_id)
+            if state is not None and "fingerprint" in data:
+                state.frames.forget(data["fingerprint"])  # the retry frame isn't a duplicate
+            if "instruction" in data:
+                drop_session(client_id)
+                pending_instructions[client_id] = data["instruction"]
+            response = create_command_response("wait", duration=MODEL_ERROR_WAIT_MS)
+            response["warning"] = "Model unavailable, retrying"
+            return response
+
+def run_step(data: dict, client_id: str, on_command: Optional[Callable[[dict], None]] = None) -> dict:
+    fresh_session(client_id)
+    if "instruction" not in data:
+        pending = pending_instructions.get(client_id)
+        if pending is not None:
+            pending_instructions.discard(client_id)
+            data["instruction"] = pending
     log_action(client_id, "Processing request", {"request_type": "instruction" if "instruction" in data else "step"})
     
     # Initialize a new session if this is a new instruction
@@ -355,102 +929,117 @@ def process_request(data: dict, client_id: str) -> dict:
         
         # Check if this is a request for summary
         if any(keyword in instruction.lower() for keyword in ["summary", "update", "tell me", "progress"]):
-            if client_id in sessions:
-                state = sessions[client_id]
+            state = sessions.get(client_id)
+            if state is not None:
                 summary = create_summary(state)
                 log_action(client_id, "Providing summary", {"summary": summary})
                 return create_command_response("announce", text=summary)
             else:
                 return {"error": "No active session to summarize"}
         
-        sessions[client_id] = SessionState(instruction)
+        previous = sessions.get(client_id)
+        if previous is not None:
+            previous.close()
+        sessions[client_id] = start_session(instruction, read_frame(data))
         log_action(client_id, f"New session created for instruction: {instruction}")
 
     # Validate session
-    if client_id not in sessions:
+    state = sessions.get(client_id)
+    if state is None:
         return {"error": "No active session for this client_id. Send 'instruction' first."}
 
-    state = sessions[client_id]
-
     # Validate image input
-    if "imageb64" not in data:
-        return {"error": "No 'imageb64' field provided"}
-
-    img_b64 = data["imageb64"]
-    img_bytes = base64.b64decode(img_b64)
-
-    # Skip duplicate screenshots to avoid loops
-    if state.is_duplicate(img_bytes):
-        log_action(client_id, "Duplicate screenshot detected")
-        return {"warning": "Duplicate screenshot received"}
+    frame = read_frame(data)
+    if frame is None:
+        return {"error": "No 'image_bytes' or 'imageb64' field provided"}
+    fingerprint = frame.fingerprint
 
     # Check if all goals are completed
     if state.is_all_done():
         log_action(client_id, "All goals completed")
         return {"info": "All goals already completed", "isDone": True}
 
-    # Get current goal
-    goal = state.current_goal()
-    if not goal:
-        log_action(client_id, "No goal to process")
-        return {"info": "No goal to process. Possibly done."}
-    
-    log_action(client_id, f"Working on goal: {goal}", {"goal_index": state.goal_index})
+    # A screen that looks like one we just saw gets no model call: the machine decides
+    # between letting the UI settle and the next recovery gesture
+    unchanged = state.is_unchanged(fingerprint) and not grounded_here(state, frame)
+    if unchanged:
+        metrics.incr("duplicates")
+        # The last command didn't change the screen; don't trust its cached decision again
+        if state.last_grounding is not None:
+            failed = grounding_cache.invalidate(*state.last_grounding, scope=GRID_SCOPE)
+            if failed is not None:
+                state.failed_boxes.setdefault(state.last_grounding[0], set()).add(failed)
+            state.last_grounding = None
+            state.history.mark_unchanged()
+
+    event = "unchanged" if unchanged else "frame"
+    grounded: Optional[Grounding] = None  # what "ground" found, for the "act" that follows it
+    while True:
+        decision = state.machine.handle(event)
+        if decision.effect == "wait":
+            log_action(client_id, "Duplicate screenshot detected")
+            response = create_command_response("wait", duration=DUPLICATE_WAIT_MS)
+            response["warning"] = "Duplicate screenshot received"
+            return response
+        if decision.effect == "recover":
+            log_action(client_id, f"Element not found. Trying {decision.action}", {"recoveries": state.machine.recoveries})
+            state.history.record(state.current_goal(), decision.action)
+            return create_command_response(decision.action)
+        if decision.effect == "act":
+            if grounded is None:
+                raise RuntimeError(f"Goal machine acted without a grounding (event {event!r})")
+            log_action(client_id, f"Element found. Sending {grounded.action} on box: {grounded.box_id}")
+            state.last_grounding = (grounded.goal, fingerprint)
+            state.history.record(grounded.goal, grounded.action, grounded.box_id)
+            prefetch_next_goal(state, frame)
+            return create_command_response(grounded.action, box_id=grounded.box_id, text=grounded.text)
+        if decision.effect == "skip":
+            # The machine moved on; the next goal gets a look at this same screen
+            if state.is_all_done():
+                return {"info": "Recovery completed all goals", "isDone": True}
+            event = "frame"
+            continue
 
-    # Check if we're stuck on the current goal
-    if state.is_goal_stuck():
-        log_action(client_id, "Detected stuck state")
-        state.handle_stuck_goal()
-        # Get updated goal after handling stuck state
+        # "ground": ask the model (or a cache) where the goal's element is
         goal = state.current_goal()
-        if not goal:
-            return {"info": "Recovery completed all goals", "isDone": True}
+        if goal_gesture(goal) is not None:
+            return gesture_commands(state, client_id)
+        action, text = goal_command(goal)
+        log_action(client_id, f"Working on goal: {goal}", {"goal_index": state.goal_index, "action": action})
+        box_id, cache_hit = resolve_box(state, goal, frame, dispatch_early(on_command, action, text))
+        log_action(client_id, "Box selection result", {"box_id": box_id, "cache_hit": cache_hit})
+        grounded = Grounding(goal, action, text, box_id)
+        event = "found" if box_id != "N/A" else "not_found"
 
-    # Handle special "Type" prefix goals
-    if goal.lower().startswith("type "):
-        match = re.search(r"[\"'](.+?)[\"']|type (.+?)(?: in| on| into| to|$)", goal, re.IGNORECASE)
-        typed_text = match.group(1) or match.group(2) if match else goal[5:].strip()
-        # typed_text = typed_text.replace('"','')s
-        log_action(client_id, f"Executing type command: {typed_text}")
+# ---------------------------------------------------------------------------
+# ⚡ Async entry point for the websocket server
+# ---------------------------------------------------------------------------
 
-        box_id = select_box(goal, img_b64)
-        log_action(client_id, f"Box selected for typing: {box_id}")
+# One lock per client keeps its steps ordered; entries vanish once unused
+_client_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
 
-        if box_id != "N/A":
-            state.advance_goal()
-            state.register_goal_attempt(success=True, action="type")
-            return create_command_response("type", text=typed_text, box_id=box_id)
-        else:
-            if state.swipe_attempts < state.max_swipe_attempts:
-                action = state.get_next_alternative_action()
-                log_action(client_id, f"Text input target not found. Trying {action}", {"swipe_attempt": state.swipe_attempts + 1})
-                state.register_goal_attempt(success=False, action=action)
-                return create_command_response(action)
-            else:
-                log_action(client_id, "Max scroll attempts reached for text input, skipping")
-                state.advance_goal()
-                return create_command_response("swipeUp")
-
-    # Select box for current goal
-    log_action(client_id, f"Analyzing screenshot to find element for: {goal}")
-    box_id = select_box(goal, img_b64)
-    log_action(client_id, f"Box selection result", {"box_id": box_id})
-
-    # Execute taps if box is found
-    if box_id != "N/A":
-        log_action(client_id, f"Element found. Tapping box: {box_id}")
-        state.advance_goal()
-        state.register_goal_attempt(success=True, action="tap")
-        return create_command_response("tap", box_id=box_id)
-    else:
-        # Element not found, try scrolling
-        if state.swipe_attempts < state.max_swipe_attempts:
-            action = state.get_next_alternative_action()
-            log_action(client_id, f"Element not found. Trying {action}", {"swipe_attempt": state.swipe_attempts + 1})
-            state.register_goal_attempt(success=False, action=action)
-            return create_command_response(action)
-        else:
-            # If we've scrolled too much without finding the element, skip this goal
-            log_action(client_id, "Max scroll attempts reached, skipping goal")
-            state.advance_goal()
-            return create_command_response("swipeUp")  # One more scroll before next goal
\ No newline at end of file
+async def process_request_async(data: dict, client_id: str,
+                                on_command: Optional[Callable[[dict], Awaitable[None]]] = None) -> dict:
+    """Run process_request on the step pool so the event loop keeps serving other clients
+
+    on_command(response) is awaited on the event loop for each early-dispatched command;
+    all of them have been sent by the time the final response is returned.
+    """
+    lock = _client_locks.get(client_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _client_locks[client_id] = lock
+
+    async with lock:
+        loop = asyncio.get_running_loop()
+        dispatched = []
+
+        def emit_early(response: dict) -> None:
+            # Step pool thread -> event loop
+            dispatched.append(asyncio.run_coroutine_threadsafe(on_command(response), loop))
+
+        emit = emit_early if on_command is not None else None
+        response = await loop.run_in_executor(_step_executor, process_request, data, client_id, emit)
+        for future in dispatched:
+            await asyncio.wrap_future(future)
+        return response
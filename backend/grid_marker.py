@@ -1,43 +1,115 @@
+import logging
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
 from PIL import Image, ImageDraw, ImageFont
 
-def apply_grid_overlay(image: Image.Image) -> Image.Image:
-    image = image.copy()
-    draw = ImageDraw.Draw(image)
-    width, height = image.size
+from grid_utils import TOTAL_COLUMNS, TOTAL_ROWS, geometry_for
+from telemetry import log_event
+
+# Candidate fonts, first match wins; ARES_FONT_PATH overrides them all
+FONT_CANDIDATES = [
+    "C:/Windows/Fonts/Arial.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+    "/usr/share/fonts/liberation/LiberationSans-Regular.ttf",
+    "/Library/Fonts/Arial.ttf",
+    "/System/Library/Fonts/Supplemental/Arial.ttf",
+]
+
+
+@dataclass(frozen=True)
+class GridStyle:
+    outline_color: str = "lime"
+    text_color: str = "magenta"
+    shadow_color: str = "black"
+    line_width: int = 2
+    font_size: int = 40
+    shadow_offset: int = 2
+
+
+DEFAULT_STYLE = GridStyle()
+
+
+def find_font_path() -> Optional[str]:
+    override = os.getenv("ARES_FONT_PATH")
+    if override and os.path.exists(override):
+        return override
+    for path in FONT_CANDIDATES:
+        if os.path.exists(path):
+            return path
+    return None
 
-    # Grid dimensions
-    rows, cols = 20, 10
-    cell_width = width // cols
-    cell_height = height // rows
 
-    # Font setup
-    font_path = "C:/Windows/Fonts/Arial.ttf"  # Change if needed
-    font = ImageFont.truetype(font_path, 40)
+@lru_cache(maxsize=8)
+def load_font(size: int) -> ImageFont.ImageFont:
+    path = find_font_path()
+    if path is None:
+        log_event(None, "No TrueType font found, falling back to PIL's default font", {"size": size}, level=logging.WARNING)
+        return ImageFont.load_default(size)
+    return ImageFont.truetype(path, size)
 
-    # Colors
-    outline_color = "lime"
-    text_color = "magenta"
+
+def draw_grid(draw: ImageDraw.ImageDraw, width: int, height: int, rows: int, cols: int, style: GridStyle) -> None:
+    # Float cell edges from the shared geometry, so cells tile the frame exactly
+    geometry = geometry_for(width, height, rows, cols)
+    xs = [round(x) for x in geometry.x_edges]
+    ys = [round(y) for y in geometry.y_edges]
+    # Shrink labels on finer grids so they stay inside their cells
+    font = load_font(min(style.font_size, int(geometry.cell_height * 0.6)))
 
     # Draw grid and labels
     for row in range(rows):
-        letter = chr(97 + row)
         for col in range(cols):
-            x0 = col * cell_width
-            y0 = row * cell_height
-            x1 = x0 + cell_width
-            y1 = y0 + cell_height
+            x0, x1 = xs[col], xs[col + 1]
+            y0, y1 = ys[row], ys[row + 1]
+            cell_width = x1 - x0
+            cell_height = y1 - y0
 
-            draw.rectangle([x0, y0, x1, y1], outline=outline_color, width=2)
+            draw.rectangle([x0, y0, x1, y1], outline=style.outline_color, width=style.line_width)
 
-            label = f"{letter}{col}"
+            label = geometry.label(row, col)
             text_bbox = draw.textbbox((0, 0), label, font=font)
             text_width = text_bbox[2] - text_bbox[0]
             text_height = text_bbox[3] - text_bbox[1]
             text_x = x0 + (cell_width - text_width) / 2
             text_y = y0 + (cell_height - text_height) / 2
 
-            shadow_offset = 2
-            draw.text((text_x + shadow_offset, text_y + shadow_offset), label, fill="black", font=font)
-            draw.text((text_x, text_y), label, fill=text_color, font=font)
+            offset = style.shadow_offset
+            draw.text((text_x + offset, text_y + offset), label, fill=style.shadow_color, font=font)
+            draw.text((text_x, text_y), label, fill=style.text_color, font=font)
+
+
+@lru_cache(maxsize=16)
+def grid_layer(width: int, height: int, rows: int, cols: int, style: GridStyle = DEFAULT_STYLE) -> Image.Image:
+    """Transparent RGBA layer holding the grid; rendered once per (size, grid, style)"""
+    layer = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    draw_grid(ImageDraw.Draw(layer), width, height, rows, cols, style)
+    return layer
 
+
+def apply_grid_overlay(image: Image.Image, rows: int = TOTAL_ROWS, cols: int = TOTAL_COLUMNS, style: GridStyle = DEFAULT_STYLE) -> Image.Image:
+    width, height = image.size
+    layer = grid_layer(width, height, rows, cols, style)
+    # Single composite pass; the layer's alpha acts as the paste mask
+    image = image.copy()
+    image.paste(layer, (0, 0), layer)
+    return image
+
+
+def apply_box_overlay(image: Image.Image, boxes: Sequence[Tuple[float, float, float, float]], labels: List[str],
+                      style: GridStyle = DEFAULT_STYLE) -> Image.Image:
+    """Outline each box and label it in its top-left corner (detected elements instead of a grid)"""
+    image = image.copy()
+    draw = ImageDraw.Draw(image)
+    font = load_font(max(12, style.font_size // 2))
+    offset = style.shadow_offset
+    for (x0, y0, x1, y1), label in zip(boxes, labels):
+        draw.rectangle([x0, y0, x1, y1], outline=style.outline_color, width=style.line_width)
+        text_x, text_y = x0 + style.line_width + 2, y0 + style.line_width
+        draw.text((text_x + offset, text_y + offset), label, fill=style.shadow_color, font=font)
+        draw.text((text_x, text_y), label, fill=style.text_color, font=font)
     return image
@@ -1,21 +1,182 @@
+import os
+import re
+from dataclasses import dataclass
+from functools import cached_property, lru_cache
+from typing import Dict, Tuple
+
+import numpy as np
+
+# Legacy default device resolution, used when the phone doesn't report its own
 SCREEN_WIDTH = 1084
 SCREEN_HEIGHT = 2412
-TOTAL_COLUMNS = 10
-TOTAL_ROWS = 20
+TOTAL_COLUMNS = int(os.getenv("ARES_GRID_COLS", "10"))
+TOTAL_ROWS = int(os.getenv("ARES_GRID_ROWS", "20"))
+# Coarse-to-fine grounding: pick a region on a coarse grid, then a cell on a fine grid inside it
+COARSE_COLUMNS = int(os.getenv("ARES_COARSE_COLS", "3"))
+COARSE_ROWS = int(os.getenv("ARES_COARSE_ROWS", "5"))
+FINE_COLUMNS = int(os.getenv("ARES_FINE_COLS", "4"))
+FINE_ROWS = int(os.getenv("ARES_FINE_ROWS", "6"))
+# Each region is padded by this fraction of a coarse cell, so elements on a border stay whole
+REGION_MARGIN = float(os.getenv("ARES_REGION_MARGIN", "0.25"))
 
-def get_coordinate(unique_str: str) -> tuple[int, int]:
-    """
-    Converts a grid cell name (e.g., 'b3') to screen midpoint coordinates.
-    Returns: (x, y) as integers
+# Row letters run a..z, aa..az, ...; columns are plain integers (a0, b12, aa3).
+# Coarse-to-fine ids join the region and the cell inside it: "c1/b3"
+LABEL_RE = re.compile(r"^([a-z]+)([0-9]+)$")
+REGION_SEPARATOR = "/"
+BOX_ID_PATTERN = r"^([a-z]+[0-9]+|N/A)$"
+# Element grounding resolves a detected element to its centre, as per-mille of the frame: "@512,431"
+POINT_PREFIX = "@"
+POINT_RE = re.compile(r"^@([0-9]+),([0-9]+)$")
+
+
+def row_label(row: int) -> str:
+    label = ""
+    row += 1
+    while row:
+        row, rem = divmod(row - 1, 26)
+        label = chr(97 + rem) + label
+    return label
+
+
+def row_index(label: str) -> int:
+    index = 0
+    for ch in label:
+        index = index * 26 + (ord(ch) - 96)
+    return index - 1
+
+
+@dataclass(frozen=True)
+class GridGeometry:
+    """A rows x cols grid laid over a (left, top, width, height) rectangle of the screen
+
+    The same object drives the overlay (pixel edges) and the tap lookup (cell centres),
+    so the labels the model reads and the coordinates the phone taps cannot disagree.
     """
-    cell_width = SCREEN_WIDTH / TOTAL_COLUMNS
-    cell_height = SCREEN_HEIGHT / TOTAL_ROWS
 
-    row_char = unique_str[0].lower()
-    col_num = int(unique_str[1])
+    width: float
+    height: float
+    rows: int = TOTAL_ROWS
+    cols: int = TOTAL_COLUMNS
+    left: float = 0.0
+    top: float = 0.0
+
+    @property
+    def cell_width(self) -> float:
+        return self.width / self.cols
+
+    @property
+    def cell_height(self) -> float:
+        return self.height / self.rows
+
+    @cached_property
+    def x_edges(self) -> np.ndarray:
+        return self.left + np.arange(self.cols + 1) * self.cell_width
+
+    @cached_property
+    def y_edges(self) -> np.ndarray:
+        return self.top + np.arange(self.rows + 1) * self.cell_height
+
+    @cached_property
+    def centers(self) -> Dict[str, Tuple[int, int]]:
+        """label -> (x, y) for every cell, computed once for the whole grid"""
+        xs = np.rint((self.x_edges[:-1] + self.x_edges[1:]) / 2).astype(int)
+        ys = np.rint((self.y_edges[:-1] + self.y_edges[1:]) / 2).astype(int)
+        return {
+            self.label(row, col): (int(xs[col]), int(ys[row]))
+            for row in range(self.rows)
+            for col in range(self.cols)
+        }
+
+    def label(self, row: int, col: int) -> str:
+        return f"{row_label(row)}{col}"
+
+    def parse(self, label: str) -> Tuple[int, int]:
+        """'b12' -> (row, col); raises ValueError for malformed or out-of-grid labels"""
+        match = LABEL_RE.match(label.strip().lower())
+        if not match:
+            raise ValueError(f"Malformed grid label: {label!r}")
+        row, col = row_index(match.group(1)), int(match.group(2))
+        if not (0 <= row < self.rows and 0 <= col < self.cols):
+            raise ValueError(f"Grid label {label!r} is outside a {self.rows}x{self.cols} grid")
+        return row, col
+
+    def contains(self, label: str) -> bool:
+        try:
+            self.parse(label)
+            return True
+        except ValueError:
+            return False
 
-    row_index = ord(row_char) - ord('a')
-    x_mid = (col_num + 0.5) * cell_width
-    y_mid = (row_index + 0.5) * cell_height
+    def center(self, label: str) -> Tuple[int, int]:
+        self.parse(label)  # validates and gives a precise error
+        return self.centers[label.strip().lower()]
 
-    return int(x_mid), int(y_mid)
+    def cell_bounds(self, label: str) -> Tuple[float, float, float, float]:
+        row, col = self.parse(label)
+        return self.x_edges[col], self.y_edges[row], self.x_edges[col + 1], self.y_edges[row + 1]
+
+    def regrid(self, rows: int, cols: int) -> "GridGeometry":
+        """Same rectangle, different grid"""
+        return geometry_for(self.width, self.height, rows, cols, self.left, self.top)
+
+    def region_bounds(self, label: str, margin: float = REGION_MARGIN) -> Tuple[float, float, float, float]:
+        """A cell grown by margin (fraction of a cell) on every side, clipped to the grid"""
+        x0, y0, x1, y1 = self.cell_bounds(label)
+        pad_x, pad_y = margin * self.cell_width, margin * self.cell_height
+        return (
+            float(max(self.left, x0 - pad_x)),
+            float(max(self.top, y0 - pad_y)),
+            float(min(self.left + self.width, x1 + pad_x)),
+            float(min(self.top + self.height, y1 + pad_y)),
+        )
+
+    def subgrid(self, label: str, rows: int = FINE_ROWS, cols: int = FINE_COLUMNS, margin: float = REGION_MARGIN) -> "GridGeometry":
+        """The fine grid laid over one (padded) cell of this grid"""
+        x0, y0, x1, y1 = self.region_bounds(label, margin)
+        return geometry_for(x1 - x0, y1 - y0, rows, cols, x0, y0)
+
+
+@lru_cache(maxsize=64)
+def geometry_for(width: float, height: float, rows: int = TOTAL_ROWS, cols: int = TOTAL_COLUMNS, left: float = 0.0, top: float = 0.0) -> GridGeometry:
+    """Shared geometry per screen size, so each centre table is built once"""
+    return GridGeometry(width, height, rows, cols, left, top)
+
+
+DEFAULT_GEOMETRY = geometry_for(SCREEN_WIDTH, SCREEN_HEIGHT)
+
+
+def point_id(x: float, y: float, width: float, height: float) -> str:
+    """Id of a point (x, y) on a width x height frame, independent of the frame's resolution"""
+    return f"{POINT_PREFIX}{round(1000 * x / width)},{round(1000 * y / height)}"
+
+
+def box_in_grid(box_id: str, rows: int = TOTAL_ROWS, cols: int = TOTAL_COLUMNS) -> bool:
+    """Whether a model answer names a real cell: 'b3' on a rows x cols grid, or 'c1/b3' on the coarse and fine grids
+
+    Point ids ('@512,431') are accepted when they fall inside the frame.
+    """
+    point = POINT_RE.match(box_id)
+    if point:
+        return all(int(v) <= 1000 for v in point.groups())
+    if REGION_SEPARATOR in box_id:
+        region, cell = box_id.split(REGION_SEPARATOR, 1)
+        return box_in_grid(region, COARSE_ROWS, COARSE_COLUMNS) and box_in_grid(cell, FINE_ROWS, FINE_COLUMNS)
+    # contains() forgives case and whitespace; an answer that needs forgiving is not a clean one
+    return LABEL_RE.match(box_id) is not None and DEFAULT_GEOMETRY.regrid(rows, cols).contains(box_id)
+
+
+def get_coordinate(unique_str: str, geometry: GridGeometry = DEFAULT_GEOMETRY) -> tuple[int, int]:
+    """
+    Converts a grid cell name (e.g., 'b3', 'c12', or coarse-to-fine 'c1/b3') to screen midpoint coordinates.
+    Point ids ('@512,431') map straight onto the geometry's rectangle.
+    Returns: (x, y) as integers
+    """
+    point = POINT_RE.match(unique_str)
+    if point:
+        x, y = (int(v) / 1000 for v in point.groups())
+        return round(geometry.left + x * geometry.width), round(geometry.top + y * geometry.height)
+    if REGION_SEPARATOR in unique_str:
+        region, cell = unique_str.split(REGION_SEPARATOR, 1)
+        coarse = geometry.regrid(COARSE_ROWS, COARSE_COLUMNS)
+        return coarse.subgrid(region).center(cell)
+    return geometry.center(unique_str)
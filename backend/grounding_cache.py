@@ -0,0 +1,153 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+from frame_similarity import hamming
+from kv_store import SqliteKV
+
+# ---------------------------------------------------------------------------
+# 🎯 Memoized grounding: (normalized goal, screen fingerprint) -> box_id
+# ---------------------------------------------------------------------------
+
+GROUNDING_CACHE_SIZE = int(os.getenv("ARES_GROUNDING_CACHE_SIZE", "5000"))
+GROUNDING_CACHE_TTL = float(os.getenv("ARES_GROUNDING_CACHE_TTL", str(7 * 24 * 3600)))  # seconds
+GROUNDING_MATCH_THRESHOLD = int(os.getenv("ARES_GROUNDING_MATCH_THRESHOLD", "10"))  # max differing bits
+GROUNDING_CACHE_PATH = os.getenv("ARES_GROUNDING_CACHE_PATH")  # unset = memory only
+
+_KEY_SEP = "\x1f"
+
+
+def normalize_goal(goal: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace: "Tap 'OK'." == "tap ok" """
+    return " ".join(re.sub(r"[^\w\s]", " ", goal.lower()).split())
+
+
+def _cache_key(goal: str, scope: str) -> str:
+    # Scope separates answers that aren't interchangeable, e.g. box ids from different grids
+    return f"{scope}|{normalize_goal(goal)}" if scope else normalize_goal(goal)
+
+
+class GroundingCache:
+    """LRU + TTL cache of grounding decisions, matched on perceptual screen similarity"""
+
+    def __init__(
+        self,
+        max_entries: int = GROUNDING_CACHE_SIZE,
+        ttl: float = GROUNDING_CACHE_TTL,
+        threshold: int = GROUNDING_MATCH_THRESHOLD,
+        path: Optional[str] = GROUNDING_CACHE_PATH,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries: "OrderedDict[Tuple[str, int], Tuple[str, float]]" = OrderedDict()
+        self._by_goal: Dict[str, Set[int]] = {}
+        self._lock = threading.Lock()
+        self._store = SqliteKV(path, "grounding") if path else None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self._store is not None:
+            self._load()
+
+    def _load(self) -> None:
+        now = time.time()
+        rows = []
+        for key, value in self._store.items():
+            goal, fp_hex = key.split(_KEY_SEP)
+            rows.append((value["ts"], goal, int(fp_hex, 16), value["box_id"]))
+        rows.sort()
+        stale, live = rows[:-self.max_entries], rows[-self.max_entries:]
+        # Oldest first so the LRU order survives the restart
+        for ts, goal, fp, box_id in live:
+            if now - ts <= self.ttl:
+                self._insert(goal, fp, box_id, ts)
+            else:
+                stale.append((ts, goal, fp, box_id))
+        for _, goal, fp, _ in stale:
+            self._store.delete(f"{goal}{_KEY_SEP}{fp:x}")
+
+    def _insert(self, goal: str, fp: int, box_id: str, ts: float) -> None:
+        self._entries[(goal, fp)] = (box_id, ts)
+        self._entries.move_to_end((goal, fp))
+        self._by_goal.setdefault(goal, set()).add(fp)
+
+    def _remove(self, goal: str, fp: int) -> None:
+        self._entries.pop((goal, fp), None)
+        fps = self._by_goal.get(goal)
+        if fps is not None:
+            fps.discard(fp)
+            if not fps:
+                del self._by_goal[goal]
+        if self._store is not None:
+            self._store.delete(f"{goal}{_KEY_SEP}{fp:x}")
+
+    def _find(self, goal: str, fp: int, now: float, threshold: Optional[int] = None) -> Optional[int]:
+        best, best_distance = None, (self.threshold if threshold is None else threshold) + 1
+        for cached_fp in list(self._by_goal.get(goal, ())):
+            _, ts = self._entries[(goal, cached_fp)]
+            if now - ts > self.ttl:
+                self._remove(goal, cached_fp)
+                self.evictions += 1
+                continue
+            distance = hamming(cached_fp, fp)
+            if distance < best_distance:
+                best, best_distance = cached_fp, distance
+        return best
+
+    def get(self, goal: str, fp: int, scope: str = "") -> Optional[str]:
+        key = _cache_key(goal, scope)
+        with self._lock:
+            match = self._find(key, fp, time.time())
+            if match is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end((key, match))
+            return self._entries[(key, match)][0]
+
+    def put(self, goal: str, fp: int, box_id: str, scope: str = "") -> None:
+        key = _cache_key(goal, scope)
+        now = time.time()
+        with self._lock:
+            self._insert(key, fp, box_id, now)
+            while len(self._entries) > self.max_entries:
+                old_goal, old_fp = next(iter(self._entries))
+                self._remove(old_goal, old_fp)
+                self.evictions += 1
+        if self._store is not None:
+            self._store.put(f"{key}{_KEY_SEP}{fp:x}", {"box_id": box_id, "ts": now})
+
+    def nearest(self, goal: str, fp: int, max_distance: int, scope: str = "") -> Optional[str]:
+        """The decision for this goal on the closest screen within max_distance; no hit/miss accounting"""
+        key = _cache_key(goal, scope)
+        with self._lock:
+            match = self._find(key, fp, time.time(), max_distance)
+            return None if match is None else self._entries[(key, match)][0]
+
+    def invalidate(self, goal: str, fp: int, scope: str = "") -> Optional[str]:
+        """Forget the decision used for this goal on this screen, e.g. after a tap that did nothing
+
+        Returns the box_id that was forgotten, if any.
+        """
+        key = _cache_key(goal, scope)
+        with self._lock:
+            match = self._find(key, fp, time.time())
+            if match is None:
+                return None
+            box_id = self._entries[(key, match)][0]
+            self._remove(key, match)
+            return box_id
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
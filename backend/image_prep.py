@@ -0,0 +1,203 @@
+import math
+import os
+import time
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image
+
+from frame_similarity import fingerprint
+from grid_marker import apply_box_overlay, apply_grid_overlay
+from grid_utils import COARSE_COLUMNS, COARSE_ROWS, FINE_COLUMNS, FINE_ROWS, TOTAL_COLUMNS, TOTAL_ROWS, geometry_for
+
+# ---------------------------------------------------------------------------
+# 🖼️ Frame preparation: decode -> fingerprint -> crop/resize -> grid -> encode
+# ---------------------------------------------------------------------------
+# Every byte here is upload time and vision tokens, so size/format are per-deployment knobs.
+
+MIME_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp", "png": "image/png"}
+
+
+def _crop_from_env() -> Optional[Tuple[float, float, float, float]]:
+    raw = os.getenv("ARES_IMAGE_CROP")  # "left,top,right,bottom" as fractions of the frame
+    if not raw:
+        return None
+    left, top, right, bottom = (float(v) for v in raw.split(","))
+    return left, top, right, bottom
+
+
+@dataclass(frozen=True)
+class ImagePrepConfig:
+    # "fixed": resize to width x height; "tile": largest scale that fits max_tiles model tiles;
+    # "none": keep the phone's resolution
+    resize: str = "fixed"
+    width: int = 720
+    height: int = 1600
+    tile_size: int = 768  # Gemini bills images per 768x768 tile
+    max_tiles: int = 2
+    format: str = "jpeg"
+    quality: int = 80
+    grayscale: bool = False
+    crop: Optional[Tuple[float, float, float, float]] = None
+
+    @property
+    def mime_type(self) -> str:
+        return MIME_TYPES[self.format]
+
+    @classmethod
+    def from_env(cls) -> "ImagePrepConfig":
+        return cls(
+            resize=os.getenv("ARES_IMAGE_RESIZE", "fixed"),
+            width=int(os.getenv("ARES_IMAGE_WIDTH", "720")),
+            height=int(os.getenv("ARES_IMAGE_HEIGHT", "1600")),
+            tile_size=int(os.getenv("ARES_TILE_SIZE", "768")),
+            max_tiles=int(os.getenv("ARES_MAX_TILES", "2")),
+            format=os.getenv("ARES_IMAGE_FORMAT", "jpeg").lower(),
+            quality=int(os.getenv("ARES_IMAGE_QUALITY", "80")),
+            grayscale=os.getenv("ARES_IMAGE_GRAYSCALE", "0") == "1",
+            crop=_crop_from_env(),
+        )
+
+
+PREP_CONFIG = ImagePrepConfig.from_env()
+# The coarse pass of coarse-to-fine grounding only has to tell regions apart
+COARSE_SCALE = float(os.getenv("ARES_COARSE_SCALE", "0.5"))
+
+
+def crop_box(size: Tuple[int, int], crop: Optional[Tuple[float, float, float, float]]) -> Tuple[int, int, int, int]:
+    """Pixel box for a fractional crop; the whole frame when crop is None"""
+    width, height = size
+    if crop is None:
+        return 0, 0, width, height
+    left, top, right, bottom = crop
+    return round(left * width), round(top * height), round(right * width), round(bottom * height)
+
+
+def target_size(size: Tuple[int, int], config: ImagePrepConfig) -> Tuple[int, int]:
+    width, height = size
+    if config.resize == "fixed":
+        return config.width, config.height
+    if config.resize == "tile":
+        # Best scale (<= 1) over every tile layout that stays within the budget
+        scale = 0.0
+        for cols in range(1, config.max_tiles + 1):
+            rows = config.max_tiles // cols
+            scale = max(scale, min(cols * config.tile_size / width, rows * config.tile_size / height))
+        scale = min(1.0, scale)
+        return max(1, math.floor(width * scale)), max(1, math.floor(height * scale))
+    return width, height
+
+
+def encode_image(image: Image.Image, config: ImagePrepConfig) -> bytes:
+    buffer = BytesIO()
+    if config.format == "png":
+        image.save(buffer, format="PNG")
+    else:
+        image.save(buffer, format=config.format.upper(), quality=config.quality)
+    return buffer.getvalue()
+
+
+def sniff_mime(data: bytes) -> str:
+    """MIME type from magic bytes, for images that arrive without one"""
+    head = bytes(data[:12])
+    if head.startswith(b"\x89PNG"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+def render_grid(image: Image.Image, rows: int, cols: int, config: ImagePrepConfig = PREP_CONFIG,
+                size: Optional[Tuple[int, int]] = None) -> bytes:
+    """Resize (optionally), overlay a rows x cols grid and encode"""
+    if size is not None and size != image.size:
+        image = image.resize(size)
+    return encode_image(apply_grid_overlay(image, rows, cols), config)
+
+
+def coarse_view(image: Image.Image, config: ImagePrepConfig = PREP_CONFIG) -> bytes:
+    """The whole clean frame, downscaled, with the coarse region grid"""
+    width, height = target_size(image.size, config)
+    size = max(1, round(width * COARSE_SCALE)), max(1, round(height * COARSE_SCALE))
+    return render_grid(image, COARSE_ROWS, COARSE_COLUMNS, config, size)
+
+
+def region_view(image: Image.Image, region: str, config: ImagePrepConfig = PREP_CONFIG) -> bytes:
+    """One padded coarse region of the clean frame, at full resolution, with the fine grid"""
+    x0, y0, x1, y1 = geometry_for(*image.size, COARSE_ROWS, COARSE_COLUMNS).region_bounds(region)
+    crop = image.crop((round(x0), round(y0), round(x1), round(y1)))
+    return render_grid(crop, FINE_ROWS, FINE_COLUMNS, config)
+
+
+def element_view(image: Image.Image, boxes: Sequence[Tuple[float, float, float, float]], labels: List[str],
+                 config: ImagePrepConfig = PREP_CONFIG) -> bytes:
+    """The clean frame, resized as usual, with only the detected elements outlined and labelled"""
+    size = target_size(image.size, config)
+    sx, sy = size[0] / image.width, size[1] / image.height
+    resized = image.resize(size) if size != image.size else image
+    scaled = [(x0 * sx, y0 * sy, x1 * sx, y1 * sy) for x0, y0, x1, y1 in boxes]
+    return encode_image(apply_box_overlay(resized, scaled, labels), config)
+
+
+def prepare_frame(image_data: bytes, config: ImagePrepConfig = PREP_CONFIG, timings: Optional[Dict[str, float]] = None,
+                  overlay: bool = True) -> dict:
+    """Decode, fingerprint, overlay and encode one screenshot into process_request inputs
+
+    The clean (cropped, ungridded) frame is returned too, for coarse-to-fine and element grounding;
+    with overlay=False the full-grid image is skipped and only that is kept.
+    """
+    timings = {} if timings is None else timings
+
+    start = time.perf_counter()
+    image = Image.open(BytesIO(image_data)).convert("RGB")
+    source_size = image.size
+    timings["decode"] = time.perf_counter() - start
+
+    # Fingerprint the clean, full frame, before it is cropped or gridded
+    start = time.perf_counter()
+    fp = fingerprint(image)
+    timings["fingerprint"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if config.crop is not None:
+        image = image.crop(crop_box(source_size, config.crop))
+    if config.grayscale:
+        # Grey the screenshot but keep the coloured labels readable
+        image = image.convert("L").convert("RGB")
+    payload = {
+        "image": image,
+        "image_mime": config.mime_type,
+        "fingerprint": fp,
+        "source_size": source_size,
+    }
+    if not overlay:
+        timings["resize"] = time.perf_counter() - start
+        return payload
+
+    size = target_size(image.size, config)
+    resized = image.resize(size) if size != image.size else image
+    timings["resize"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    image_with_grid = apply_grid_overlay(resized, TOTAL_ROWS, TOTAL_COLUMNS)
+    timings["overlay"] = time.perf_counter() - start
+
+    # Raw bytes travel to gem_orch; base64 happens once, at the model call
+    start = time.perf_counter()
+    payload["image_bytes"] = encode_image(image_with_grid, config)
+    timings["encode"] = time.perf_counter() - start
+    return payload
+
+
+def prepare_frame_job(image_data: bytes, overlay: bool = True, keep_image: bool = True) -> Tuple[dict, Dict[str, float]]:
+    """prepare_frame for an executor (thread or process): timings come back with the payload
+
+    keep_image=False drops the clean frame, so a process pool doesn't ship it back when
+    the grounding mode only needs the encoded image.
+    """
+    timings: Dict[str, float] = {}
+    payload = prepare_frame(image_data, timings=timings, overlay=overlay)
+    if not keep_image:
+        del payload["image"]
+    return payload, timings
@@ -0,0 +1,50 @@
+import json
+import sqlite3
+import threading
+from typing import Any, Iterator, Optional, Tuple
+
+# ---------------------------------------------------------------------------
+# 💾 Tiny SQLite-backed key/value table shared by the on-disk caches
+# ---------------------------------------------------------------------------
+
+
+class SqliteKV:
+    """JSON values keyed by string in one SQLite table; safe to share across threads"""
+
+    def __init__(self, path: str, table: str):
+        if not table.isidentifier():
+            raise ValueError(f"Invalid table name: {table!r}")
+        self.path = path
+        self.table = table
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, value: Any) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)",
+                (key, json.dumps(value, separators=(",", ":"))),
+            )
+
+    def delete(self, key: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(f"SELECT key, value FROM {self.table}").fetchall()
+        for key, value in rows:
+            yield key, json.loads(value)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,248 @@
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+from telemetry import metrics
+
+# ---------------------------------------------------------------------------
+# 🔌 Model backends: the one seam between gem_orch and whatever answers tool calls
+# ---------------------------------------------------------------------------
+
+
+@dataclass
+class ToolRequest:
+    model: str
+    tool: dict  # OpenAI-style function tool spec; the model is forced to call it
+    messages: List[dict]
+    temperature: float
+    # Plain inputs behind the prompt (instruction, goal, ...); never sent to the model
+    context: Dict[str, Any] = field(default_factory=dict)
+    timeout: Optional[float] = None  # seconds this attempt may take; set by the gateway
+
+    @property
+    def tool_name(self) -> str:
+        return self.tool["function"]["name"]
+
+    @property
+    def box_key(self) -> str:
+        """Fixture key for a grounding call; coarse-to-fine passes get their own answers"""
+        view = self.context.get("view", "grid")
+        goal = self.context["goal"]
+        return goal if view == "grid" else f"{goal} #{view}"
+
+
+class ModelBackend:
+    """Answers a forced tool call with the call's JSON arguments string"""
+
+    def call(self, request: ToolRequest) -> str:
+        raise NotImplementedError
+
+    def stream(self, request: ToolRequest) -> Iterator[str]:
+        """Argument fragments as they arrive; backends without streaming yield one piece"""
+        yield self.call(request)
+
+
+# Point at a local fake (fake_model_server.py) to exercise the real client offline
+MODEL_BASE_URL = os.getenv("ARES_MODEL_BASE_URL", "https://generativelanguage.googleapis.com/v1beta/")
+# One keep-alive pool shared by every session; sized for the in-flight model call cap plus hedges
+HTTP_MAX_CONNECTIONS = int(os.getenv("ARES_HTTP_MAX_CONNECTIONS", "32"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("ARES_HTTP_MAX_KEEPALIVE", "16"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("ARES_HTTP_CONNECT_TIMEOUT", "5"))
+
+
+class OpenAIBackend(ModelBackend):
+    """Gemini through its OpenAI-compatible endpoint"""
+
+    def __init__(self, api_key: Optional[str] = None, base_url: str = MODEL_BASE_URL):
+        self.api_key = api_key
+        self.base_url = base_url
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        # Built on first use so offline runs (mock backend, benchmarks) never need a key
+        with self._lock:
+            if self._client is None:
+                import httpx
+                from openai import OpenAI
+                http_client = httpx.Client(
+                    limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+                    timeout=httpx.Timeout(60.0, connect=HTTP_CONNECT_TIMEOUT),
+                )
+                self._client = OpenAI(
+                    api_key=self.api_key or os.getenv("GEMINI_API_KEY"),  # You must define GEMINI_API_KEY in your .env
+                    base_url=self.base_url,
+                    http_client=http_client,
+                    max_retries=0,  # ModelGateway owns retries, so they respect the call deadline
+                )
+            return self._client
+
+    def _kwargs(self, request: ToolRequest) -> dict:
+        kwargs = {
+            "model": request.model,
+            "tools": [request.tool],
+            "tool_choice": {"type": "function", "function": {"name": request.tool_name}},
+            "messages": request.messages,
+            "temperature": request.temperature,
+        }
+        if request.timeout is not None:
+            kwargs["timeout"] = request.timeout
+        return kwargs
+
+    @staticmethod
+    def _record_usage(usage: Any) -> None:
+        # Billed prompt tokens, and the share the provider served from its prefix cache
+        if usage is None:
+            return
+        metrics.incr("prompt_tokens", usage.prompt_tokens or 0)
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None) if details is not None else None
+        if cached:
+            metrics.incr("cached_prompt_tokens", cached)
+
+    def call(self, request: ToolRequest) -> str:
+        resp = self.client.chat.completions.create(**self._kwargs(request))
+        self._record_usage(getattr(resp, "usage", None))
+        return resp.choices[0].message.tool_calls[0].function.arguments
+
+    def stream(self, request: ToolRequest) -> Iterator[str]:
+        for chunk in self.client.chat.completions.create(stream=True, **self._kwargs(request)):
+            self._record_usage(getattr(chunk, "usage", None))
+            if not chunk.choices:
+                continue
+            for tool_call in chunk.choices[0].delta.tool_calls or []:
+                if tool_call.function and tool_call.function.arguments:
+                    yield tool_call.function.arguments
+
+
+class MockBackend(ModelBackend):
+    """Deterministic offline stand-in: fixture answers first, then stable synthetic ones
+
+    Fixture format: {"goals": {instruction: [goal, ...]}, "boxes": {goal: [box_id, ...]}}.
+    Batch grounding calls answer each of their goals the same way.
+    Box answers for a goal are replayed in order, repeating the last one. Coarse-to-fine
+    passes look up "<goal> #coarse" / "<goal> #fine" instead. An optional
+    "models": {model: {"goals": ..., "boxes": ...}} section overrides answers per model,
+    e.g. to give a fast tier the wrong box; model_latency does the same for latency.
+    """
+
+    def __init__(self, fixture_path: Optional[str] = None, latency: float = 0.0, jitter: float = 0.0, seed: int = 0, rows: int = 20, cols: int = 10,
+                 model_latency: Optional[Dict[str, float]] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.model_latency = model_latency or {}
+        self.rows = rows
+        self.cols = cols
+        self.fixture: Dict[str, Dict[str, Any]] = {"goals": {}, "boxes": {}}
+        if fixture_path:
+            with open(fixture_path) as f:
+                self.fixture.update(json.load(f))
+        self._box_cursor: Dict[str, int] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _latency(self, model: str) -> float:
+        return self.model_latency.get(model, self.latency)
+
+    def _sleep(self, model: str = "") -> None:
+        with self._lock:
+            delay = self._latency(model) + self._random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _fixture(self, model: str, section: str) -> Dict[str, Any]:
+        """The per-model override of a fixture section, falling back to the shared one"""
+        override = self.fixture.get("models", {}).get(model, {}).get(section, {})
+        return {**self.fixture[section], **override} if override else self.fixture[section]
+
+    def _goals(self, instruction: str, model: str = "") -> List[str]:
+        goals = self._fixture(model, "goals")
+        if instruction in goals:
+            return goals[instruction]
+        parts = re.split(r",|\band then\b|\band\b|\bthen\b", instruction)
+        return [part.strip().capitalize() for part in parts if part.strip()]
+
+    def _box(self, key: str, rows: int, cols: int, model: str = "", labels: Optional[List[str]] = None) -> str:
+        answers = self._fixture(model, "boxes").get(key)
+        if answers:
+            with self._lock:
+                cursor = f"{model}\x1f{key}"
+                index = self._box_cursor.get(cursor, 0)
+                self._box_cursor[cursor] = index + 1
+            return answers[min(index, len(answers) - 1)]
+        digest = int(hashlib.sha256(key.encode("utf-8")).hexdigest(), 16)
+        if labels:
+            return labels[digest % len(labels)]
+        return f"{chr(97 + digest % rows)}{(digest // rows) % cols}"
+
+    def answer(self, request: ToolRequest) -> dict:
+        model = request.model
+        if "instruction" in request.context:
+            return {"goals": self._goals(request.context["instruction"], model)}
+        if "goal" in request.context:
+            rows, cols = request.context.get("grid") or (self.rows, self.cols)
+            return {"box_id": self._box(request.box_key, rows, cols, model, request.context.get("labels"))}
+        if "goals" in request.context:
+            rows, cols = request.context.get("grid") or (self.rows, self.cols)
+            return {"box_ids": [self._box(goal, rows, cols, model) for goal in request.context["goals"]]}
+        raise ValueError(f"MockBackend has no answer for tool '{request.tool_name}'")
+
+    def call(self, request: ToolRequest) -> str:
+        self._sleep(request.model)
+        return json.dumps(self.answer(request))
+
+    def stream(self, request: ToolRequest) -> Iterator[str]:
+        arguments = json.dumps(self.answer(request))
+        pieces = [arguments[i:i + 16] for i in range(0, len(arguments), 16)]
+        delay = self._latency(request.model) / max(len(pieces), 1)
+        for piece in pieces:
+            if delay > 0:
+                time.sleep(delay)
+            yield piece
+
+
+class RecordingBackend(ModelBackend):
+    """Passes calls through and saves the answers as a MockBackend fixture
+
+    Answers are filed under their model ("models" section), so a tiered run replays
+    each tier's own answers.
+    """
+
+    def __init__(self, inner: ModelBackend, fixture_path: str):
+        self.inner = inner
+        self.fixture_path = fixture_path
+        self.fixture: Dict[str, Dict[str, Any]] = {"goals": {}, "boxes": {}}
+        self._lock = threading.Lock()
+
+    def _record(self, request: ToolRequest, arguments: str) -> None:
+        answer = json.loads(arguments)
+        with self._lock:
+            fixture = self.fixture.setdefault("models", {}).setdefault(request.model, {"goals": {}, "boxes": {}})
+            if "instruction" in request.context and "goals" in answer:
+                fixture["goals"][request.context["instruction"]] = answer["goals"]
+            elif "goal" in request.context and "box_id" in answer:
+                fixture["boxes"].setdefault(request.box_key, []).append(answer["box_id"])
+            elif "goals" in request.context and "box_ids" in answer:
+                for goal, box_id in zip(request.context["goals"], answer["box_ids"]):
+                    fixture["boxes"].setdefault(goal, []).append(box_id)
+            with open(self.fixture_path, "w") as f:
+                json.dump(self.fixture, f, indent=2)
+
+    def call(self, request: ToolRequest) -> str:
+        arguments = self.inner.call(request)
+        self._record(request, arguments)
+        return arguments
+
+    def stream(self, request: ToolRequest) -> Iterator[str]:
+        arguments = ""
+        for fragment in self.inner.stream(request):
+            arguments += fragment
+            yield fragment
+        self._record(request, arguments)
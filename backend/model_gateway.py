@@ -0,0 +1,188 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import replace
+from typing import Iterator, List, Optional
+
+from model_backend import ModelBackend, ToolRequest
+from telemetry import log_event, metrics
+
+# ---------------------------------------------------------------------------
+# 🚦 Model gateway: deadlines, retries, hedging and rate limiting for every model call
+# ---------------------------------------------------------------------------
+# Wraps any ModelBackend. A call either returns within its deadline or raises ModelError,
+# so a slow or failing provider costs a session one step, never the session itself.
+
+MODEL_DEADLINE = float(os.getenv("ARES_MODEL_DEADLINE", "45"))  # seconds per call, retries included
+MODEL_RETRIES = int(os.getenv("ARES_MODEL_RETRIES", "2"))
+MODEL_BACKOFF = float(os.getenv("ARES_MODEL_BACKOFF", "0.5"))  # first retry delay, doubled each time
+MODEL_BACKOFF_MAX = float(os.getenv("ARES_MODEL_BACKOFF_MAX", "8"))
+# Send a duplicate request if the first hasn't answered after this long (0 = no hedging)
+MODEL_HEDGE_AFTER = float(os.getenv("ARES_MODEL_HEDGE_AFTER", "0"))
+# Requests per second across all sessions, with bursts up to MODEL_BURST (0 = unlimited)
+MODEL_RATE = float(os.getenv("ARES_MODEL_RATE", "0"))
+MODEL_BURST = int(os.getenv("ARES_MODEL_BURST", "10"))
+GATEWAY_WORKERS = int(os.getenv("ARES_GATEWAY_WORKERS", "32"))
+
+# HTTP statuses worth another try: timeouts, conflicts, throttling and server errors
+RETRYABLE_STATUS = {408, 409, 429}
+
+
+class ModelError(Exception):
+    """A model call failed for good: out of retries, out of time, or not retryable"""
+
+
+class ModelTimeout(ModelError):
+    pass
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS or status >= 500
+    # openai's APIConnectionError/APITimeoutError carry no status; matched by name so
+    # this module doesn't need the openai package (e.g. with the mock backend)
+    return any(cls.__name__ in ("APIConnectionError", "APITimeoutError") for cls in type(error).__mro__)
+
+
+class TokenBucket:
+    """Thread-safe token bucket: rate tokens/s, holding at most burst"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> bool:
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def acquire(self, deadline: float) -> None:
+        """Block for a token; ModelTimeout if none would arrive before deadline (monotonic)"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_for = (1 - self._tokens) / self.rate
+            if now + wait_for > deadline:
+                metrics.incr("model_rate_limited")
+                raise ModelTimeout("Rate limit would exceed the call deadline")
+            time.sleep(wait_for)
+
+
+class ModelGateway(ModelBackend):
+    """Deadline, retry with exponential backoff + jitter, optional hedging, shared rate limit"""
+
+    def __init__(
+        self,
+        inner: ModelBackend,
+        deadline: float = MODEL_DEADLINE,
+        retries: int = MODEL_RETRIES,
+        backoff: float = MODEL_BACKOFF,
+        backoff_max: float = MODEL_BACKOFF_MAX,
+        hedge_after: float = MODEL_HEDGE_AFTER,
+        limiter: Optional[TokenBucket] = None,
+        workers: int = GATEWAY_WORKERS,
+    ):
+        self.inner = inner
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self.limiter = limiter if limiter is not None else TokenBucket(MODEL_RATE, MODEL_BURST)
+        # Attempts run here so the caller can stop waiting at the deadline or race a hedge
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ares-model")
+
+    def _backoff(self, attempt: int, deadline: float) -> None:
+        delay = min(self.backoff_max, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+        if time.monotonic() + delay >= deadline:
+            raise ModelTimeout("No time left for another attempt")
+        time.sleep(delay)
+
+    def _attempt(self, request: ToolRequest, deadline: float) -> str:
+        remaining = deadline - time.monotonic()
+        request = replace(request, timeout=remaining)
+        futures: List[Future] = [self._executor.submit(self.inner.call, request)]
+        if 0 < self.hedge_after < remaining:
+            done, _ = wait(futures, timeout=self.hedge_after)
+            if not done and self.limiter.try_acquire():
+                metrics.incr("model_hedges")
+                futures.append(self._executor.submit(self.inner.call, replace(request, timeout=deadline - time.monotonic())))
+
+        # First successful answer wins; a loser still on the wire is simply ignored
+        pending = set(futures)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                for future in pending:
+                    future.cancel()
+                raise ModelTimeout(f"No answer within {self.deadline:.0f}s")
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def call(self, request: ToolRequest) -> str:
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            self.limiter.acquire(deadline)
+            try:
+                return self._attempt(request, deadline)
+            except ModelError:
+                raise
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.retries:
+                    raise ModelError(f"{request.tool_name} failed: {e}") from e
+                metrics.incr("model_retries")
+                log_event(None, f"Retrying {request.tool_name} after: {e}", {"attempt": attempt + 1})
+            self._backoff(attempt, deadline)
+            attempt += 1
+
+    def stream(self, request: ToolRequest) -> Iterator[str]:
+        # Retried only until the first fragment; after that the caller already acted on output
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            self.limiter.acquire(deadline)
+            started = False
+            try:
+                for fragment in self.inner.stream(replace(request, timeout=deadline - time.monotonic())):
+                    started = True
+                    yield fragment
+                    if time.monotonic() > deadline:
+                        raise ModelTimeout(f"Stream ran past {self.deadline:.0f}s")
+                return
+            except ModelError:
+                raise
+            except Exception as e:
+                if started or not is_retryable(e) or attempt >= self.retries:
+                    raise ModelError(f"{request.tool_name} stream failed: {e}") from e
+                metrics.incr("model_retries")
+                log_event(None, f"Retrying {request.tool_name} stream after: {e}", {"attempt": attempt + 1})
+            self._backoff(attempt, deadline)
+            attempt += 1
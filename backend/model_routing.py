@@ -0,0 +1,135 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, TypeVar
+
+from telemetry import log_event, metrics
+
+# ---------------------------------------------------------------------------
+# 🪜 Tiered model routing: a fast model first, the heavy one only when unsure
+# ---------------------------------------------------------------------------
+# A routed call runs on the fast tier and the caller's accept() checks the answer
+# (well-formed, on the grid, consistent with what we already know). A failed call or
+# a rejected answer escalates to the heavy tier, whose answer is used as it is.
+
+MODEL_ROUTING = os.getenv("ARES_MODEL_ROUTING", "tiered")  # "tiered" | "heavy" | "fast"
+FAST_MODEL = os.getenv("ARES_FAST_MODEL", "gemini-2.5-flash")
+HEAVY_MODEL = os.getenv("ARES_HEAVY_MODEL", "gemini-2.5-pro-preview-03-25")
+# Share of accepted fast answers that the heavy tier also answers, off the request
+# path, to measure how often the fast tier is right (0 = never)
+ROUTING_SHADOW_RATE = float(os.getenv("ARES_ROUTING_SHADOW_RATE", "0"))
+ROUTING_SHADOW_WORKERS = int(os.getenv("ARES_ROUTING_SHADOW_WORKERS", "2"))
+
+T = TypeVar("T")
+
+# attempt(model, use) -> answer, where use says what the attempt may do with output
+# that streams in before the answer is complete (e.g. dispatch a command early):
+#   "trusted": act on it; "checked": act only on what would pass accept(); "shadow": nothing
+Attempt = Callable[[str, str], T]
+
+
+class ModelRouter:
+    """Fast tier first, heavy tier on failure or rejection; per-tier latency and agreement"""
+
+    def __init__(
+        self,
+        mode: str = MODEL_ROUTING,
+        fast_model: str = FAST_MODEL,
+        heavy_model: str = HEAVY_MODEL,
+        shadow_rate: float = ROUTING_SHADOW_RATE,
+        seed: Optional[int] = None,
+    ):
+        self.mode = mode
+        self.models = {"fast": fast_model, "heavy": heavy_model}
+        self.shadow_rate = shadow_rate
+        # kind -> tier -> counter; "agreed"/"compared" is the fast tier's accuracy against the heavy one
+        self._counts: Dict[str, Dict[str, Dict[str, int]]] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._shadow_executor: Optional[ThreadPoolExecutor] = None
+
+    def _count(self, kind: str, tier: str, counter: str) -> None:
+        with self._lock:
+            tiers = self._counts.setdefault(kind, {})
+            counts = tiers.setdefault(tier, {})
+            counts[counter] = counts.get(counter, 0) + 1
+        metrics.incr(f"route_{tier}_{counter}")
+
+    def _run_tier(self, kind: str, tier: str, attempt: Attempt, use: str) -> T:
+        self._count(kind, tier, "calls")
+        start = time.perf_counter()
+        try:
+            return attempt(self.models[tier], use)
+        except Exception:
+            self._count(kind, tier, "errors")
+            raise
+        finally:
+            metrics.observe(f"{kind}_{tier}", time.perf_counter() - start)
+
+    def _compare(self, kind: str, fast_answer: T, heavy_answer: T, same: Callable[[T, T], bool]) -> None:
+        self._count(kind, "fast", "compared")
+        if same(fast_answer, heavy_answer):
+            self._count(kind, "fast", "agreed")
+
+    def _shadow(self, kind: str, attempt: Attempt, fast_answer: T, same: Callable[[T, T], bool]) -> None:
+        with self._lock:
+            if self._random.random() >= self.shadow_rate:
+                return
+            if self._shadow_executor is None:
+                self._shadow_executor = ThreadPoolExecutor(max_workers=ROUTING_SHADOW_WORKERS, thread_name_prefix="ares-shadow")
+
+        def check() -> None:
+            try:
+                heavy_answer = self._run_tier(kind, "heavy", attempt, "shadow")
+            except Exception as e:
+                log_event(None, f"Shadow {kind} call failed: {e}")
+                return
+            self._compare(kind, fast_answer, heavy_answer, same)
+
+        self._shadow_executor.submit(check)
+
+    def run(self, kind: str, attempt: Attempt, accept: Callable[[T], bool],
+            same: Optional[Callable[[T, T], bool]] = None) -> T:
+        """The fast tier's answer if accept() passes it, else the heavy tier's"""
+        same = same or (lambda a, b: a == b)
+        if self.mode != "tiered":
+            return self._run_tier(kind, "fast" if self.mode == "fast" else "heavy", attempt, "trusted")
+
+        fast_answer = None
+        try:
+            fast_answer = self._run_tier(kind, "fast", attempt, "checked")
+        except Exception as e:
+            # Any failure of the fast tier (gateway error, malformed output) is just a reason to escalate
+            log_event(None, f"Fast {kind} call failed, escalating: {e}")
+        else:
+            if accept(fast_answer):
+                self._count(kind, "fast", "accepted")
+                if self.shadow_rate > 0:
+                    self._shadow(kind, attempt, fast_answer, same)
+                return fast_answer
+            log_event(None, f"Fast {kind} answer rejected, escalating", {"answer": fast_answer})
+
+        self._count(kind, "fast", "escalated")
+        heavy_answer = self._run_tier(kind, "heavy", attempt, "trusted")
+        if accept(heavy_answer):
+            self._count(kind, "heavy", "accepted")
+        if fast_answer is not None:
+            self._compare(kind, fast_answer, heavy_answer, same)
+        return heavy_answer
+
+    def stats(self) -> dict:
+        with self._lock:
+            result = {"mode": self.mode, "models": dict(self.models)}
+            for kind, tiers in self._counts.items():
+                result[kind] = {}
+                for tier, counts in tiers.items():
+                    summary = dict(counts)
+                    calls = counts.get("calls", 0)
+                    if tier == "fast" and calls:
+                        summary["accept_rate"] = counts.get("accepted", 0) / calls
+                    if counts.get("compared"):
+                        summary["agreement"] = counts.get("agreed", 0) / counts["compared"]
+                    result[kind][tier] = summary
+            return result
@@ -0,0 +1,180 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from kv_store import SqliteKV
+
+# ---------------------------------------------------------------------------
+# 🧭 Instruction -> goals cache with slot-filled templates
+# ---------------------------------------------------------------------------
+# "Message John on WhatsApp" and "Message Priya on WhatsApp" share one template:
+# the argument is cut out of the instruction and the goals, and filled back in.
+
+PLAN_CACHE_SIZE = int(os.getenv("ARES_PLAN_CACHE_SIZE", "2000"))
+PLAN_CACHE_TTL = float(os.getenv("ARES_PLAN_CACHE_TTL", str(30 * 24 * 3600)))  # seconds
+PLAN_CACHE_PATH = os.getenv("ARES_PLAN_CACHE_PATH")  # unset = memory only
+
+# App names are part of the plan, never an argument: WhatsApp steps don't fit Reddit
+KNOWN_APPS = {
+    "whatsapp", "reddit", "uber", "clock", "instagram", "linkedin", "youtube",
+    "gmail", "chrome", "maps", "spotify", "amazon", "settings", "messages", "camera",
+}
+
+_QUOTED = re.compile(r"\"([^\"]+)\"|'([^']+)'")
+_NUMBER = re.compile(r"(?<![\w:])\d+(?::\d{2})?(?![\w:])")
+_PROPER = re.compile(r"\b[A-Z][\w'-]*(?:\s+[A-Z][\w'-]*)*")
+
+
+def _slot(index: int) -> str:
+    return f"<<{index}>>"
+
+
+def normalize_instruction(instruction: str) -> str:
+    return " ".join(instruction.strip().rstrip(".!?").lower().split())
+
+
+def extract_slots(instruction: str) -> Tuple[str, List[str]]:
+    """Cut argument values (quoted text, numbers, names) out of an instruction"""
+    text = instruction.strip().rstrip(".!?")
+    spans = []
+
+    for m in _QUOTED.finditer(text):
+        spans.append((m.start(), m.end(), m.group(1) or m.group(2)))
+    for m in _NUMBER.finditer(text):
+        spans.append((m.start(), m.end(), m.group(0)))
+    for m in _PROPER.finditer(text):
+        words = m.group(0).split()
+        if m.start() == 0:
+            words = words[1:]  # sentence-initial capital is just grammar
+        if not words or " ".join(words).lower() in KNOWN_APPS or words == ["I"]:
+            continue
+        value = " ".join(words)
+        start = m.end() - len(value)
+        spans.append((start, m.end(), value))
+
+    # Keep the earliest non-overlapping spans (quotes win over names found inside them)
+    spans.sort(key=lambda span: (span[0], -span[1]))
+    template, slots, cursor = "", [], 0
+    for start, end, value in spans:
+        if start < cursor:
+            continue
+        template += text[cursor:start] + _slot(len(slots))
+        slots.append(value)
+        cursor = end
+    template += text[cursor:]
+    return normalize_instruction(template), slots
+
+
+# Characters that join a slot value to its neighbour into one word: "AM/PM", "Sam-Team"
+_WORD_JOINERS = r"\w/-"
+
+
+def _value_pattern(value: str) -> re.Pattern:
+    """The value as a whole word only; "John's" still counts as John"""
+    return re.compile(rf"(?<![{_WORD_JOINERS}]){re.escape(value)}(?![{_WORD_JOINERS}])", re.IGNORECASE)
+
+
+def goals_to_template(goals: List[str], slots: List[str]) -> Optional[List[str]]:
+    """Swap slot values for placeholders; None if a slot never shows up in the goals"""
+    if len({s.lower() for s in slots}) != len(slots):
+        return None  # same value twice: can't tell which placeholder it belongs to
+    templated = list(goals)
+    for i, value in enumerate(slots):
+        pattern = _value_pattern(value)
+        if not any(pattern.search(goal) for goal in templated):
+            return None
+        templated = [pattern.sub(_slot(i), goal) for goal in templated]
+    return templated
+
+
+def fill_template(goal_templates: List[str], slots: List[str]) -> List[str]:
+    goals = []
+    for goal in goal_templates:
+        for i, value in enumerate(slots):
+            goal = goal.replace(_slot(i), value)
+        goals.append(goal)
+    return goals
+
+
+class PlanCache:
+    """LRU + TTL cache of extracted goals, by exact instruction and by slot template"""
+
+    def __init__(self, max_entries: int = PLAN_CACHE_SIZE, ttl: float = PLAN_CACHE_TTL, path: Optional[str] = PLAN_CACHE_PATH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[List[str], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._store = SqliteKV(path, "plans") if path else None
+        self.hits = 0
+        self.template_hits = 0
+        self.misses = 0
+        if self._store is not None:
+            rows = sorted((value["ts"], key, value["goals"]) for key, value in self._store.items())
+            for ts, key, goals in rows:
+                self._entries[key] = (goals, ts)
+            self._evict(time.time())
+
+    def _evict(self, now: float) -> None:
+        expired = [key for key, (_, ts) in self._entries.items() if now - ts > self.ttl]
+        for key in expired:
+            self._drop(key)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key: str) -> None:
+        self._entries.pop(key, None)
+        if self._store is not None:
+            self._store.delete(key)
+
+    def _lookup(self, key: str, now: float) -> Optional[List[str]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        goals, ts = entry
+        if now - ts > self.ttl:
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return goals
+
+    def _store_entry(self, key: str, goals: List[str], now: float) -> None:
+        self._entries[key] = (goals, now)
+        self._entries.move_to_end(key)
+        if self._store is not None:
+            self._store.put(key, {"goals": goals, "ts": now})
+
+    def get(self, instruction: str) -> Optional[List[str]]:
+        now = time.time()
+        template, slots = extract_slots(instruction)
+        with self._lock:
+            goals = self._lookup("exact:" + normalize_instruction(instruction), now)
+            if goals is not None:
+                self.hits += 1
+                return list(goals)
+            goal_templates = self._lookup("template:" + template, now) if slots else None
+            if goal_templates is not None:
+                self.template_hits += 1
+                return fill_template(goal_templates, slots)
+            self.misses += 1
+            return None
+
+    def put(self, instruction: str, goals: List[str]) -> None:
+        now = time.time()
+        template, slots = extract_slots(instruction)
+        goal_templates = goals_to_template(goals, slots) if slots else None
+        with self._lock:
+            self._store_entry("exact:" + normalize_instruction(instruction), goals, now)
+            if goal_templates is not None:
+                self._store_entry("template:" + template, goal_templates, now)
+            self._evict(now)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "template_hits": self.template_hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,195 @@
+import base64
+import math
+import os
+from collections import deque
+from io import BytesIO
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from PIL import Image
+
+# ---------------------------------------------------------------------------
+# 🧾 Prompt assembly: a static, cacheable prefix and a small per-call suffix
+# ---------------------------------------------------------------------------
+# Providers reuse the longest prefix a request shares with earlier ones (Gemini implicit
+# caching, OpenAI prompt caching), and bill/serve it faster. So what never changes (role,
+# rules, knowledge base) goes first as a system message, byte-for-byte identical across
+# calls and sessions; the instruction, goal, recent steps and screenshot come after it.
+# Nothing dynamic may be formatted into the prefixes below.
+
+# Commands of a session shown to grounding calls, most recent last (0 = none)
+STEP_HISTORY_SIZE = int(os.getenv("ARES_STEP_HISTORY", "4"))
+
+KNOWLEDGE_BASE = """⏰ **Whatsapp App**
+- Remember that while interacting with WHATSAPP, when you look for someone through search, click on their name to open the chat not the profile picture.
+
+⏰ **Reddit App**
+- Remember that while interacting with REDDIT, you will probably will be told to browse on user's behalf,
+- In that case, after opening the app, keep scrolling upto 5 times, and then announce a very short summary.
+
+⏰ **Uber App**
+- Remember that while booking UBER, when you complete input/type, the most closest search will appear right below -- pick that.
+
+
+⏰ **Clock App**
+- Clock app has 5 bottom tabs: **Alarm, Clock, Timer, Stopwatch, Bedtime**.
+- If the desired alarm exists, toggle it.
+- Otherwise:
+1. Tap the **plus (+)** button.
+2. Set **hour**, **minute**, and **AM/PM**.
+3. Tap **OK** to confirm."""
+
+PLANNER_PREFIX = f"""You are an android assistant which runs on android to do basic chores on behalf of user and that breaks down user instructions into concrete, modular mobile UI goals to automate workflows on Android apps.
+
+Each goal should be written like a command and must reflect specific UI actions such as:
+- Tapping buttons, icons, or menu items (e.g., "Tap element ")
+- Typing into text fields (e.g., "Type something into search bar")
+- Navigating through the interface (e.g., "Open LinkedIn app", "Scroll down", "Swipe left")
+- Selecting or confirming actions (e.g., "Tap 'Connect'", "Tap 'Allow'", "Select first result")
+- Waiting for or verifying UI changes if implied by flow (e.g., "Wait for connection confirmation")
+
+Ensure that:
+- Goals are atomic (one action per step)
+- The order reflects how a user would logically complete the task in the UI
+- Multi-step flows (e.g., searching, connecting, posting) are decomposed clearly
+
+
+### Knowledge Base:
+
+{KNOWLEDGE_BASE}
+
+Return only the modular goals in the `goals` field as a **list of strings**."""
+
+# Shared by single and batch grounding calls, on every view
+GROUNDER_PREFIX = """You locate UI elements on Android screenshots for an assistant that operates the phone on the user's behalf.
+Each screenshot has labelled boxes drawn on it, and you answer with box labels only.
+For a goal, return the single best box that fully contains the UI element needed for it.
+Return "N/A" for a goal ONLY if its element is definitely not visible in the current screen.
+Recent steps, when given, are what the assistant already did; a step marked as not changing the screen should not be repeated on the same box.
+No explanations."""
+
+DEFAULT_LABELS = "bounding boxes labelled a1, b2, etc."
+
+
+def planner_messages(instruction: str) -> List[dict]:
+    return [
+        {"role": "system", "content": PLANNER_PREFIX},
+        {"role": "user", "content": f'Instruction: "{instruction}"'},
+    ]
+
+
+def _image_part(img_b64: str, mime_type: str) -> dict:
+    return {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{img_b64}"}}
+
+
+def _history_text(history: Sequence[str]) -> str:
+    if not history:
+        return ""
+    return "Recent steps:\n" + "\n".join(f"- {line}" for line in history) + "\n"
+
+
+def grounder_messages(goal: str, img_b64: str, mime_type: str, labels: Optional[str] = None,
+                      history: Sequence[str] = ()) -> List[dict]:
+    text = f"""The screenshot shows {labels or DEFAULT_LABELS}
+{_history_text(history)}Goal: **{goal}**"""
+    return [
+        {"role": "system", "content": GROUNDER_PREFIX},
+        {"role": "user", "content": [{"type": "text", "text": text}, _image_part(img_b64, mime_type)]},
+    ]
+
+
+def batch_grounder_messages(goals: List[str], img_b64: str, mime_type: str, labels: Optional[str] = None,
+                            history: Sequence[str] = ()) -> List[dict]:
+    steps = "\n".join(f"{i + 1}. {goal}" for i, goal in enumerate(goals))
+    text = f"""The screenshot shows {labels or DEFAULT_LABELS}
+{_history_text(history)}These are the next steps of a task, in order:
+{steps}
+For each step, in the same order, return its box. Step 1 is the current one; later steps often
+only appear after the earlier ones are done, so N/A is expected for them."""
+    return [
+        {"role": "system", "content": GROUNDER_PREFIX},
+        {"role": "user", "content": [{"type": "text", "text": text}, _image_part(img_b64, mime_type)]},
+    ]
+
+# ---------------------------------------------------------------------------
+# 👣 Rolling step history per session
+# ---------------------------------------------------------------------------
+
+
+class StepRecord(NamedTuple):
+    goal: str
+    action: str
+    box_id: Optional[str] = None
+    unchanged: bool = False  # the next frame looked the same as the one the command was sent on
+
+    def render(self) -> str:
+        line = f"{self.goal}: {self.action}"
+        if self.box_id:
+            line += f" on {self.box_id}"
+        if self.unchanged:
+            line += " (screen did not change)"
+        return line
+
+
+class StepHistory:
+    """The last few commands of a session, rendered compactly into grounding prompts"""
+
+    def __init__(self, size: int = STEP_HISTORY_SIZE):
+        self._steps: "deque[StepRecord]" = deque(maxlen=max(size, 0))
+
+    def record(self, goal: str, action: str, box_id: Optional[str] = None) -> None:
+        if self._steps.maxlen:
+            self._steps.append(StepRecord(goal, action, box_id))
+
+    def mark_unchanged(self) -> None:
+        if self._steps and not self._steps[-1].unchanged:
+            self._steps[-1] = self._steps[-1]._replace(unchanged=True)
+
+    def lines(self) -> Tuple[str, ...]:
+        """An immutable copy, safe to hand to a grounding call on another thread"""
+        return tuple(step.render() for step in self._steps)
+
+    def snapshot(self) -> List[list]:
+        return [list(step) for step in self._steps]
+
+    def restore(self, snapshot: List[list]) -> None:
+        self._steps.clear()
+        for step in snapshot:
+            self._steps.append(StepRecord(*step))
+
+# ---------------------------------------------------------------------------
+# 🧮 Prompt size estimates, for the benchmark
+# ---------------------------------------------------------------------------
+
+CHARS_PER_TOKEN = 4
+# Gemini bills an image as 258 tokens, or 258 per 768x768 tile when either side exceeds 384
+IMAGE_TILE_TOKENS = 258
+IMAGE_TILE = 768
+IMAGE_SMALL_SIDE = 384
+
+
+def image_tokens(data_url: str) -> int:
+    _, _, payload = data_url.partition(",")
+    width, height = Image.open(BytesIO(base64.b64decode(payload))).size
+    if width <= IMAGE_SMALL_SIDE and height <= IMAGE_SMALL_SIDE:
+        return IMAGE_TILE_TOKENS
+    return math.ceil(width / IMAGE_TILE) * math.ceil(height / IMAGE_TILE) * IMAGE_TILE_TOKENS
+
+
+def estimate_tokens(messages: List[dict]) -> Dict[str, int]:
+    """Rough prompt tokens: "prefix" for the leading system messages (cacheable), "total" for all"""
+    prefix = total = 0
+    in_prefix = True
+    for message in messages:
+        content = message["content"]
+        parts = [{"type": "text", "text": content}] if isinstance(content, str) else content
+        tokens = 0
+        for part in parts:
+            if part.get("type") == "text":
+                tokens += math.ceil(len(part["text"]) / CHARS_PER_TOKEN)
+            elif part.get("type") == "image_url":
+                tokens += image_tokens(part["image_url"]["url"])
+        in_prefix = in_prefix and message["role"] == "system"
+        if in_prefix:
+            prefix += tokens
+        total += tokens
+    return {"prefix": prefix, "total": total}
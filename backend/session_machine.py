@@ -0,0 +1,328 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+import weakref
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from telemetry import current_session, log_event, metrics
+
+# ---------------------------------------------------------------------------
+# 🚥 Goal state machine: table-driven transitions, deadlines, pluggable recovery
+# ---------------------------------------------------------------------------
+# Each step reports what happened (a new frame, an unchanged one, the element was found
+# or not) and the machine answers with what to do. Goal deadlines fire from a scheduler
+# thread, so a goal that has run out of time is given up on before the next model call,
+# not discovered after it.
+
+GOAL_TIMEOUT = float(os.getenv("ARES_GOAL_TIMEOUT", "20"))  # seconds per goal (0 = no deadline)
+# Unchanged screens in a row before the goal counts as stuck and recovery starts
+MAX_CONSECUTIVE_FAILS = int(os.getenv("ARES_MAX_CONSECUTIVE_FAILS", "3"))
+# Recovery ladder for a goal whose element isn't found: "strategy[:times]" rungs, in order.
+# Once every rung is used up, the goal is skipped.
+RECOVERY_PLAN = os.getenv("ARES_RECOVERY_PLAN", "swipeUp:3,swipeDown:2,back:1")
+
+
+class DeadlineScheduler:
+    """One daemon thread and a heap: run fn at a monotonic deadline unless cancelled first"""
+
+    class Deadline:
+        __slots__ = ("when", "fn", "cancelled")
+
+        def __init__(self, when: float, fn: Callable[[], None]):
+            self.when = when
+            self.fn = fn
+            self.cancelled = False
+
+        def cancel(self) -> None:
+            self.cancelled = True
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, "DeadlineScheduler.Deadline"]] = []
+        self._sequence = itertools.count()
+        self._wakeup = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def schedule(self, delay: float, fn: Callable[[], None]) -> "DeadlineScheduler.Deadline":
+        deadline = self.Deadline(time.monotonic() + delay, fn)
+        with self._wakeup:
+            heapq.heappush(self._heap, (deadline.when, next(self._sequence), deadline))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ares-deadlines", daemon=True)
+                self._thread.start()
+            self._wakeup.notify()
+        return deadline
+
+    def pending(self) -> int:
+        with self._wakeup:
+            return sum(1 for _, _, deadline in self._heap if not deadline.cancelled)
+
+    def _run(self) -> None:
+        while True:
+            with self._wakeup:
+                # Cancelled entries are dropped lazily, when they reach the top
+                while self._heap and self._heap[0][2].cancelled:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._wakeup.wait()
+                    continue
+                wait_for = self._heap[0][0] - time.monotonic()
+                if wait_for > 0:
+                    self._wakeup.wait(wait_for)
+                    continue
+                deadline = heapq.heappop(self._heap)[2]
+            try:
+                deadline.fn()
+            except Exception as e:
+                log_event(None, f"Deadline callback failed: {e}")
+
+
+deadlines = DeadlineScheduler()
+
+
+class RecoveryStrategy:
+    """One rung of the recovery ladder: a command to try while the goal's element can't be found"""
+
+    def __init__(self, action: str, times: int = 1):
+        self.action = action
+        self.times = times
+
+    def next_action(self, machine: "GoalMachine", used: int) -> Optional[str]:
+        """The command for this rung's used+1'th try, or None once the rung is spent"""
+        return self.action if used < self.times else None
+
+    def __repr__(self) -> str:
+        return f"{self.action}:{self.times}"
+
+
+# Strategy name -> factory(times); register more with register_recovery
+RECOVERY_STRATEGIES: Dict[str, Callable[[int], RecoveryStrategy]] = {
+    "swipeUp": lambda times: RecoveryStrategy("swipeUp", times),
+    "swipeDown": lambda times: RecoveryStrategy("swipeDown", times),
+    "back": lambda times: RecoveryStrategy("back", times),
+}
+
+
+def register_recovery(name: str, factory: Callable[[int], RecoveryStrategy]) -> None:
+    RECOVERY_STRATEGIES[name] = factory
+
+
+def recovery_ladder(plan: str = RECOVERY_PLAN) -> List[RecoveryStrategy]:
+    """"swipeUp:3,back" -> [RecoveryStrategy("swipeUp", 3), RecoveryStrategy("back", 1)]"""
+    ladder = []
+    for rung in filter(None, (part.strip() for part in plan.split(","))):
+        name, _, times = rung.partition(":")
+        if name not in RECOVERY_STRATEGIES:
+            raise ValueError(f"Unknown recovery strategy {name!r} in {plan!r}")
+        ladder.append(RECOVERY_STRATEGIES[name](int(times or 1)))
+    return ladder
+
+
+class Decision(NamedTuple):
+    """What the step should do: an effect, plus the recovery command for "recover" """
+    effect: str  # ground | act | wait | recover | skip
+    action: Optional[str] = None
+
+
+# (phase, event) -> (next phase, effect). Phases of the current goal:
+#   seeking    - grounding it on every new frame
+#   recovering - its element wasn't found; gestures from the recovery ladder between groundings
+#   doomed     - out of time or out of recovery; skipped without another model call
+# Events: frame (a new screen), unchanged (same screen as before), found / not_found
+# (grounding result), stuck (too many unchanged screens in a row). A goal's deadline
+# moves it to doomed directly, from the scheduler thread (GoalMachine.expire).
+TRANSITIONS: Dict[Tuple[str, str], Tuple[str, str]] = {
+    ("seeking", "frame"): ("seeking", "ground"),
+    ("seeking", "unchanged"): ("seeking", "wait"),
+    ("seeking", "found"): ("seeking", "act"),
+    ("seeking", "not_found"): ("recovering", "recover"),
+    ("seeking", "stuck"): ("recovering", "recover"),
+    ("recovering", "frame"): ("recovering", "ground"),
+    # The last gesture changed nothing (e.g. the list can't scroll further): next one, no model call
+    ("recovering", "unchanged"): ("recovering", "recover"),
+    ("recovering", "found"): ("seeking", "act"),
+    ("recovering", "not_found"): ("recovering", "recover"),
+    ("recovering", "stuck"): ("recovering", "recover"),
+    ("doomed", "frame"): ("doomed", "skip"),
+    ("doomed", "unchanged"): ("doomed", "skip"),
+    # Found anyway (e.g. while the deadline passed mid-call, maybe already dispatched early): use it
+    ("doomed", "found"): ("seeking", "act"),
+    ("doomed", "not_found"): ("doomed", "skip"),
+    ("doomed", "stuck"): ("doomed", "skip"),
+}
+
+
+class GoalMachine:
+    """Per-session progress through the goal list, driven by step events and goal deadlines"""
+
+    def __init__(
+        self,
+        goals: List[str],
+        ladder: Optional[List[RecoveryStrategy]] = None,
+        timeout: float = GOAL_TIMEOUT,
+        max_failures: int = MAX_CONSECUTIVE_FAILS,
+        scheduler: DeadlineScheduler = deadlines,
+        on_doomed: Optional[Callable[[int], None]] = None,
+    ):
+        self.goals = goals
+        self.ladder = ladder if ladder is not None else recovery_ladder()
+        self.timeout = timeout
+        self.max_failures = max_failures
+        self.scheduler = scheduler
+        self.on_doomed = on_doomed  # called from the scheduler thread when a goal times out
+        self.client_id = current_session.get()  # the scheduler thread has no session scope of its own
+        self.goal_index = 0
+        self.phase = "seeking"
+        self.last_event: Optional[str] = None
+        self.failures = 0  # unchanged screens in a row
+        self.rung = 0
+        self.rung_used = 0
+        self.recoveries: List[str] = []  # recovery commands sent for the current goal
+        self.skipped: List[int] = []
+        self.goal_started = time.monotonic()
+        self.version = 0  # bumped on every change worth persisting
+        self._deadline: Optional[DeadlineScheduler.Deadline] = None
+        self._lock = threading.RLock()
+        self._arm()
+
+    def current_goal(self) -> Optional[str]:
+        return self.goals[self.goal_index] if self.goal_index < len(self.goals) else None
+
+    def is_all_done(self) -> bool:
+        return self.goal_index >= len(self.goals)
+
+    def _arm(self, delay: Optional[float] = None) -> None:
+        if self._deadline is not None:
+            self._deadline.cancel()
+            self._deadline = None
+        if self.timeout <= 0 or self.is_all_done():
+            return
+        ref = weakref.ref(self)
+        index = self.goal_index
+
+        def expire() -> None:
+            machine = ref()
+            if machine is not None:
+                machine.expire(index)
+
+        self._deadline = self.scheduler.schedule(self.timeout if delay is None else delay, expire)
+
+    def expire(self, goal_index: int) -> None:
+        """The goal's deadline passed: give it up before the next step spends a model call on it"""
+        with self._lock:
+            if goal_index != self.goal_index or self.phase == "doomed":
+                return  # the goal was finished in time
+            self.phase = "doomed"
+            self.version += 1
+            self._deadline = None
+        metrics.incr("goal_timeouts", client_id=self.client_id)
+        log_event(self.client_id, f"⏰ Goal timed out: {self.goals[goal_index]}", {"goal_index": goal_index, "timeout_s": self.timeout})
+        if self.on_doomed is not None:
+            self.on_doomed(goal_index)
+
+    def _progress(self) -> tuple:
+        return self.goal_index, self.phase, self.failures, self.rung, self.rung_used
+
+    def handle(self, event: str) -> Decision:
+        """Feed one step event, get the step's next move"""
+        with self._lock:
+            before = self._progress()
+            decision = self._handle(event)
+            if self._progress() != before:
+                self.version += 1
+            return decision
+
+    def _handle(self, event: str) -> Decision:
+        if event == "unchanged":
+            self.failures += 1
+            if self.phase == "seeking" and self.failures >= self.max_failures:
+                event = "stuck"
+        elif event in ("found", "not_found"):
+            self.failures = 0
+        self.last_event = event
+        phase, effect = TRANSITIONS[(self.phase, event)]
+        if phase == "recovering" and self.phase == "seeking":
+            metrics.incr("recoveries_started")
+        self.phase = phase
+        if effect == "recover":
+            return self._recover()
+        if effect == "act":
+            self._advance(recovered=bool(self.recoveries))
+        elif effect == "skip":
+            self._skip()
+        return Decision(effect)
+
+    def _recover(self) -> Decision:
+        while self.rung < len(self.ladder):
+            action = self.ladder[self.rung].next_action(self, self.rung_used)
+            if action is not None:
+                self.rung_used += 1
+                self.recoveries.append(action)
+                metrics.incr(f"recovery_{action}")
+                return Decision("recover", action)
+            self.rung += 1
+            self.rung_used = 0
+        self.phase = "doomed"
+        self._skip()
+        return Decision("skip")
+
+    def _skip(self) -> None:
+        metrics.incr("goals_skipped")
+        log_event(self.client_id, f"⏭️ Skipping goal: {self.current_goal()}", {"recoveries": self.recoveries})
+        self.skipped.append(self.goal_index)
+        self._next_goal()
+
+    def _advance(self, recovered: bool) -> None:
+        if recovered:
+            metrics.incr("goals_recovered")
+        log_event(self.client_id, f"✅ Completed goal: {self.current_goal()}")
+        self._next_goal()
+
+    def _next_goal(self) -> None:
+        metrics.observe("goal", time.monotonic() - self.goal_started)
+        self.goal_index += 1
+        self.phase = "seeking"
+        self.failures = 0
+        self.rung = 0
+        self.rung_used = 0
+        self.recoveries = []
+        self.goal_started = time.monotonic()
+        self._arm()
+        if not self.is_all_done():
+            log_event(self.client_id, f"📋 Now working on: {self.current_goal()}")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "goal_index": self.goal_index,
+                "phase": self.phase,
+                "failures": self.failures,
+                "rung": self.rung,
+                "rung_used": self.rung_used,
+                "recoveries": list(self.recoveries),
+                "skipped": list(self.skipped),
+                "elapsed": time.monotonic() - self.goal_started,
+            }
+
+    def restore(self, snapshot: dict) -> None:
+        """Resume from snapshot(); the goal's deadline keeps the time it had left (downtime is free)"""
+        with self._lock:
+            self.goal_index = snapshot["goal_index"]
+            self.phase = snapshot["phase"]
+            self.failures = snapshot["failures"]
+            self.rung = snapshot["rung"]
+            self.rung_used = snapshot["rung_used"]
+            self.recoveries = list(snapshot["recoveries"])
+            self.skipped = list(snapshot["skipped"])
+            self.goal_started = time.monotonic() - snapshot["elapsed"]
+            if self.phase == "doomed":
+                self.close()  # already given up on: nothing left to time
+            else:
+                self._arm(max(0.0, self.timeout - snapshot["elapsed"]))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._deadline is not None:
+                self._deadline.cancel()
+                self._deadline = None
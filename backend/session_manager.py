@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# ---------------------------------------------------------------------------
+# 🗄️ Bounded session store: LRU cap + idle TTL + explicit cleanup
+# ---------------------------------------------------------------------------
+
+MAX_SESSIONS = int(os.getenv("ARES_MAX_SESSIONS", "1000"))
+SESSION_IDLE_TTL = float(os.getenv("ARES_SESSION_IDLE_TTL", "1800"))  # seconds
+
+
+class SessionManager:
+    """Thread-safe mapping of client_id -> session with LRU and idle-TTL eviction
+
+    With a loader, a client_id that isn't in memory (evicted, or from before a restart)
+    is looked up through loader(client_id) on first use. on_evict(client_id, session) is
+    called for sessions dropped by the LRU cap or the idle TTL, to release what they hold.
+    """
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, idle_ttl: float = SESSION_IDLE_TTL,
+                 loader: Optional[Callable[[str], Optional[Any]]] = None,
+                 on_evict: Optional[Callable[[str, Any], None]] = None):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.loader = loader
+        self.on_evict = on_evict
+        self._sessions: "OrderedDict[str, Any]" = OrderedDict()
+        self._last_seen: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _expire(self, now: float, evicted: List[Tuple[str, Any]]) -> None:
+        # Oldest-touched entries sit at the front, so stop at the first live one
+        while self._sessions:
+            client_id = next(iter(self._sessions))
+            if now - self._last_seen[client_id] <= self.idle_ttl:
+                break
+            self._drop(client_id, evicted)
+
+    def _drop(self, client_id: str, evicted: List[Tuple[str, Any]]) -> None:
+        evicted.append((client_id, self._sessions.pop(client_id, None)))
+        self._last_seen.pop(client_id, None)
+        self.evictions += 1
+
+    def _release(self, evicted: List[Tuple[str, Any]]) -> None:
+        # Outside the lock: teardown may cancel work or take other locks
+        if self.on_evict is None:
+            return
+        for client_id, session in evicted:
+            if session is not None:
+                self.on_evict(client_id, session)
+
+    def get(self, client_id: str) -> Optional[Any]:
+        evicted: List[Tuple[str, Any]] = []
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now, evicted)
+            session = self._sessions.get(client_id)
+            if session is not None:
+                self._sessions.move_to_end(client_id)
+                self._last_seen[client_id] = now
+        self._release(evicted)
+        if session is not None:
+            return session
+        if self.loader is None:
+            return None
+        # Outside the lock: loading may hit disk. Steps for one client are serialized upstream.
+        session = self.loader(client_id)
+        if session is not None:
+            self.put(client_id, session)
+        return session
+
+    def put(self, client_id: str, session: Any) -> None:
+        evicted: List[Tuple[str, Any]] = []
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now, evicted)
+            self._sessions[client_id] = session
+            self._sessions.move_to_end(client_id)
+            self._last_seen[client_id] = now
+            while len(self._sessions) > self.max_sessions:
+                self._drop(next(iter(self._sessions)), evicted)
+        self._release(evicted)
+
+    def discard(self, client_id: str) -> Optional[Any]:
+        """Forget a session, e.g. when its websocket disconnects; returns it if it was in memory"""
+        with self._lock:
+            self._last_seen.pop(client_id, None)
+            return self._sessions.pop(client_id, None)
+
+    def __contains__(self, client_id: str) -> bool:
+        return self.get(client_id) is not None
+
+    def __getitem__(self, client_id: str) -> Any:
+        session = self.get(client_id)
+        if session is None:
+            raise KeyError(client_id)
+        return session
+
+    def __setitem__(self, client_id: str, session: Any) -> None:
+        self.put(client_id, session)
+
+    def __len__(self) -> int:
+        evicted: List[Tuple[str, Any]] = []
+        with self._lock:
+            self._expire(time.monotonic(), evicted)
+            count = len(self._sessions)
+        self._release(evicted)
+        return count
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            return iter(list(self._sessions))
@@ -0,0 +1,85 @@
+import os
+import time
+from typing import Optional
+
+from kv_store import SqliteKV
+from session_manager import SESSION_IDLE_TTL
+
+# ---------------------------------------------------------------------------
+# 💽 Session persistence: snapshots that outlive a restart or deploy
+# ---------------------------------------------------------------------------
+# A session's snapshot is written before the step that changed it answers the phone, so
+# after a crash the phone's next frame (same device_id) picks the task up where it was,
+# without planning it again.
+
+SESSION_STORE_PATH = os.getenv("ARES_SESSION_STORE_PATH")  # unset = sessions live in memory only
+# Snapshots older than this are not worth resuming
+SESSION_STORE_TTL = float(os.getenv("ARES_SESSION_STORE_TTL", str(SESSION_IDLE_TTL)))
+
+
+class SessionStore:
+    """Where session snapshots go; this base class keeps nothing"""
+
+    def load(self, client_id: str) -> Optional[dict]:
+        return None
+
+    def save(self, client_id: str, snapshot: dict) -> Optional[float]:
+        """Store the snapshot; returns its stamp (see stamp())"""
+        return None
+
+    def stamp(self, client_id: str) -> Optional[float]:
+        """When the stored snapshot was written; another process saving the session changes it"""
+        return None
+
+    def delete(self, client_id: str) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": "none"}
+
+
+class SqliteSessionStore(SessionStore):
+    """Snapshots in a local SQLite file (WAL), one row per client_id"""
+
+    def __init__(self, path: str, ttl: float = SESSION_STORE_TTL):
+        self.ttl = ttl
+        self._kv = SqliteKV(path, "sessions")
+        self.saves = 0
+        self.loads = 0
+        self._purge()
+
+    def _purge(self) -> None:
+        now = time.time()
+        for client_id, value in list(self._kv.items()):
+            if now - value["ts"] > self.ttl:
+                self._kv.delete(client_id)
+
+    def load(self, client_id: str) -> Optional[dict]:
+        value = self._kv.get(client_id)
+        if value is None:
+            return None
+        if time.time() - value["ts"] > self.ttl:
+            self._kv.delete(client_id)
+            return None
+        self.loads += 1
+        return value["state"]
+
+    def save(self, client_id: str, snapshot: dict) -> Optional[float]:
+        ts = time.time()
+        self._kv.put(client_id, {"ts": ts, "state": snapshot})
+        self.saves += 1
+        return ts
+
+    def stamp(self, client_id: str) -> Optional[float]:
+        value = self._kv.get(client_id)
+        return None if value is None else value["ts"]
+
+    def delete(self, client_id: str) -> None:
+        self._kv.delete(client_id)
+
+    def stats(self) -> dict:
+        return {"backend": "sqlite", "path": self._kv.path, "saves": self.saves, "loads": self.loads}
+
+
+def open_session_store(path: Optional[str] = SESSION_STORE_PATH) -> SessionStore:
+    return SqliteSessionStore(path) if path else SessionStore()
@@ -0,0 +1,53 @@
+import logging
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from frame_similarity import hamming
+from telemetry import log_event
+
+# ---------------------------------------------------------------------------
+# 🔮 Speculative grounding: start a select_box call before the step needs it
+# ---------------------------------------------------------------------------
+
+SPECULATIVE_START = os.getenv("ARES_SPECULATIVE_START", "1") == "1"
+# Off by default: a prefetch is a model call that is wasted whenever the screen moves on
+PREFETCH_NEXT_GOAL = os.getenv("ARES_PREFETCH_NEXT_GOAL", "0") == "1"
+# A speculative answer is reused only if the new frame is this close to the one it was computed on
+SPECULATION_THRESHOLD = int(os.getenv("ARES_SPECULATION_THRESHOLD", "24"))
+SPECULATION_WORKERS = int(os.getenv("ARES_SPECULATION_WORKERS", "8"))
+
+_executor = ThreadPoolExecutor(max_workers=SPECULATION_WORKERS, thread_name_prefix="ares-spec")
+
+
+class Speculation:
+    """A grounding call for (goal_index, goal) running against one particular frame"""
+
+    def __init__(self, goal_index: int, goal: str, fingerprint: int, future: "Future[Any]"):
+        self.goal_index = goal_index
+        self.goal = goal
+        self.fingerprint = fingerprint
+        self.future = future
+
+    def matches(self, goal_index: int, goal: str, fingerprint: int) -> bool:
+        return (
+            self.goal_index == goal_index
+            and self.goal == goal
+            and hamming(self.fingerprint, fingerprint) <= SPECULATION_THRESHOLD
+        )
+
+    def result(self) -> Optional[Any]:
+        """Wait for the speculative result; None if it failed or was cancelled"""
+        try:
+            return self.future.result()
+        except Exception as e:
+            log_event(None, f"Speculative grounding failed for '{self.goal}': {e}", level=logging.WARNING)
+            return None
+
+    def cancel(self) -> None:
+        # A call already on the wire can't be recalled; its result is simply dropped
+        self.future.cancel()
+
+
+def speculate(goal_index: int, goal: str, fingerprint: int, fn: Callable[..., Any], *args: Any) -> Speculation:
+    return Speculation(goal_index, goal, fingerprint, _executor.submit(fn, *args))
@@ -0,0 +1,268 @@
+import contextvars
+import json
+import logging
+import math
+import os
+import queue
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+# ---------------------------------------------------------------------------
+# 📈 Telemetry: queued structured logs, stage timers, counters, session spans
+# ---------------------------------------------------------------------------
+# Callers only enqueue a LogRecord; formatting and stdout I/O happen on a listener
+# thread, so logging never blocks the event loop or a step worker.
+
+LOG_LEVEL = os.getenv("ARES_LOG_LEVEL", "INFO").upper()
+METRICS_HOST = os.getenv("ARES_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("ARES_METRICS_PORT", "9100"))  # 0 = no endpoint
+# Latency samples kept per stage for percentiles
+METRICS_WINDOW = int(os.getenv("ARES_METRICS_WINDOW", "2048"))
+# Finished sessions kept for the endpoint
+FINISHED_SESSIONS = int(os.getenv("ARES_FINISHED_SESSIONS", "100"))
+
+# The session a step belongs to; set around process_request so deep calls can attribute their timings
+current_session: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("ares_session", default=None)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.created)),
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        client_id = getattr(record, "client_id", None)
+        if client_id is not None:
+            entry["client_id"] = client_id
+        data = getattr(record, "data", None)
+        if data:
+            entry["data"] = data
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _DeferredQueueHandler(QueueHandler):
+    # The stock prepare() formats on the caller's thread; leave that to the listener
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class _StdoutHandler(logging.StreamHandler):
+    # Resolve sys.stdout per record so redirects (e.g. the quiet benchmark) apply
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+logger = logging.getLogger("ares")
+logger.setLevel(LOG_LEVEL)
+logger.propagate = False
+_log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+_stdout_handler = _StdoutHandler()
+_stdout_handler.setFormatter(JsonFormatter())
+logger.addHandler(_DeferredQueueHandler(_log_queue))
+_listener = QueueListener(_log_queue, _stdout_handler)
+_listener.start()
+
+
+def log_event(client_id: Optional[str], message: str, data: Any = None, level: int = logging.INFO) -> None:
+    if logger.isEnabledFor(level):
+        logger.log(level, message, extra={"client_id": client_id, "data": data})
+
+
+def flush_logs() -> None:
+    """Block until everything queued so far has been written"""
+    _listener.stop()
+    _listener.start()
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    rank = math.ceil(pct / 100 * len(sorted_values))
+    return sorted_values[max(0, min(len(sorted_values), rank) - 1)]
+
+
+class StageStats:
+    """Count and total for a stage, plus a window of recent samples for percentiles"""
+
+    def __init__(self, window: int = METRICS_WINDOW):
+        self.count = 0
+        self.total = 0.0
+        self.recent: Deque[float] = deque(maxlen=window)
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.recent.append(seconds)
+
+    def summary(self) -> dict:
+        ordered = sorted(self.recent)
+        result = {"count": self.count, "total_ms": self.total * 1000, "mean_ms": self.total / self.count * 1000}
+        if ordered:
+            result.update(
+                p50_ms=percentile(ordered, 50) * 1000,
+                p95_ms=percentile(ordered, 95) * 1000,
+                p99_ms=percentile(ordered, 99) * 1000,
+            )
+        return result
+
+
+class SessionSpan:
+    """Where one client's time went: steps, wall time and per-stage totals"""
+
+    def __init__(self, client_id: str):
+        self.client_id = client_id
+        self.started = time.time()
+        self.ended: Optional[float] = None
+        self.steps = 0
+        self.stages: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+
+    def summary(self) -> dict:
+        end = self.ended if self.ended is not None else time.time()
+        return {
+            "client_id": self.client_id,
+            "started": self.started,
+            "duration_s": end - self.started,
+            "steps": self.steps,
+            "stage_ms": {stage: seconds * 1000 for stage, seconds in self.stages.items()},
+            "counters": dict(self.counters),
+        }
+
+
+class Metrics:
+    """Process-wide stage timers, counters and session spans; cheap enough for every step"""
+
+    def __init__(self, max_sessions: int = 1000, finished: int = FINISHED_SESSIONS):
+        self.max_sessions = max_sessions
+        self.stages: Dict[str, StageStats] = {}
+        self.counters: Dict[str, int] = {}
+        self.sessions: "OrderedDict[str, SessionSpan]" = OrderedDict()
+        self.finished: Deque[SessionSpan] = deque(maxlen=finished)
+        self.gauges: Dict[str, Callable[[], Any]] = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def _span(self, client_id: Optional[str]) -> Optional[SessionSpan]:
+        # Caller holds the lock
+        if client_id is None:
+            return None
+        span = self.sessions.get(client_id)
+        if span is None:
+            span = self.sessions[client_id] = SessionSpan(client_id)
+            if len(self.sessions) > self.max_sessions:
+                self.finished.append(self.sessions.popitem(last=False)[1])
+        return span
+
+    def observe(self, stage: str, seconds: float, client_id: Optional[str] = None) -> None:
+        client_id = client_id if client_id is not None else current_session.get()
+        with self._lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = StageStats()
+            stats.add(seconds)
+            span = self._span(client_id)
+            if span is not None:
+                span.stages[stage] = span.stages.get(stage, 0.0) + seconds
+
+    def observe_all(self, timings: Dict[str, float], client_id: Optional[str] = None) -> None:
+        for stage, seconds in timings.items():
+            self.observe(stage, seconds, client_id)
+
+    def incr(self, counter: str, amount: int = 1, client_id: Optional[str] = None) -> None:
+        client_id = client_id if client_id is not None else current_session.get()
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+            span = self._span(client_id)
+            if span is not None:
+                span.counters[counter] = span.counters.get(counter, 0) + amount
+
+    @contextmanager
+    def timer(self, stage: str, client_id: Optional[str] = None) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, client_id)
+
+    def step(self, client_id: str) -> None:
+        with self._lock:
+            self._span(client_id).steps += 1
+
+    def end_session(self, client_id: str) -> None:
+        with self._lock:
+            span = self.sessions.pop(client_id, None)
+            if span is not None:
+                span.ended = time.time()
+                self.finished.append(span)
+
+    def register_gauge(self, name: str, read: Callable[[], Any]) -> None:
+        """A value read at snapshot time, e.g. cache stats owned by another module"""
+        self.gauges[name] = read
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            result = {
+                "uptime_s": time.time() - self.started,
+                "counters": dict(self.counters),
+                "stages": {stage: stats.summary() for stage, stats in self.stages.items()},
+                "sessions": {
+                    "active": [span.summary() for span in self.sessions.values()],
+                    "finished": [span.summary() for span in self.finished],
+                },
+            }
+        for name, read in self.gauges.items():
+            try:
+                result[name] = read()
+            except Exception as e:
+                result[name] = {"error": str(e)}
+        return result
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def session_scope(client_id: str) -> Iterator[None]:
+    """Attribute timings and counters recorded inside to client_id's span"""
+    token = current_session.set(client_id)
+    try:
+        yield
+    finally:
+        current_session.reset(token)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = json.dumps(metrics.snapshot(), default=str).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes are not worth a log line
+
+
+def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> Optional[ThreadingHTTPServer]:
+    """Serve GET /metrics (JSON) from a daemon thread; local-only by default"""
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="ares-metrics", daemon=True).start()
+    log_event(None, f"Metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -1,42 +1,420 @@
-import base64
-import os
+import argparse
+import asyncio
+import contextlib
 import json
-from gem_orch import process_request  # your full logic lives here
+import math
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Dict, Iterator, List
+
+import websockets
+from PIL import Image, ImageDraw
+
+import gem_orch
+from frame_protocol import encode_frame
+from grounding_cache import GroundingCache
+from fake_model_server import FakeModelServer
+from model_backend import MockBackend, ModelBackend, OpenAIBackend, RecordingBackend, ToolRequest
+from model_routing import FAST_MODEL, ModelRouter
+from plan_cache import PlanCache
+from prompts import estimate_tokens
+from image_prep import prepare_frame
+from telemetry import flush_logs, metrics
+from web_socket import echo_handler
+
+# ---------------------------------------------------------------------------
+# 🏁 Replay benchmark: screenshots -> process_request (direct or over the websocket)
+# ---------------------------------------------------------------------------
+# Offline by default: a MockBackend with recorded answers (bench_fixture.json) and
+# simulated model latency. Use --backend live / record to go through Gemini, or --backend fake
+# for the real HTTP client against a local fake endpoint with injected failures.
 
 # Setup test inputs
-instruction = "Open WhatsApp and send text message to Subhrato Som"
-client_id = "test_client"
-
-# Folder with mock screenshots
-mock_folder = "content"
-image_files = sorted(os.listdir(mock_folder))  # assumes 1.jpeg, 2.jpeg, ...
-
-# Step 1: send instruction + first screenshot
-def encode_image(path):
-    with open(path, "rb") as img_file:
-        return base64.b64encode(img_file.read()).decode("utf-8")
-
-first_image_path = os.path.join(mock_folder, image_files[0])
-first_payload = {
-    "instruction": instruction,
-    "imageb64": encode_image(first_image_path)
-}
-
-# Send first input
-print(">>> First request:")
-response = process_request(first_payload, client_id)
-print(json.dumps(response, indent=2))
-
-# Step 2 onward: send remaining screenshots one at a time
-for image_name in image_files[1:]:
-    path = os.path.join(mock_folder, image_name)
-    payload = {
-        "imageb64": encode_image(path)
+DEFAULT_INSTRUCTION = "Open WhatsApp and send text message to Subhrato Som"
+DEFAULT_FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_fixture.json")
+
+
+class StageRecorder:
+    """Thread-safe latency samples per stage, in seconds"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.counters: Dict[str, int] = {"steps": 0, "completed": 0, "errors": 0}
+        self.sizes: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def bump(self, counter: str) -> None:
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + 1
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def record_size(self, name: str, value: float) -> None:
+        with self._lock:
+            self.sizes.setdefault(name, []).append(value)
+
+    def record_all(self, timings: Dict[str, float]) -> None:
+        for stage, seconds in timings.items():
+            self.record(stage, seconds)
+
+
+class TimedBackend(ModelBackend):
+    """Wraps a backend and records plan/ground latency per call, split by model tier"""
+
+    def __init__(self, inner: ModelBackend, recorder: StageRecorder):
+        self.inner = inner
+        self.recorder = recorder
+
+    def _stage(self, request: ToolRequest) -> str:
+        stage = "plan" if "instruction" in request.context else "ground"
+        for tier, model in gem_orch.router.models.items():
+            if request.model == model:
+                return f"{stage}_{tier}"
+        return stage
+
+    def _record_payload(self, request: ToolRequest) -> None:
+        # Estimated prompt tokens per call, and how many sit in the cacheable static prefix
+        tokens = estimate_tokens(request.messages)
+        self.recorder.record_size(f"{self._stage(request)}_tokens", tokens["total"])
+        self.recorder.record_size(f"{self._stage(request)}_prefix_tokens", tokens["prefix"])
+        # Size of the image data URLs actually sent, i.e. the vision payload per call
+        for message in request.messages:
+            for part in message["content"] if isinstance(message["content"], list) else []:
+                if part.get("type") == "image_url":
+                    self.recorder.record_size("model_image_kb", len(part["image_url"]["url"]) / 1024)
+
+    def call(self, request: ToolRequest) -> str:
+        self._record_payload(request)
+        start = time.perf_counter()
+        try:
+            return self.inner.call(request)
+        finally:
+            self.recorder.record(self._stage(request), time.perf_counter() - start)
+
+    def stream(self, request: ToolRequest) -> Iterator[str]:
+        self._record_payload(request)
+        start = time.perf_counter()
+        try:
+            yield from self.inner.stream(request)
+        finally:
+            self.recorder.record(self._stage(request), time.perf_counter() - start)
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    rank = math.ceil(pct / 100 * len(sorted_values))
+    return sorted_values[max(0, min(len(sorted_values), rank) - 1)]
+
+
+def synthetic_frames(count: int, size=(1080, 2400)) -> List[bytes]:
+    """Distinct fake app screens, so none of them trips duplicate detection"""
+    frames = []
+    for i in range(count):
+        image = Image.new("RGB", size, "white")
+        draw = ImageDraw.Draw(image)
+        for row in range(10):
+            top = 200 + row * 210 + (i * 37) % 180
+            shade = 200 + (row * 13 + i * 29) % 50
+            draw.rectangle([60, top, size[0] - 60, top + 150], fill=(shade, shade, 255), outline="gray")
+            draw.text((100, top + 60), f"Screen {i} item {row}", fill="black")
+        draw.rectangle([0, (i * 150) % size[1], size[0] // (i % 3 + 2), (i * 150) % size[1] + 120], fill="teal")
+        buffer = BytesIO()
+        image.save(buffer, format="JPEG", quality=70)
+        frames.append(buffer.getvalue())
+    return frames
+
+
+def load_frames(folder: str, synthetic: int) -> List[bytes]:
+    if synthetic or not os.path.isdir(folder):
+        return synthetic_frames(synthetic or 12)
+    frames = []
+    for name in sorted(os.listdir(folder)):  # assumes 1.jpeg, 2.jpeg, ...
+        with open(os.path.join(folder, name), "rb") as img_file:
+            frames.append(img_file.read())
+    return frames
+
+
+def replay_direct(session: int, frames: List[bytes], instruction: str, recorder: StageRecorder) -> None:
+    client_id = f"bench-{session}"
+    for index, jpeg in enumerate(frames):
+        step_start = time.perf_counter()
+        timings: Dict[str, float] = {}
+        payload = prepare_frame(jpeg, timings=timings, overlay=gem_orch.GRID_FRAME)
+        payload.pop("source_size")
+        recorder.record_all(timings)
+        if "image_bytes" in payload:
+            recorder.record_size("frame_kb", len(payload["image_bytes"]) / 1024)
+        if index == 0:
+            payload["instruction"] = instruction
+
+        start = time.perf_counter()
+        response = gem_orch.process_request(payload, client_id)
+        recorder.record("process_request", time.perf_counter() - start)
+        recorder.record("step", time.perf_counter() - step_start)
+        recorder.bump("steps")
+        if response.get("isDone"):
+            recorder.bump("completed")
+            break
+    gem_orch.end_session(client_id)
+
+
+async def replay_websocket(session: int, port: int, frames: List[bytes], instruction: str, recorder: StageRecorder,
+                           stream: bool = False, reconnect: bool = False, burst: int = 1) -> None:
+    websocket = None
+    seq = 0
+    try:
+        for index, jpeg in enumerate(frames):
+            if websocket is None or reconnect:
+                # A new connection per frame may land on another server worker each time
+                if websocket is not None:
+                    await websocket.close()
+                websocket = await websockets.connect(f"ws://127.0.0.1:{port}", max_size=None)
+            header = {"device_id": f"bench-{session}", "stream_steps": stream}
+            if index == 0:
+                header["prompt"] = instruction
+            start = time.perf_counter()
+            # A burst repeats the screenshot back-to-back, like a phone sending faster than
+            # steps finish; only the last one's answer counts
+            for _ in range(1 if index == 0 else burst):
+                seq += 1
+                await websocket.send(encode_frame({**header, "seq": seq}, jpeg))
+            while True:
+                response = json.loads(await websocket.recv())
+                if "ack" in response:
+                    recorder.bump(f"frames_{response['status']}")
+                    continue
+                if response.get("seq", seq) != seq:
+                    recorder.bump("stale_answers")  # answered a frame queued before the last one
+                    continue
+                break
+            # When the phone could start its gesture
+            recorder.record("first_command", time.perf_counter() - start)
+            if response.get("streamed"):
+                response = json.loads(await websocket.recv())["update"]
+            recorder.record("roundtrip", time.perf_counter() - start)
+            recorder.bump("steps")
+            if "error" in response:
+                recorder.bump("errors")
+            if response.get("isDone"):
+                recorder.bump("completed")
+                break
+    finally:
+        if websocket is not None:
+            await websocket.close()
+
+
+@contextlib.contextmanager
+def server_workers(args) -> Iterator[int]:
+    """web_socket.py with --workers in a subprocess, answering from MockBackend; yields its port"""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    store = tempfile.TemporaryDirectory()
+    env = {**os.environ, "ARES_METRICS_PORT": "0", "ARES_SESSION_STORE_PATH": os.path.join(store.name, "sessions.db")}
+    command = [sys.executable, "web_socket.py", "--host", "127.0.0.1", "--port", str(port),
+               "--workers", str(args.workers), "--mock-latency", str(args.latency)]
+    output = None if args.verbose else subprocess.DEVNULL
+    server = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)), env=env, stdout=output, stderr=output)
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if server.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("web_socket.py workers did not start")
+                time.sleep(0.2)
+        # Workers bind one after another; give the last ones a moment to join the port
+        time.sleep(1.0)
+        yield port
+    finally:
+        server.terminate()
+        server.wait()
+        store.cleanup()
+
+
+async def replay_all(args, port: int, frames: List[bytes], recorder: StageRecorder) -> None:
+    await asyncio.gather(*(
+        replay_websocket(i, port, frames, args.instruction, recorder, args.stream, args.reconnect, args.burst)
+        for i in range(args.sessions)
+    ))
+
+
+async def run_websocket(args, frames: List[bytes], recorder: StageRecorder) -> float:
+    """Replay over websockets; returns the seconds spent starting server workers, not part of the replay"""
+    if args.workers:
+        start = time.perf_counter()
+        with server_workers(args) as port:
+            setup = time.perf_counter() - start
+            await replay_all(args, port, frames, recorder)
+        return setup
+    async with websockets.serve(echo_handler, "127.0.0.1", 0, max_size=None) as server:
+        await replay_all(args, server.sockets[0].getsockname()[1], frames, recorder)
+    return 0.0
+
+
+def mock_backend(args) -> MockBackend:
+    fast_latency = args.latency if args.fast_latency is None else args.fast_latency
+    return MockBackend(fixture_path=args.fixture, latency=args.latency, jitter=args.jitter, model_latency={FAST_MODEL: fast_latency})
+
+
+def make_backend(args) -> ModelBackend:
+    if args.backend == "mock":
+        return mock_backend(args)
+    if args.backend == "record":
+        return RecordingBackend(OpenAIBackend(), args.record_to)
+    if args.backend == "fake":
+        server = FakeModelServer(
+            mock_backend(args),
+            fail_rate=args.fail_rate, slow_rate=args.slow_rate, slow_latency=args.slow_latency,
+        )
+        port = server.start()
+        return OpenAIBackend(api_key="fake", base_url=f"http://127.0.0.1:{port}/")
+    return OpenAIBackend()
+
+
+def report(args, recorder: StageRecorder, wall: float, peak_alloc: int) -> dict:
+    stages = {}
+    for stage, values in recorder.samples.items():
+        ordered = sorted(values)
+        stages[stage] = {
+            "count": len(ordered),
+            "mean_ms": sum(ordered) / len(ordered) * 1000,
+            "p50_ms": percentile(ordered, 50) * 1000,
+            "p95_ms": percentile(ordered, 95) * 1000,
+            "p99_ms": percentile(ordered, 99) * 1000,
+        }
+    return {
+        "mode": args.mode,
+        "backend": args.backend,
+        "sessions": args.sessions,
+        "workers": args.workers,
+        "grounding": gem_orch.GROUNDING_MODE,
+        "routing": gem_orch.router.stats(),
+        "steps": recorder.counters["steps"],
+        "completed_sessions": recorder.counters["completed"],
+        "errors": recorder.counters["errors"],
+        "burst": args.burst,
+        "ingest": {name: recorder.counters.get(name, 0) for name in ("frames_queued", "frames_superseded", "stale_answers")},
+        "wall_s": wall,
+        "throughput_steps_per_s": recorder.counters["steps"] / wall if wall else 0.0,
+        "peak_python_alloc_mb": peak_alloc / 2**20 if peak_alloc else None,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "plan_cache": gem_orch.plan_cache.stats(),
+        "grounding_cache": gem_orch.grounding_cache.stats(),
+        "element_index": gem_orch.element_index.stats(),
+        "counters": dict(metrics.counters),
+        "stages": stages,
+        "sizes": {name: {"count": len(v), "mean": sum(v) / len(v), "max": max(v)} for name, v in recorder.sizes.items()},
     }
-    print(f"\n>>> Processing {image_name}:")
-    response = process_request(payload, client_id)
-    print(json.dumps(response, indent=2))
 
-    if response.get("isDone"):
-        print("✅ Instruction completed!")
-        break
+
+def print_report(result: dict) -> None:
+    print(f"\n{result['mode']} replay, {result['backend']} backend, {result['sessions']} session(s), {result['grounding']} grounding")
+    if result["workers"]:
+        print(f"  server: {result['workers']} worker process(es), mock latency only (server-side stages not recorded)")
+    print(f"  steps: {result['steps']}  completed sessions: {result['completed_sessions']}  errors: {result['errors']}"
+          f"  wall: {result['wall_s']:.2f}s")
+    print(f"  throughput: {result['throughput_steps_per_s']:.2f} steps/s")
+    if result["burst"] > 1:
+        print(f"  ingest (bursts of {result['burst']}): " + ", ".join(f"{name}={value}" for name, value in result["ingest"].items()))
+    memory = f"max RSS {result['max_rss_mb']:.1f} MB"
+    if result["peak_python_alloc_mb"] is not None:
+        memory += f", peak python alloc {result['peak_python_alloc_mb']:.1f} MB"
+    print(f"  memory: {memory}")
+    routing = result["routing"]
+    print(f"  routing: {routing['mode']} ({routing['models']['fast']} -> {routing['models']['heavy']})")
+    for kind in ("plan", "ground"):
+        for tier, counts in sorted(routing.get(kind, {}).items()):
+            print(f"    {kind}/{tier}: " + ", ".join(
+                f"{name}={value:.2f}" if isinstance(value, float) else f"{name}={value}" for name, value in sorted(counts.items())
+            ))
+    if result["grounding"] == "elements":
+        index = result["element_index"]
+        print(f"  element index: {index['entries']} frames, hit rate {index['hit_rate']:.2f}")
+    if result["counters"]:
+        print("  counters: " + ", ".join(f"{name}={value}" for name, value in sorted(result["counters"].items())))
+    print(f"  {'stage':<24}{'n':>6}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}   (ms)")
+    for stage, s in sorted(result["stages"].items()):
+        print(f"  {stage:<24}{s['count']:>6}{s['mean_ms']:>10.1f}{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}")
+    for name, s in sorted(result["sizes"].items()):
+        print(f"  {name:<24}{s['count']:>6}  mean {s['mean']:.1f}  max {s['max']:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay screenshots through the Ares pipeline and report latency")
+    parser.add_argument("--content", default="content", help="folder of screenshots (1.jpeg, 2.jpeg, ...)")
+    parser.add_argument("--synthetic", type=int, default=0, help="use N generated frames instead of --content")
+    parser.add_argument("--instruction", default=DEFAULT_INSTRUCTION)
+    parser.add_argument("--mode", choices=["direct", "websocket"], default="direct")
+    parser.add_argument("--sessions", type=int, default=1, help="concurrent replay sessions")
+    parser.add_argument("--backend", choices=["mock", "fake", "live", "record"], default="mock")
+    parser.add_argument("--fixture", default=DEFAULT_FIXTURE, help="recorded answers for the mock backend")
+    parser.add_argument("--record-to", default="recorded_fixture.json", help="fixture written by --backend record")
+    parser.add_argument("--latency", type=float, default=0.8, help="mock model latency per call (s)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="extra random mock latency, up to (s)")
+    parser.add_argument("--fast-latency", type=float, default=None, help="mock latency of the fast model tier (s), default --latency")
+    parser.add_argument("--routing", choices=["tiered", "heavy", "fast"], default=None, help="model routing, default ARES_MODEL_ROUTING")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fake backend: fraction of HTTP 503 answers")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fake backend: fraction of slow answers")
+    parser.add_argument("--slow-latency", type=float, default=10.0, help="fake backend: delay of a slow answer (s)")
+    parser.add_argument("--stream", action="store_true", help="websocket mode: ask for early-dispatched commands")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="websocket mode: replay against web_socket.py --workers N in a subprocess (mock backend)")
+    parser.add_argument("--reconnect", action="store_true",
+                        help="websocket mode: new connection per frame, so sessions move between workers")
+    parser.add_argument("--burst", type=int, default=1,
+                        help="websocket mode: send each screenshot N times back-to-back (server keeps the newest)")
+    parser.add_argument("--no-cache", action="store_true", help="disable plan and grounding caches")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--trace-memory", action="store_true", help="track peak Python allocations (slows the run)")
+    parser.add_argument("--verbose", action="store_true", help="show pipeline logs")
+    args = parser.parse_args()
+
+    frames = load_frames(args.content, args.synthetic)
+    recorder = StageRecorder()
+    if args.routing is not None:
+        gem_orch.router = ModelRouter(mode=args.routing)
+    gem_orch.set_backend(TimedBackend(make_backend(args), recorder))
+    if args.no_cache:
+        gem_orch.plan_cache = PlanCache(max_entries=0, path=None)
+        gem_orch.grounding_cache = GroundingCache(max_entries=0, path=None)
+
+    if args.trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    setup = 0.0
+    with contextlib.redirect_stdout(sys.stdout if args.verbose else open(os.devnull, "w")):
+        if args.mode == "websocket":
+            setup = asyncio.run(run_websocket(args, frames, recorder))
+        else:
+            with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+                futures = [pool.submit(replay_direct, i, frames, args.instruction, recorder) for i in range(args.sessions)]
+                for future in futures:
+                    future.result()
+        flush_logs()
+    wall = time.perf_counter() - start - setup
+    peak = tracemalloc.get_traced_memory()[1] if args.trace_memory else 0
+    tracemalloc.stop()
+
+    result = report(args, recorder, wall, peak)
+    print_report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
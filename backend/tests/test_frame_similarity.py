@@ -0,0 +1,20 @@
+from frame_similarity import FrameHistory
+
+A, B, C = 0, (1 << 64) - 1, (1 << 128) - (1 << 64)
+
+
+def test_only_the_previous_frame_counts_as_unchanged():
+    history = FrameHistory(threshold=10, window=3)
+    assert [history.observe(fp) for fp in (A, B, C)] == [False, False, False]
+    # Back on a screen seen two frames ago: navigation, not a no-op
+    assert history.observe(B) is False
+    assert history.observe(B ^ 0b111) is True
+
+
+def test_find_still_matches_the_whole_window():
+    history = FrameHistory(threshold=10, window=3)
+    for fp in (A, B, C):
+        history.observe(fp)
+    assert history.find(A ^ 1) == A
+    history.observe(B)
+    assert history.find(A) is None  # pushed out of the window
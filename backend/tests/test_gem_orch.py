@@ -0,0 +1,109 @@
+import io
+
+import pytest
+from PIL import Image, ImageDraw
+
+import gem_orch
+from model_backend import ModelBackend, MockBackend
+from model_gateway import ModelError
+
+
+class GarbledBackend(ModelBackend):
+    """Answers every tool call with the same broken arguments"""
+
+    def __init__(self, arguments: str):
+        self.arguments = arguments
+
+    def call(self, request):
+        return self.arguments
+
+
+@pytest.fixture
+def use_backend():
+    previous = gem_orch.backend.inner
+    yield gem_orch.set_backend
+    gem_orch.set_backend(previous)
+
+
+def jpeg(stripes: int = 0) -> bytes:
+    """A screenshot; different stripe counts give clearly different fingerprints"""
+    image = Image.new("RGB", (540, 1200), "white")
+    draw = ImageDraw.Draw(image)
+    for i in range(stripes):
+        top = 100 + i * 1000 // stripes
+        draw.rectangle((0, top, 540, top + 500 // stripes), fill="black")
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("arguments", ['{"goals": ["Open', '{"steps": []}', '{"goals": "Open settings"}'])
+def test_malformed_plan_is_a_model_error(use_backend, arguments):
+    use_backend(GarbledBackend(arguments))
+    with pytest.raises(ModelError):
+        gem_orch.extract_goals("open settings")
+
+
+@pytest.mark.parametrize("arguments", ['{"box_id": ', '{}', '{"box_id": "top left"}'])
+def test_malformed_box_is_a_model_error(use_backend, arguments):
+    use_backend(GarbledBackend(arguments))
+    with pytest.raises(ModelError):
+        gem_orch.select_box("Tap settings", jpeg())
+    with pytest.raises(ModelError):
+        gem_orch.select_box("Tap settings", jpeg(), on_box=lambda box_id: None)
+
+
+def test_malformed_answer_takes_the_retry_path(use_backend):
+    use_backend(GarbledBackend("not json"))
+    response = gem_orch.process_request({"instruction": "open settings", "image_bytes": jpeg()}, "garbled")
+    assert response["command"]["action"] == "wait"
+    assert response["warning"] == "Model unavailable, retrying"
+
+    # The instruction is kept and planned again once the model answers properly
+    use_backend(MockBackend(latency=0))
+    response = gem_orch.process_request({"image_bytes": jpeg()}, "garbled")
+    assert response["command"]["action"] == "tap"
+    gem_orch.end_session("garbled")
+
+
+def test_going_back_to_an_earlier_screen_is_not_unchanged(use_backend):
+    use_backend(MockBackend(latency=0))
+    screen_a, screen_b, screen_c = jpeg(1), jpeg(3), jpeg(7)
+    instruction = "open settings, then tap wi-fi, then go back, then tap bluetooth"
+    actions = [gem_orch.process_request({"instruction": instruction, "image_bytes": screen_a}, "back-nav")["command"]["action"]]
+    for screen in (screen_b, screen_c, screen_b):
+        actions.append(gem_orch.process_request({"image_bytes": screen}, "back-nav")["command"]["action"])
+    assert actions == ["tap", "tap", "back", "tap"]
+    assert gem_orch.sessions.get("back-nav").is_all_done()
+    gem_orch.end_session("back-nav")
+
+
+class FailingPlanner(ModelBackend):
+    """Streams the first planned goal, then fails the call"""
+
+    def call(self, request):
+        raise ModelError("planner down")
+
+    def stream(self, request):
+        yield '{"goals": ["Tap Wi-Fi", "Tap'
+        raise ModelError("planner down")
+
+
+class FakeSpeculation:
+    def __init__(self, goal_index, goal, *args):
+        self.goal = goal
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+def test_failed_planning_cancels_speculative_groundings(use_backend, monkeypatch):
+    started = []
+    monkeypatch.setattr(gem_orch, "SPECULATIVE_START", True)
+    monkeypatch.setattr(gem_orch, "speculate", lambda *args: started.append(FakeSpeculation(*args)) or started[-1])
+    use_backend(FailingPlanner())
+    response = gem_orch.process_request({"instruction": "tap wi-fi", "image_bytes": jpeg()}, "failed-plan")
+    assert response["command"]["action"] == "wait"
+    assert started and all(speculation.cancelled for speculation in started)
+    gem_orch.pending_instructions.discard("failed-plan")
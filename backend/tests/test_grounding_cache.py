@@ -0,0 +1,73 @@
+from grounding_cache import GroundingCache
+
+THRESHOLD = 10
+
+
+def flip(fingerprint: int, bits: int) -> int:
+    """The fingerprint with its lowest `bits` bits flipped: exactly that Hamming distance away"""
+    return fingerprint ^ ((1 << bits) - 1)
+
+
+def cache(**kwargs) -> GroundingCache:
+    return GroundingCache(threshold=THRESHOLD, path=None, **kwargs)
+
+
+def test_hit_up_to_the_threshold_and_miss_beyond():
+    grounding = cache()
+    grounding.put("Tap Wi-Fi", 0xF0F0, "b3")
+    assert grounding.get("Tap Wi-Fi", 0xF0F0) == "b3"
+    assert grounding.get("Tap Wi-Fi", flip(0xF0F0, THRESHOLD)) == "b3"
+    assert grounding.get("Tap Wi-Fi", flip(0xF0F0, THRESHOLD + 1)) is None
+    assert grounding.get("Tap Bluetooth", 0xF0F0) is None
+    stats = grounding.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 2)
+
+
+def test_goals_are_normalized_and_scopes_kept_apart():
+    grounding = cache()
+    grounding.put("Tap 'OK'.", 1, "c2", scope="grid")
+    assert grounding.get("tap ok", 1, scope="grid") == "c2"
+    assert grounding.get("tap ok", 1, scope="elements") is None
+    assert grounding.get("tap ok", 1) is None
+
+
+def test_closest_screen_wins():
+    grounding = cache()
+    grounding.put("Tap Wi-Fi", 0, "a1")
+    grounding.put("Tap Wi-Fi", flip(0, 8), "a2")
+    assert grounding.get("Tap Wi-Fi", flip(0, 6)) == "a2"
+    assert grounding.get("Tap Wi-Fi", flip(0, 2)) == "a1"
+
+
+def test_invalidate_within_the_threshold_only():
+    grounding = cache()
+    grounding.put("Tap Wi-Fi", 0, "b3")
+    assert grounding.invalidate("Tap Wi-Fi", flip(0, THRESHOLD + 1)) is None
+    assert grounding.get("Tap Wi-Fi", 0) == "b3"
+    assert grounding.invalidate("Tap Wi-Fi", flip(0, THRESHOLD)) == "b3"
+    assert grounding.get("Tap Wi-Fi", 0) is None
+    assert grounding.invalidate("Tap Wi-Fi", 0) is None
+
+
+def test_nearest_uses_its_own_distance_without_counting():
+    grounding = cache()
+    grounding.put("Tap Wi-Fi", 0, "b3")
+    assert grounding.nearest("Tap Wi-Fi", flip(0, 20), max_distance=20) == "b3"
+    assert grounding.nearest("Tap Wi-Fi", flip(0, 21), max_distance=20) is None
+    assert (grounding.hits, grounding.misses) == (0, 0)
+
+
+def test_lru_eviction_and_ttl():
+    grounding = cache(max_entries=2)
+    grounding.put("Tap A", 1, "a1")
+    grounding.put("Tap B", 1, "b1")
+    assert grounding.get("Tap A", 1) == "a1"  # now most recently used
+    grounding.put("Tap C", 1, "c1")
+    assert grounding.get("Tap B", 1) is None
+    assert grounding.get("Tap A", 1) == "a1"
+    assert grounding.stats()["evictions"] == 1
+
+    expired = cache(ttl=-1)
+    expired.put("Tap A", 1, "a1")
+    assert expired.get("Tap A", 1) is None
+    assert expired.stats()["entries"] == 0
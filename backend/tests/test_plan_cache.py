@@ -0,0 +1,65 @@
+from plan_cache import PlanCache, extract_slots, fill_template, goals_to_template
+
+WHATSAPP_GOALS = ["Open WhatsApp", "Search for John", "Tap John's chat", "Type 'hello' into the message box", "Tap send"]
+
+
+def test_extract_slots_keeps_app_names_and_sentence_case():
+    assert extract_slots("Message John on WhatsApp") == ("message <<0>> on whatsapp", ["John"])
+    assert extract_slots('Send "see you at 7" to Priya Sharma') == ("send <<0>> to <<1>>", ["see you at 7", "Priya Sharma"])
+    assert extract_slots("Set an alarm for 6:45") == ("set an alarm for <<0>>", ["6:45"])
+
+
+def test_template_round_trip():
+    templates = goals_to_template(WHATSAPP_GOALS, ["John"])
+    assert templates[1] == "Search for <<0>>"
+    assert fill_template(templates, ["Priya"])[1:3] == ["Search for Priya", "Tap Priya's chat"]
+
+
+def test_template_needs_every_slot_in_the_goals():
+    assert goals_to_template(["Open WhatsApp", "Tap the first chat"], ["John"]) is None
+    assert goals_to_template(["Call Sam", "Text Sam"], ["Sam", "sam"]) is None
+
+
+def test_exact_hit_template_hit_and_miss():
+    cache = PlanCache(path=None)
+    cache.put("Message John on WhatsApp", WHATSAPP_GOALS)
+
+    assert cache.get("message john on whatsapp!") == WHATSAPP_GOALS
+    goals = cache.get("Message Priya on WhatsApp")
+    assert goals[1] == "Search for Priya" and goals[0] == "Open WhatsApp"
+    assert cache.get("Message Priya on Instagram") is None
+    assert cache.stats() == {"entries": 2, "hits": 1, "template_hits": 1, "misses": 1}
+
+
+def test_numbers_are_slots():
+    cache = PlanCache(path=None)
+    cache.put("Set an alarm for 7:30", ["Open Clock", "Tap Alarm", "Set alarm to 7:30"])
+    assert cache.get("Set an alarm for 6:45") == ["Open Clock", "Tap Alarm", "Set alarm to 6:45"]
+
+
+def test_hits_are_copies():
+    cache = PlanCache(path=None)
+    cache.put("Open Reddit", ["Open Reddit"])
+    cache.get("Open Reddit").append("Scroll down")
+    assert cache.get("Open Reddit") == ["Open Reddit"]
+
+
+def test_expired_and_evicted_entries_miss():
+    expired = PlanCache(ttl=-1, path=None)
+    expired.put("Message John on WhatsApp", WHATSAPP_GOALS)
+    assert expired.get("Message John on WhatsApp") is None
+
+    small = PlanCache(max_entries=1, path=None)
+    small.put("Open Reddit", ["Open Reddit"])
+    small.put("Open Uber", ["Open Uber"])
+    assert small.get("Open Reddit") is None
+    assert small.get("Open Uber") == ["Open Uber"]
+
+
+def test_slot_values_inside_other_words_stay_literal():
+    cache = PlanCache(path=None)
+    cache.put("Set an alarm for 7 AM", ["Open Clock", "Tap the AM/PM toggle", "Set alarm to 7 AM"])
+    assert cache.get("Set an alarm for 6 PM") == ["Open Clock", "Tap the AM/PM toggle", "Set alarm to 6 PM"]
+
+    cache.put("Call Sam", ["Open Phone", "Search for Sam", "Skip the Sam-Team group", "Tap Sam's number"])
+    assert cache.get("Call Ana") == ["Open Phone", "Search for Ana", "Skip the Sam-Team group", "Tap Ana's number"]
@@ -0,0 +1,113 @@
+import itertools
+import time
+
+import pytest
+
+from session_machine import TRANSITIONS, DeadlineScheduler, GoalMachine, recovery_ladder
+
+PHASES = ("seeking", "recovering", "doomed")
+EVENTS = ("frame", "unchanged", "found", "not_found", "stuck")
+
+
+def machine(goals=("Open Settings", "Tap Wi-Fi"), plan="swipeUp:2,back", timeout=0.0, **kwargs) -> GoalMachine:
+    return GoalMachine(list(goals), ladder=recovery_ladder(plan), timeout=timeout, scheduler=DeadlineScheduler(), **kwargs)
+
+
+def wait_for(condition, timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def test_every_phase_handles_every_event():
+    assert set(TRANSITIONS) == set(itertools.product(PHASES, EVENTS))
+    assert {phase for phase, _ in TRANSITIONS.values()} <= set(PHASES)
+
+
+def test_unknown_event_is_rejected_without_side_effects():
+    goals = machine()
+    with pytest.raises(KeyError):
+        goals.handle("teleported")
+    assert (goals.goal_index, goals.phase) == (0, "seeking")
+
+
+def test_found_acts_and_advances():
+    goals = machine()
+    assert goals.handle("frame").effect == "ground"
+    assert goals.handle("found").effect == "act"
+    assert goals.current_goal() == "Tap Wi-Fi"
+    goals.handle("frame")
+    goals.handle("found")
+    assert goals.is_all_done()
+
+
+def test_recovery_ladder_then_skip():
+    goals = machine()
+    goals.handle("frame")
+    actions = [goals.handle("not_found").action for _ in range(3)]
+    assert actions == ["swipeUp", "swipeUp", "back"]
+    assert goals.phase == "recovering"
+    assert goals.handle("not_found").effect == "skip"
+    assert goals.skipped == [0]
+    assert (goals.goal_index, goals.phase, goals.recoveries) == (1, "seeking", [])
+
+
+def test_found_while_recovering_counts_as_done():
+    goals = machine()
+    goals.handle("frame")
+    goals.handle("not_found")
+    assert goals.handle("frame").effect == "ground"
+    assert goals.handle("found").effect == "act"
+    assert (goals.goal_index, goals.phase, goals.skipped) == (1, "seeking", [])
+
+
+def test_unchanged_screens_wait_until_stuck():
+    goals = machine(max_failures=3)
+    assert [goals.handle("unchanged").effect for _ in range(3)] == ["wait", "wait", "recover"]
+    assert goals.phase == "recovering"
+    # Every further unchanged screen takes the next rung without a model call
+    assert goals.handle("unchanged").effect == "recover"
+
+
+def test_deadline_dooms_the_goal_and_the_next_frame_skips_it():
+    doomed = []
+    goals = machine(goals=["Open Settings"], timeout=0.05, on_doomed=doomed.append)
+    assert wait_for(lambda: goals.phase == "doomed")
+    assert doomed == [0]
+    assert goals.handle("frame").effect == "skip"
+    assert goals.is_all_done() and goals.skipped == [0]
+
+
+def test_found_after_the_deadline_is_still_used():
+    goals = machine(goals=["Open Settings"], timeout=0.05)
+    assert wait_for(lambda: goals.phase == "doomed")
+    assert goals.handle("found").effect == "act"
+    assert goals.is_all_done() and goals.skipped == []
+
+
+def test_goal_finished_in_time_is_not_expired():
+    doomed = []
+    goals = machine(goals=["Open Settings"], timeout=0.05, on_doomed=doomed.append)
+    goals.handle("frame")
+    goals.handle("found")
+    time.sleep(0.15)
+    assert doomed == [] and goals.skipped == []
+
+
+def test_snapshot_round_trip_keeps_progress():
+    goals = machine()
+    goals.handle("frame")
+    goals.handle("not_found")
+    restored = machine()
+    restored.restore(goals.snapshot())
+    assert restored.snapshot()["recoveries"] == ["swipeUp"]
+    assert restored.handle("not_found").action == "swipeUp"
+    assert restored.handle("not_found").action == "back"
+
+
+def test_unknown_recovery_strategy_is_rejected():
+    with pytest.raises(ValueError):
+        recovery_ladder("swipeUp:2,teleport")
@@ -0,0 +1,52 @@
+import time
+
+from session_manager import SessionManager
+
+
+class Session:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def manager(**kwargs) -> SessionManager:
+    return SessionManager(on_evict=lambda client_id, session: session.close(), **kwargs)
+
+
+def test_lru_eviction_closes_the_session():
+    sessions = manager(max_sessions=2)
+    first, second, third = Session(), Session(), Session()
+    sessions["a"] = first
+    sessions["b"] = second
+    assert sessions.get("a") is first  # "b" is now the least recently used
+    sessions["c"] = third
+    assert "b" not in sessions
+    assert second.closed and not first.closed and not third.closed
+    assert sessions.evictions == 1
+
+
+def test_idle_expiry_closes_the_session():
+    sessions = manager(idle_ttl=0.01)
+    idle = Session()
+    sessions["a"] = idle
+    time.sleep(0.02)
+    assert len(sessions) == 0
+    assert idle.closed
+
+
+def test_discard_hands_the_session_back_unclosed():
+    sessions = manager()
+    session = Session()
+    sessions["a"] = session
+    assert sessions.discard("a") is session
+    assert not session.closed
+
+
+def test_loader_fills_misses():
+    loaded = Session()
+    sessions = SessionManager(loader=lambda client_id: loaded if client_id == "known" else None)
+    assert sessions.get("known") is loaded
+    assert sessions.get("unknown") is None
+    assert len(sessions) == 1
@@ -0,0 +1,69 @@
+import asyncio
+import base64
+import io
+import json
+
+import pytest
+import websockets
+from PIL import Image
+
+import gem_orch
+import web_socket
+from frame_protocol import encode_frame
+from model_backend import MockBackend
+
+
+@pytest.fixture(autouse=True)
+def mock_backend():
+    previous = gem_orch.backend.inner
+    gem_orch.set_backend(MockBackend(latency=0))
+    yield
+    gem_orch.set_backend(previous)
+
+
+def jpeg() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (540, 1200), "white").save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+async def exchange(*messages) -> list:
+    """Send messages one at a time over a fresh connection, collecting each one's answer"""
+    async with websockets.serve(web_socket.echo_handler, "127.0.0.1", 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        async with websockets.connect(f"ws://127.0.0.1:{port}", max_size=None) as websocket:
+            answers = []
+            for message in messages:
+                await websocket.send(message)
+                answers.append(json.loads(await asyncio.wait_for(websocket.recv(), 10)))
+            return answers
+
+
+def assert_wait_reply(reply: dict, seq: int) -> None:
+    """An answer the phone can carry on from: wait, then send a fresh frame"""
+    assert reply["seq"] == seq and "error" in reply
+    assert reply["isDone"] is False
+    assert reply["command"] == {"action": "wait", "duration": gem_orch.MODEL_ERROR_WAIT_MS}
+    assert "settle" in reply["capture"]
+
+
+def test_malformed_frame_answers_with_wait_and_connection_keeps_working():
+    bad = encode_frame({"prompt": "open settings", "seq": 1}, b"not a jpeg")
+    good = json.dumps({"prompt": "open settings", "seq": 2, "imageb64": base64.b64encode(jpeg()).decode()})
+    error, answer = asyncio.run(exchange(bad, good))
+    assert_wait_reply(error, 1)
+    assert answer["seq"] == 2 and answer["command"]["action"] == "tap"
+
+
+def test_bad_base64_answers_with_wait():
+    (error,) = asyncio.run(exchange(json.dumps({"prompt": "open settings", "seq": 7, "imageb64": "!!!"})))
+    assert_wait_reply(error, 7)
+
+
+def test_prompt_of_a_malformed_frame_is_kept_for_the_next_one():
+    bad = encode_frame({"prompt": "open settings", "device_id": "kept-prompt", "seq": 1}, b"not a jpeg")
+    retry = encode_frame({"device_id": "kept-prompt", "seq": 2}, jpeg())
+    error, answer = asyncio.run(exchange(bad, retry))
+    assert_wait_reply(error, 1)
+    assert answer["seq"] == 2 and answer["command"]["action"] == "tap"
+    gem_orch.end_session("kept-prompt")
@@ -1,68 +1,396 @@
+import argparse
 import asyncio
 import json
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple, Union
 import websockets
 import base64
-from PIL import Image
-from io import BytesIO
-from grid_marker import apply_grid_overlay
-from gem_orch import process_request
-from grid_utils import get_coordinate
+import gem_orch
+from capture_policy import capture_request
+from frame_protocol import FrameError, decode_frame
+from gem_orch import GRID_FRAME, MODEL_ERROR_WAIT_MS, create_command_response, process_request_async, end_session
+from grid_utils import DEFAULT_GEOMETRY, GridGeometry, geometry_for, get_coordinate
+from image_prep import PREP_CONFIG, crop_box, prepare_frame_job
+from model_backend import MockBackend
+from session_store import SESSION_STORE_PATH
+from telemetry import METRICS_PORT, log_event, metrics, start_metrics_server
 
-async def echo_handler(websocket):
-    async for message in websocket:
-        # print(f"Received from client: {message}", flush=True)
+# ---------------------------------------------------------------------------
+# 🧵 Scale-out: worker processes on one port, frame preparation off the event loop
+# ---------------------------------------------------------------------------
+# Each worker is a whole server process (event loop, step pool, caches) bound to the same
+# port with SO_REUSEPORT, and the kernel spreads connections across them. Sessions are
+# per process, so with several workers they go through the shared session store
+# (ARES_SESSION_STORE_PATH): a phone that reconnects to another worker resumes there.
 
-        try:
+WS_HOST = os.getenv("ARES_WS_HOST", "0.0.0.0")
+WS_PORT = int(os.getenv("ARES_WS_PORT", "8765"))
+WS_WORKERS = int(os.getenv("ARES_WS_WORKERS", "1"))
+# Processes per worker that decode/overlay/encode frames (0 = threads of the worker itself)
+FRAME_WORKERS = int(os.getenv("ARES_FRAME_WORKERS", "0"))
+
+_frame_pool: Optional[ProcessPoolExecutor] = None
+
+
+async def prepare_frame_async(image_data: Union[bytes, memoryview]) -> Tuple[dict, Dict[str, float]]:
+    """prepare_frame without blocking the event loop; on a process pool with ARES_FRAME_WORKERS"""
+    global _frame_pool
+    loop = asyncio.get_running_loop()
+    if FRAME_WORKERS <= 0:
+        # PIL releases the GIL while decoding, resizing and encoding
+        return await loop.run_in_executor(None, prepare_frame_job, image_data, GRID_FRAME)
+    if _frame_pool is None:
+        _frame_pool = ProcessPoolExecutor(FRAME_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    # Binary frames arrive as a memoryview, which can't be pickled; the clean frame only
+    # crosses the process boundary when the grounding mode needs it
+    return await loop.run_in_executor(_frame_pool, prepare_frame_job, bytes(image_data), GRID_FRAME, not GRID_FRAME)
+
+def device_geometry(screen_size: Tuple[int, int]) -> GridGeometry:
+    """The model's grid in device pixels; with a crop, it only covers the cropped region"""
+    left, top, right, bottom = crop_box(screen_size, PREP_CONFIG.crop)
+    return geometry_for(right - left, bottom - top, left=left, top=top)
+
+
+class ClientConnection:
+    """Per-websocket state: which session it drives and the phone's screen geometry"""
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        # Each connection gets its own session unless the phone names its device
+        self.client_id = str(websocket.id)
+        self.device_scoped = False
+        self.geometry: Optional[GridGeometry] = None
+        # Phones that can take an early command followed by an {"update": ...} message
+        self.stream_steps = False
+        self.received = 0  # messages so far; numbers frames from phones that send no "seq"
+
+    def update(self, data: dict, frame_size: Optional[Tuple[int, int]]) -> None:
+        if data.get("device_id") and data["device_id"] != self.client_id:
+            if not self.device_scoped:
+                end_session(self.client_id)
+            self.client_id = str(data["device_id"])
+            self.device_scoped = True
+        if "stream_steps" in data:
+            self.stream_steps = bool(data["stream_steps"])
+
+        # Taps land in device pixels: prefer the size the phone reports, else the raw frame's
+        if data.get("screen_width") and data.get("screen_height"):
+            self.geometry = device_geometry((int(data["screen_width"]), int(data["screen_height"])))
+        elif self.geometry is None and frame_size is not None:
+            self.geometry = device_geometry(frame_size)
+
+    def close(self) -> None:
+        # Device-scoped sessions survive reconnects and age out via the TTL instead
+        if not self.device_scoped:
+            end_session(self.client_id)
+
+
+def add_coordinates(connection: ClientConnection, response: dict) -> None:
+    """Turn tap/type commands' box_ids into the device pixels the phone should touch"""
+    commands = [step["command"] for step in response.get("batch", [])]
+    if "command" in response:
+        commands.append(response["command"])
+    for command in commands:
+        if command.get("action") == "tap" or  command.get("action") == "type":
+            try:
+                box_id = command["box_id"]
+                with metrics.timer("coordinate", connection.client_id):
+                    x, y = get_coordinate(box_id, connection.geometry or DEFAULT_GEOMETRY)
+                command["x_cord"] = x
+                command["y_cord"] = y
+            except Exception as e:
+                log_event(connection.client_id, f"Failed to get coordinates for box_id '{box_id}': {e}", level=logging.WARNING)
+
+
+async def send_json(connection: ClientConnection, response: dict) -> None:
+    with metrics.timer("send", connection.client_id):
+        await connection.websocket.send(json.dumps(response))
+
+
+def add_capture(response: dict) -> None:
+    """Ask the phone for its next frame as soon as the screen settles after this command"""
+    if response.get("isDone"):
+        return
+    if "command" in response:
+        response["capture"] = capture_request(response["command"])
+    elif response.get("batch"):
+        # Sent once the whole batch has run
+        response["capture"] = capture_request(response["batch"][-1]["command"])
+
+
+# ---------------------------------------------------------------------------
+# 📥 Per-connection ingest: one step at a time, the newest frame wins
+# ---------------------------------------------------------------------------
+# A phone that sends frames faster than steps finish would otherwise queue screens that
+# no longer exist, each costing a decode and a model call. While a step runs, a newer
+# frame replaces the one waiting (dropped before it is ever decoded) and the phone is told
+# with an ack; messages carrying a prompt are never coalesced away.
+
+# Messages that may wait behind a running step; beyond this the oldest is dropped
+INGEST_MAX_PENDING = int(os.getenv("ARES_INGEST_MAX_PENDING", "4"))
+
+
+class Inbound(NamedTuple):
+    """A received message, parsed only as far as its header"""
+    seq: int
+    data: dict
+    image_data: Optional[Union[bytes, memoryview, str]]  # raw image, or base64 text from JSON clients
+    received: float
+
+    @property
+    def coalescable(self) -> bool:
+        """Just a screenshot: a newer one makes it worthless"""
+        return self.image_data is not None and "prompt" not in self.data
+
+
+class FrameInbox:
+    """Messages waiting for a connection's step worker; newer screenshots supersede waiting ones"""
+
+    def __init__(self, max_pending: int = INGEST_MAX_PENDING):
+        self.max_pending = max_pending
+        self.pending: Deque[Inbound] = deque()
+        self.in_flight = False  # a step is running, so new messages have to wait
+        self.closed = False
+        self._wakeup = asyncio.Event()
+
+    def put(self, inbound: Inbound) -> List[Inbound]:
+        """Queue a message; returns the waiting messages it supersedes or pushes out"""
+        dropped = []
+        if inbound.image_data is not None:
+            # A newer screen makes waiting screenshots stale; a message without one doesn't
+            dropped = [waiting for waiting in self.pending if waiting.coalescable]
+            self.pending = deque(waiting for waiting in self.pending if not waiting.coalescable)
+        self.pending.append(inbound)
+        while len(self.pending) > self.max_pending:
+            dropped.append(self.pending.popleft())
+        self._wakeup.set()
+        return dropped
+
+    async def get(self) -> Optional[Inbound]:
+        """The next message to run; None once the connection is closed"""
+        while not self.pending:
+            if self.closed:
+                return None
+            self._wakeup.clear()
+            await self._wakeup.wait()
+        return self.pending.popleft()
+
+    def close(self) -> None:
+        # What still waits is dropped; the step in flight finishes
+        self.pending.clear()
+        self.closed = True
+        self._wakeup.set()
+
+
+def read_message(connection: ClientConnection, message: Union[str, bytes]) -> Optional[Inbound]:
+    """Parse a message's header; its image stays undecoded until the message's turn comes"""
+    try:
+        if isinstance(message, bytes):
+            # Binary mode: small JSON header + raw JPEG, no base64 anywhere
+            data, image_data = decode_frame(message)
+        else:
             data = json.loads(message)
-            print(data.get('prompt'))
-
-            input_payload = {}
-
-            if "imageb64" in data:
-                image_data = base64.b64decode(data["imageb64"])
-                image = Image.open(BytesIO(image_data)).convert("RGB")
-                image = image.resize((720, 1600))
-                image_with_grid = apply_grid_overlay(image)
-
-                # Save to buffer and encode as base64
-                buffer = BytesIO()
-                image_with_grid.save(buffer, format="PNG")
-                encoded_image = base64.b64encode(buffer.getvalue()).decode("utf-8")
-                input_payload["imageb64"] = encoded_image
-
-            if "prompt" in data:
-                print(f"Prompt from client: {data['prompt']}")
-                input_payload["instruction"] = data["prompt"]
-
-            # 🔄 Get the auto-generated server response
-            response = process_request(input_payload, client_id="test")
-            print(response)
-
-            # If it's a tap action with a box_id, compute coordinates
-            if "command" in response:
-                command = response["command"]
-                if command.get("action") == "tap" or  command.get("action") == "type":
-                    try:
-                        box_id = command["box_id"]
-                        x, y = get_coordinate(box_id)
-                        command["x_cord"] = x
-                        command["y_cord"] = y
-                        response["command"] = command  # 🔁 Explicitly re-assign back to response
-                    except Exception as e:
-                        print(f"Failed to get coordinates for box_id '{box_id}': {e}")
-            # Send to client
-
-            print(response)
-            await websocket.send(json.dumps(response))
-
-        except json.JSONDecodeError:
-            print("Received non-JSON message")
-
-
-async def main():
-    async with websockets.serve(echo_handler, "0.0.0.0", 8765):
-        print("WebSocket server running on ws://0.0.0.0:8765")
+            image_data = data.pop("imageb64", None)
+    except json.JSONDecodeError:
+        log_event(connection.client_id, "Received non-JSON message", level=logging.WARNING)
+        return None
+    except FrameError as e:
+        log_event(connection.client_id, f"Received malformed binary frame: {e}", level=logging.WARNING)
+        return None
+    connection.received += 1
+    return Inbound(data.get("seq", connection.received), data, image_data, time.perf_counter())
+
+
+async def send_ack(connection: ClientConnection, inbound: Inbound, status: str) -> None:
+    """Tell the phone what became of a frame that didn't get a step right away"""
+    await send_json(connection, {"ack": inbound.seq, "status": status, "busy": True})
+
+
+async def run_inbox(connection: ClientConnection, inbox: FrameInbox) -> None:
+    while True:
+        inbound = await inbox.get()
+        if inbound is None:
+            return
+        inbox.in_flight = True
+        try:
+            await handle_message(connection, inbound)
+        except websockets.ConnectionClosed:
+            return
+        except Exception as e:
+            # A bad frame (undecodable base64 or image) or a failed step must not stop the
+            # worker. Like a failed model call, the phone is told to wait and send a new frame
+            metrics.incr("step_errors", client_id=connection.client_id)
+            log_event(connection.client_id, f"Step failed: {e!r}", {"seq": inbound.seq}, level=logging.ERROR)
+            if "prompt" in inbound.data:
+                # Planned with the phone's next frame, which carries no prompt
+                client_id = str(inbound.data.get("device_id") or connection.client_id)
+                gem_orch.pending_instructions[client_id] = inbound.data["prompt"]
+            response = create_command_response("wait", duration=MODEL_ERROR_WAIT_MS)
+            response["error"] = f"Step failed: {type(e).__name__}"
+            add_capture(response)
+            response["seq"] = inbound.seq
+            try:
+                await send_json(connection, response)
+            except websockets.ConnectionClosed:
+                return
+        finally:
+            inbox.in_flight = False
+
+
+async def echo_handler(websocket):
+    connection = ClientConnection(websocket)
+    inbox = FrameInbox()
+    worker = asyncio.create_task(run_inbox(connection, inbox))
+    try:
+        async for message in websocket:
+            inbound = read_message(connection, message)
+            if inbound is None:
+                continue
+            busy = inbox.in_flight
+            for dropped in inbox.put(inbound):
+                metrics.incr("frames_superseded", client_id=connection.client_id)
+                await send_ack(connection, dropped, "superseded")
+            if busy:
+                metrics.incr("frames_queued", client_id=connection.client_id)
+                await send_ack(connection, inbound, "queued")
+    finally:
+        inbox.close()
+        await worker
+        connection.close()
+
+
+async def handle_message(connection: ClientConnection, inbound: Inbound) -> None:
+    step_start = time.perf_counter()
+    data, image_data = inbound.data, inbound.image_data
+    if isinstance(image_data, str):
+        image_data = base64.b64decode(image_data)
+
+    input_payload = {}
+    timings = {}
+    if image_data is not None:
+        # Coarse-to-fine and element grounding render their own views, so skip the full-grid image
+        input_payload, timings = await prepare_frame_async(image_data)
+
+    connection.update(data, input_payload.pop("source_size", None))
+    client_id = connection.client_id
+    metrics.observe("ingest_wait", step_start - inbound.received, client_id)
+    metrics.observe_all(timings, client_id)
+    if "capture_wait_ms" in data:
+        metrics.observe("capture_wait", data["capture_wait_ms"] / 1000, client_id)
+    if "batch_stopped" in data:
+        # A guarded batch step found the screen unchanged (e.g. the list ended); the rest didn't run
+        metrics.incr("batch_guard_stops", client_id=client_id)
+        log_event(client_id, "Command batch stopped by its guard", {"step": data["batch_stopped"]})
+    if "image_bytes" in input_payload:
+        log_event(client_id, "Frame prepared", {
+            "kb": round(len(input_payload["image_bytes"]) / 1024, 1),
+            "mime": input_payload["image_mime"],
+            "encode_ms": round(timings["encode"] * 1000, 1),
+        }, level=logging.DEBUG)
+
+    if "prompt" in data:
+        log_event(client_id, f"Prompt from client: {data['prompt']}")
+        input_payload["instruction"] = data["prompt"]
+
+    # ⚡ Streaming phones get the command the moment its box_id is parsed
+    early_sent = False
+
+    async def send_early(command_response: dict) -> None:
+        nonlocal early_sent
+        early_sent = True
+        add_coordinates(connection, command_response)
+        add_capture(command_response)
+        command_response["streamed"] = True  # an {"update": ...} message follows
+        command_response["seq"] = inbound.seq
+        log_event(client_id, "Early dispatch", command_response, level=logging.DEBUG)
+        await send_json(connection, command_response)
+        metrics.observe("first_command", time.perf_counter() - step_start, client_id)
+
+    # 🔄 Get the auto-generated server response
+    on_command = send_early if connection.stream_steps else None
+    response = await process_request_async(input_payload, client_id=client_id, on_command=on_command)
+
+    # If it's a tap action with a box_id, compute coordinates
+    add_coordinates(connection, response)
+    if early_sent:
+        # The command already went out; the rest arrives as details only
+        response = {"update": response}
+    else:
+        add_capture(response)
+    # The frame this answers, so the phone can match it against what it sent
+    response["seq"] = inbound.seq
+    # Send to client
+
+    log_event(client_id, "Response", response, level=logging.DEBUG)
+    await send_json(connection, response)
+    metrics.observe("step", time.perf_counter() - step_start, client_id)
+
+
+async def serve(host: str = WS_HOST, port: int = WS_PORT, reuse_port: bool = False, metrics_port: int = METRICS_PORT) -> None:
+    start_metrics_server(port=metrics_port)
+    async with websockets.serve(echo_handler, host, port, reuse_port=reuse_port):
+        log_event(None, f"WebSocket server running on ws://{host}:{port}", {"pid": os.getpid()})
         await asyncio.Future()
 
+
+def run_worker(host: str, port: int, metrics_port: int, mock_latency: Optional[float]) -> None:
+    """Entry point of one SO_REUSEPORT worker process"""
+    if mock_latency is not None:
+        gem_orch.set_backend(MockBackend(latency=mock_latency))
+    asyncio.run(serve(host, port, reuse_port=True, metrics_port=metrics_port))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Ares websocket server")
+    parser.add_argument("--host", default=WS_HOST)
+    parser.add_argument("--port", type=int, default=WS_PORT)
+    parser.add_argument("--workers", type=int, default=WS_WORKERS, help="server processes sharing the port")
+    parser.add_argument("--mock-latency", type=float, default=None,
+                        help="answer model calls with MockBackend after this delay (s), e.g. for load tests")
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        if args.mock_latency is not None:
+            gem_orch.set_backend(MockBackend(latency=args.mock_latency))
+        asyncio.run(serve(args.host, args.port))
+        return
+
+    if not SESSION_STORE_PATH:
+        log_event(None, "Several workers without ARES_SESSION_STORE_PATH: a reconnect to another worker "
+                        "loses its session", level=logging.WARNING)
+    # Read by each worker's gem_orch at import
+    os.environ["ARES_SHARED_SESSIONS"] = "1"
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(
+            target=run_worker,
+            args=(args.host, args.port, METRICS_PORT + i if METRICS_PORT else 0, args.mock_latency),
+            name=f"ares-ws-{i}",
+        )
+        for i in range(args.workers)
+    ]
+    # A plain SIGTERM would leave the workers running; turn it into an orderly exit
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    main()
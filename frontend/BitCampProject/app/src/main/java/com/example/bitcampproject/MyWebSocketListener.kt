@@ -2,39 +2,73 @@ package com.example.bitcampproject
 
 import android.app.Activity
 import android.content.Context
+import android.os.Handler
+import android.os.Looper
+import android.os.SystemClock
+import android.provider.Settings
 import android.util.Log
 import android.widget.Toast
 import okhttp3.Response
 import okhttp3.WebSocket
 import okhttp3.WebSocketListener
 import okio.ByteString
+import okio.ByteString.Companion.toByteString
+import org.json.JSONArray
 import org.json.JSONObject
+import java.nio.ByteBuffer
+import java.util.UUID
 
 class MyWebSocketListener(
     private val context: Context,
-    private val promptText: String
+    private val promptText: String,
+    // Binary frames: [u32 header length][JSON header][raw JPEG], ~33% smaller than base64 JSON
+    private val useBinaryFrames: Boolean = true
 ) : WebSocketListener() {
 
+    companion object {
+        // Servers without capture requests get the old fixed wait
+        private const val LEGACY_CAPTURE_DELAY_MS = 4000L
+        private const val SETTLE_POLL_MS = 50L
+        private const val PREFS_NAME = "ares"
+        private const val PREF_DEVICE_ID = "device_id"
+    }
+
+    private val handler = Handler(Looper.getMainLooper())
+
+    // Stable per-device id so the server keeps this phone's session across reconnects.
+    // Without an ANDROID_ID, a random id is generated once and kept, so such devices
+    // never share (and take over) one server session.
+    private val deviceId: String by lazy {
+        Settings.Secure.getString(context.contentResolver, Settings.Secure.ANDROID_ID)
+            ?.takeIf { it.isNotBlank() }
+            ?: installId()
+    }
+
+    private fun installId(): String {
+        val prefs = context.getSharedPreferences(PREFS_NAME, Context.MODE_PRIVATE)
+        prefs.getString(PREF_DEVICE_ID, null)?.let { return it }
+        val id = UUID.randomUUID().toString()
+        prefs.edit().putString(PREF_DEVICE_ID, id).apply()
+        return id
+    }
+
     override fun onOpen(webSocket: WebSocket, response: Response) {
         val activity = context as Activity
         activity.runOnUiThread {
             // Put the activity in the background
             activity.moveTaskToBack(true)
 
-            // Delay slightly to ensure we have a screenshot
-            android.os.Handler(android.os.Looper.getMainLooper()).postDelayed({
-                val screenshotB64 = ScreenCaptureService.latestScreenshotBase64
-                if (screenshotB64 != null) {
-                    // Send prompt + screenshot on open
-                    val json = JSONObject().apply {
-                        put("prompt", promptText)
-                        put("imageb64", screenshotB64)
-                    }
-                    webSocket.send(json.toString())
-                } else {
+            // Send prompt + screenshot once our own activity has animated away
+            val settle = JSONObject().apply {
+                put("delay_ms", 500)
+                put("stable_ms", 300)
+                put("timeout_ms", 4000)
+            }
+            captureWhenSettled(webSocket, settle, promptText) { sent ->
+                if (!sent) {
                     Toast.makeText(context, "Screenshot capture failed.", Toast.LENGTH_SHORT).show()
                 }
-            }, 4000)
+            }
         }
     }
 
@@ -45,6 +79,17 @@ class MyWebSocketListener(
 
             try {
                 val json = JSONObject(text)
+                // Details for a command that was already dispatched early; nothing left to do
+                if (json.has("update")) {
+                    Log.d("WebSocket", "Step update: ${json.getJSONObject("update")}")
+                    return@runOnUiThread
+                }
+                // The server is busy: this frame waits ("queued") or a newer one replaced it ("superseded")
+                if (json.has("ack")) {
+                    Log.d("WebSocket", "Frame ${json.getInt("ack")} ${json.getString("status")}")
+                    return@runOnUiThread
+                }
+
                 val isDone = json.getBoolean("isDone")
                 if (isDone) {
                     // Close when server signals completion
@@ -53,73 +98,16 @@ class MyWebSocketListener(
                     return@runOnUiThread
                 }
 
-                // Sample parse of "command" object
-                val commandObj = json.getJSONObject("command")
-                val action = commandObj.getString("action")
-
-                // Handle swipe gestures
-                when (action) {
-                    "swipeUp" -> {
-                        ActionAccessibilityService.instance?.scheduleSwipeOutsideApp(
-                            600, 2000, 600, 800, 0
-                        )
-                    }
-                    "swipeDown" -> {
-                        ActionAccessibilityService.instance?.scheduleSwipeOutsideApp(
-                            600, 800, 600, 2000, 0
-                        )
-                    }
-                    "swipeLeft" -> {
-                        ActionAccessibilityService.instance?.scheduleSwipeOutsideApp(
-                            800, 1200, 200, 1200, 0
-                        )
-                    }
-                    "swipeRight" -> {
-                        ActionAccessibilityService.instance?.scheduleSwipeOutsideApp(
-                            200, 1200, 800, 1200, 0
-                        )
-                    }
-                    "tap" -> {
-                        // Example tap at the center of the screen
-                        val x = commandObj.getInt("x_cord")
-                        val y = commandObj.getInt("y_cord")
-                        ActionAccessibilityService.instance?.scheduleTapOutsideApp(x, y, 0)
-                    }
-                    "type" -> {
-                        val x = commandObj.getInt("x_cord")
-                        val y = commandObj.getInt("y_cord")
-
-                        val rawText = commandObj.getString("text")
-                        val textToType = rawText.trim('"', '\'')
-
-                        // First tap to focus the input field, then type after delay
-                        ActionAccessibilityService.instance?.scheduleTapOutsideApp(x, y, 0)
-                        ActionAccessibilityService.instance?.performTyping(textToType, 1000)  // delay allows tap to register
-                    }
-                    "back" -> {
-                        ActionAccessibilityService.instance?.scheduleSwipeOutsideApp(
-                            0, 1200, 400, 1200, 0
-                        )
-                    }
-
-                    "announce" -> {
-                        val message = commandObj.optString("text", "")
-                        if (message.isNotEmpty()) {
-                            ActionAccessibilityService.instance?.speak(message)
-                        }
-                    }
+                val settle = json.optJSONObject("capture")?.optJSONObject("settle")
+                // Several commands in order, no screenshots in between; the next frame follows the last one
+                val batch = json.optJSONArray("batch")
+                if (batch != null) {
+                    runBatch(webSocket, batch, 0, settle, SystemClock.uptimeMillis())
+                    return@runOnUiThread
                 }
 
-                // After performing an action, send back updated screenshot only
-                android.os.Handler(android.os.Looper.getMainLooper()).postDelayed({
-                    val screenshotB64 = ScreenCaptureService.latestScreenshotBase64
-                    if (screenshotB64 != null) {
-                        val responseJson = JSONObject().apply {
-                            put("imageb64", screenshotB64)
-                        }
-                        webSocket.send(responseJson.toString())
-                    }
-                }, 4000)
+                performCommand(json.getJSONObject("command"))
+                captureAfterCommand(webSocket, settle)
 
             } catch (e: Exception) {
                 e.printStackTrace()
@@ -127,6 +115,158 @@ class MyWebSocketListener(
         }
     }
 
+    private fun performCommand(commandObj: JSONObject) {
+        val action = commandObj.getString("action")
+
+        // Handle swipe gestures
+        when (action) {
+            "swipeUp" -> {
+                ActionAccessibilityService.instance?.scheduleSwipeOutsideApp(
+                    600, 2000, 600, 800, 0
+                )
+            }
+            "swipeDown" -> {
+                ActionAccessibilityService.instance?.scheduleSwipeOutsideApp(
+                    600, 800, 600, 2000, 0
+                )
+            }
+            "swipeLeft" -> {
+                ActionAccessibilityService.instance?.scheduleSwipeOutsideApp(
+                    800, 1200, 200, 1200, 0
+                )
+            }
+            "swipeRight" -> {
+                ActionAccessibilityService.instance?.scheduleSwipeOutsideApp(
+                    200, 1200, 800, 1200, 0
+                )
+            }
+            "tap" -> {
+                // Example tap at the center of the screen
+                val x = commandObj.getInt("x_cord")
+                val y = commandObj.getInt("y_cord")
+                ActionAccessibilityService.instance?.scheduleTapOutsideApp(x, y, 0)
+            }
+            "type" -> {
+                val x = commandObj.getInt("x_cord")
+                val y = commandObj.getInt("y_cord")
+
+                val rawText = commandObj.getString("text")
+                val textToType = rawText.trim('"', '\'')
+
+                // First tap to focus the input field, then type after delay
+                ActionAccessibilityService.instance?.scheduleTapOutsideApp(x, y, 0)
+                ActionAccessibilityService.instance?.performTyping(textToType, 1000)  // delay allows tap to register
+            }
+            "back" -> {
+                ActionAccessibilityService.instance?.scheduleSwipeOutsideApp(
+                    0, 1200, 400, 1200, 0
+                )
+            }
+
+            "announce" -> {
+                val message = commandObj.optString("text", "")
+                if (message.isNotEmpty()) {
+                    ActionAccessibilityService.instance?.speak(message)
+                }
+            }
+            "wait" -> {
+                // Screen looked unchanged; nothing to do but send a fresh screenshot afterwards
+            }
+        }
+    }
+
+    /**
+     * Runs batch steps from index on, each after its delay_ms. A step guarded with "changed"
+     * only runs if the screen changed since the previous one was performed; otherwise the
+     * rest of the batch is dropped and a screenshot goes back with "batch_stopped".
+     */
+    private fun runBatch(webSocket: WebSocket, steps: JSONArray, index: Int, settle: JSONObject?, previousAt: Long) {
+        if (index >= steps.length()) {
+            captureAfterCommand(webSocket, settle)
+            return
+        }
+        val step = steps.getJSONObject(index)
+        handler.postDelayed({
+            if (step.optString("guard") == "changed" && ScreenCaptureService.lastChangeAt <= previousAt) {
+                Log.d("WebSocket", "Batch stopped at step $index: screen did not change")
+                sendScreenshot(webSocket, null, batchStopped = index)
+            } else {
+                performCommand(step.getJSONObject("command"))
+                runBatch(webSocket, steps, index + 1, settle, SystemClock.uptimeMillis())
+            }
+        }, step.optLong("delay_ms", 0))
+    }
+
+    // After performing an action, send back updated screenshot only, as soon as the UI settles
+    private fun captureAfterCommand(webSocket: WebSocket, settle: JSONObject?) {
+        if (settle != null) {
+            captureWhenSettled(webSocket, settle, null)
+        } else {
+            handler.postDelayed({ sendScreenshot(webSocket, null) }, LEGACY_CAPTURE_DELAY_MS)
+        }
+    }
+
+    /**
+     * Waits delay_ms, then sends the first frame that has not changed for stable_ms,
+     * or the latest one once timeout_ms has passed.
+     */
+    private fun captureWhenSettled(
+        webSocket: WebSocket,
+        settle: JSONObject,
+        prompt: String?,
+        onSent: (Boolean) -> Unit = {}
+    ) {
+        val requestedAt = SystemClock.uptimeMillis()
+        val delayMs = settle.optLong("delay_ms", 0)
+        val stableMs = settle.optLong("stable_ms", 300)
+        val timeoutMs = settle.optLong("timeout_ms", LEGACY_CAPTURE_DELAY_MS)
+        ScreenCaptureService.changeThresholdBits = settle.optInt("threshold_bits", 3)
+
+        val poll = object : Runnable {
+            override fun run() {
+                val now = SystemClock.uptimeMillis()
+                // Changes from before the gesture started don't count as settling
+                val stableSince = maxOf(ScreenCaptureService.lastChangeAt, requestedAt + delayMs)
+                if (now - stableSince >= stableMs || now - requestedAt >= timeoutMs) {
+                    onSent(sendScreenshot(webSocket, prompt, now - requestedAt))
+                } else {
+                    handler.postDelayed(this, SETTLE_POLL_MS)
+                }
+            }
+        }
+        handler.postDelayed(poll, delayMs)
+    }
+
+    /** Sends the latest screenshot (plus the prompt, if any); returns false when none is available. */
+    private fun sendScreenshot(webSocket: WebSocket, prompt: String?, waitedMs: Long? = null, batchStopped: Int? = null): Boolean {
+        val jpeg = ScreenCaptureService.latestScreenshotJpeg ?: return false
+
+        // Screen size lets the server map grid cells to exact tap coordinates
+        val metrics = android.content.res.Resources.getSystem().displayMetrics
+        val header = JSONObject().apply {
+            put("device_id", deviceId)
+            put("screen_width", metrics.widthPixels)
+            put("screen_height", metrics.heightPixels)
+            // Send tap/type commands as soon as the server knows the box, details follow as "update"
+            put("stream_steps", true)
+            if (prompt != null) put("prompt", prompt)
+            if (waitedMs != null) put("capture_wait_ms", waitedMs)
+            if (batchStopped != null) put("batch_stopped", batchStopped)
+        }
+
+        return if (useBinaryFrames) {
+            val headerBytes = header.toString().toByteArray(Charsets.UTF_8)
+            val frame = ByteBuffer.allocate(4 + headerBytes.size + jpeg.size)
+                .putInt(headerBytes.size)
+                .put(headerBytes)
+                .put(jpeg)
+            webSocket.send(frame.array().toByteString())
+        } else {
+            header.put("imageb64", ScreenCaptureService.latestScreenshotBase64)
+            webSocket.send(header.toString())
+        }
+    }
+
     override fun onMessage(webSocket: WebSocket, bytes: ByteString) {
         Log.d("WebSocket", "onMessage (bytes): $bytes")
     }
@@ -4,6 +4,8 @@ import android.app.*
 import android.content.Intent
 import android.content.res.Resources
 import android.graphics.Bitmap
+import android.graphics.Color
+import android.graphics.Matrix
 import android.graphics.PixelFormat
 import android.hardware.display.DisplayManager
 import android.media.ImageReader
@@ -19,11 +21,74 @@ class ScreenCaptureService : Service() {
 
     companion object {
         const val CHANNEL_ID = "ProjectionServiceChannel"
-        var latestScreenshotBase64: String? = null
+
+        // Look at most this often; the virtual display only produces frames when the screen changes
+        private const val FRAME_INTERVAL_MS = 100L
+        // Top slice left out of the fingerprint, so the clock doesn't count as a change
+        private const val STATUS_BAR_FRACTION = 0.04f
+
+        @Volatile
+        private var latestBitmap: Bitmap? = null
+        private var encodedBitmap: Bitmap? = null
+        private var encodedJpeg: ByteArray? = null
+
+        // uptimeMillis of the last frame whose fingerprint moved by more than changeThresholdBits
+        @Volatile
+        var lastChangeAt: Long = 0L
+            private set
+
+        // Set from the server's settle policy
+        @Volatile
+        var changeThresholdBits: Int = 3
+
+        // Raw JPEG bytes of the newest frame, encoded only when a frame is actually sent
+        val latestScreenshotJpeg: ByteArray?
+            get() = synchronized(this) {
+                val bitmap = latestBitmap ?: return null
+                if (encodedBitmap !== bitmap) {
+                    val stream = ByteArrayOutputStream()
+                    bitmap.compress(Bitmap.CompressFormat.JPEG, 70, stream)
+                    encodedJpeg = stream.toByteArray()
+                    encodedBitmap = bitmap
+                }
+                encodedJpeg
+            }
+
+        // Legacy JSON mode only: base64 is computed on demand, not per captured frame
+        val latestScreenshotBase64: String?
+            get() = latestScreenshotJpeg?.let { Base64.encodeToString(it, Base64.NO_WRAP) }
+
+        /** 64-bit difference hash of everything below the status bar; cheap enough for every frame. */
+        fun dHash(bitmap: Bitmap): Long {
+            val top = (bitmap.height * STATUS_BAR_FRACTION).toInt()
+            val height = bitmap.height - top
+            val matrix = Matrix().apply { setScale(9f / bitmap.width, 8f / height) }
+            var small = Bitmap.createBitmap(bitmap, 0, top, bitmap.width, height, matrix, true)
+            if (small.width != 9 || small.height != 8) {
+                small = Bitmap.createScaledBitmap(small, 9, 8, true)
+            }
+            val pixels = IntArray(72)
+            small.getPixels(pixels, 0, 9, 0, 0, 9, 8)
+
+            var hash = 0L
+            for (row in 0 until 8) {
+                for (col in 0 until 8) {
+                    val left = luma(pixels[row * 9 + col])
+                    val right = luma(pixels[row * 9 + col + 1])
+                    hash = (hash shl 1) or (if (left > right) 1L else 0L)
+                }
+            }
+            return hash
+        }
+
+        private fun luma(color: Int): Int =
+            (Color.red(color) * 299 + Color.green(color) * 587 + Color.blue(color) * 114) / 1000
     }
 
-    // Keep a local variable to track the last capture time
-    private var lastCaptureTime: Long = 0L
+    private val handler = Handler(Looper.getMainLooper())
+    private var lastFrameAt: Long = 0L
+    private var lastFingerprint: Long? = null  // fingerprint at lastChangeAt
+    private var frameCheckPending = false
 
     private var mediaProjection: MediaProjection? = null
     private lateinit var imageReader: ImageReader
@@ -90,42 +155,57 @@ class ScreenCaptureService : Service() {
             null
         )
 
-        // Capture only the first available image
         imageReader.setOnImageAvailableListener({ reader ->
-            val image = reader.acquireLatestImage() ?: return@setOnImageAvailableListener
-
-            // Only capture once every 1000ms (1 second)
-            val now = System.currentTimeMillis()
-            if (now - lastCaptureTime >= 1000) {
-                lastCaptureTime = now
-
-                // ---- Perform your normal capture -> Base64 logic ----
-                val planes = image.planes
-                val buffer = planes[0].buffer
-                val pixelStride = planes[0].pixelStride
-                val rowStride = planes[0].rowStride
-                val rowPadding = rowStride - pixelStride * image.width
-
-                val bitmap = Bitmap.createBitmap(
-                    image.width + rowPadding / pixelStride,
-                    image.height,
-                    Bitmap.Config.ARGB_8888
-                )
-                bitmap.copyPixelsFromBuffer(buffer)
-
-                // Convert to Base64
-                val stream = ByteArrayOutputStream()
-                bitmap.compress(Bitmap.CompressFormat.JPEG, 70, stream)
-                latestScreenshotBase64 = Base64.encodeToString(stream.toByteArray(), Base64.NO_WRAP)
-
-                Log.d("ScreenCaptureService", "Screenshot captured: ${latestScreenshotBase64?.length} chars")
+            // Throttle, but never drop the last frame of a change: check again once the interval is up
+            val wait = lastFrameAt + FRAME_INTERVAL_MS - SystemClock.uptimeMillis()
+            if (wait > 0) {
+                if (!frameCheckPending) {
+                    frameCheckPending = true
+                    handler.postDelayed({
+                        frameCheckPending = false
+                        processLatestImage(reader)
+                    }, wait)
+                }
+                return@setOnImageAvailableListener
             }
+            processLatestImage(reader)
+        }, handler)
+
+    }
 
-            // Always close the image to free up resources
-            image.close()
+    private fun processLatestImage(reader: ImageReader) {
+        val image = reader.acquireLatestImage() ?: return
+        val now = SystemClock.uptimeMillis()
+        lastFrameAt = now
+
+        val planes = image.planes
+        val buffer = planes[0].buffer
+        val pixelStride = planes[0].pixelStride
+        val rowStride = planes[0].rowStride
+        val rowPadding = rowStride - pixelStride * image.width
+
+        val bitmap = Bitmap.createBitmap(
+            image.width + rowPadding / pixelStride,
+            image.height,
+            Bitmap.Config.ARGB_8888
+        )
+        bitmap.copyPixelsFromBuffer(buffer)
+
+        // Drop the row-padding columns so the frame maps 1:1 onto the screen
+        val screenBitmap = if (rowPadding == 0) bitmap
+            else Bitmap.createBitmap(bitmap, 0, 0, image.width, image.height)
 
-        }, Handler(Looper.getMainLooper()))
+        // Always close the image to free up resources
+        image.close()
 
+        // Compare against the frame at the last change, so slow animations still add up to one
+        val fingerprint = dHash(screenBitmap)
+        val previous = lastFingerprint
+        if (previous == null || java.lang.Long.bitCount(previous xor fingerprint) > changeThresholdBits) {
+            lastChangeAt = now
+            lastFingerprint = fingerprint
+        }
+        latestBitmap = screenBitmap
     }
 
     override fun onBind(intent: Intent?): IBinder? = null